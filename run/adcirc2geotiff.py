@@ -16,25 +16,63 @@ import sys
 import argparse
 import json
 import warnings
+import shutil
 import subprocess
+import time
 from functools import wraps
+from multiprocessing.pool import Pool
 # from datetime import datetime
 # from datetime import timedelta
 
+import numpy as np
 import netCDF4 as nc
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
 from loguru import logger
 
-# Import QGIS modules
-from qgis.core import (
-    Qgis,
-    QgsApplication,
-    QgsMeshLayer,
-    QgsMeshDatasetIndex,
-    QgsMeshUtils,
-    QgsProject,
-    QgsRasterFileWriter,
-    QgsRectangle
-)
+import meshraster
+import weightcache
+import cogutils
+import metrics
+import manifest
+import bandstats
+
+# Import QGIS modules, which are only needed by the qgis engine
+try:
+    from qgis.core import (
+        Qgis,
+        QgsApplication,
+        QgsCoordinateReferenceSystem,
+        QgsMeshLayer,
+        QgsMeshDatasetIndex,
+        QgsMeshUtils,
+        QgsProject,
+        QgsRasterBlock,
+        QgsRasterFileWriter,
+        QgsRectangle
+    )
+    from qgis.PyQt.QtCore import QByteArray
+
+    # QGIS data types of the output data types
+    qgisDataTypes = {'float64': Qgis.Float64, 'float32': Qgis.Float32, 'int16': Qgis.Int16,
+                     'uint16': Qgis.UInt16}
+except ImportError:
+    Qgis = None
+
+# Define the extents the ADCIRC mesh is converted to, one tiff file for each
+inputExtents = ['-97.85833,-82.288499,32.0,45.83612',
+                '-82.5,-60.040029999999994,36.0,45.83612',
+                '-97.85833,-81.0,24.28441,32.0',
+                '-82.3,-74.0,24.28441,36.555922',
+                '-74.467152,-60.040029999999994,23.0,36.83612',
+                '-97.85833,-77.0,15.0,24.313514',
+                '-77.85833,-60.040029999999994,15.0,24.313514',
+                '-97.85833,-77.0,7.909559999999999,15.83612',
+                '-77.85833,-60.040029999999994,7.909559999999999,15.83612']
+
+# Define map units per pixel of each extent
+mapUnitsPP = [0.01, 0.005, 0.001, 0.001, 0.005, 0.005, 0.005, 0.005, 0.005]
 
 # Ignore warning function
 def ignore_warnings(f):
@@ -102,22 +140,362 @@ def getParameters(**kwargs):
 
     return json.loads(parms)
 
+# Default options of the numpy engine
+defaultOptions = {'cacheDir': None, 'cacheMaxBytes': None, 'workers': 1,
+                  'blockSize': 512, 'memoryBudget': 1024*1024**2, 'cog': False,
+                  'tmpDir': None, 'timeSteps': None, 'ingest': 'full', 'metricsDir': None,
+                  'resume': False, 'adaptive': False, 'minMapUnitPP': 0.001,
+                  'maxMapUnitPP': 0.016, 'mosaic': False, 'mosaicMapUnitPP': None,
+                  'webMercator': False, 'webZoom': None, 'dataType': 'float64',
+                  'scale': None, 'offset': None, 'compress': 'DEFLATE', 'predictor': None,
+                  'maxZError': None, 'unitRows': 2048}
+
+# Options that do not change the outputs, which each shard of a sharded run takes from
+# its own command line instead of the plan
+shardRuntimeOptions = ['cacheDir', 'cacheMaxBytes', 'workers', 'memoryBudget', 'tmpDir',
+                       'metricsDir', 'resume', 'ingest']
+
+# Get the encoding and compression of the output rasters
+def getOutputEncoding(options):
+    '''
+    This function returns the encoding of the output rasters, from cogutils.getEncoding,
+    and the compression options of the COGs, from cogutils.getCompression
+    '''
+    encoding = cogutils.getEncoding(options['dataType'], options['scale'], options['offset'])
+    compression = cogutils.getCompression(options['compress'], options['predictor'],
+                                          options['maxZError'], options['dataType'])
+    return encoding, compression
+
+# Get the timesteps to render
+def getTimeSteps(timeStepsSpec, timeStepCount):
+    '''
+    This function returns the list of timesteps to render from a timesteps option,
+    which is None for the first timestep only, all for every timestep, or a
+    start:stop:step range
+    '''
+    if timeStepsSpec is None:
+        return [0]
+    if timeStepsSpec == 'all':
+        return list(range(timeStepCount))
+
+    rangeParts = [int(part) if part else None for part in timeStepsSpec.split(':')]
+    if len(rangeParts) == 1:
+        rangeParts = [rangeParts[0], rangeParts[0]+1]
+    timeSteps = list(range(timeStepCount))[slice(*rangeParts)]
+    if len(timeSteps) == 0:
+        raise Exception('The timesteps '+timeStepsSpec+' select none of the '+
+                        str(timeStepCount)+' timesteps.')
+    return timeSteps
+
+# Define the raster grid of an extent
+def getRasterGrid(inputExtent, mapUnitPP, options):
+    '''
+    This function returns the raster grid of an extent, which is on the Web Mercator
+    tile grid with the webMercator option, so the raster does not need to be reprojected
+    when it is written to a web optimized COG
+    '''
+    if options['webMercator']:
+        return meshraster.getMercatorGrid(inputExtent, mapUnitPP, options['webZoom'])
+    return meshraster.getGrid(inputExtent, mapUnitPP)
+
+# Convert mesh to raster with NumPy and save as a GeoTiff
+def exportRasterNumpy(inputList, mesh, values, options, rows=None):
+    '''
+    This function is used to export raster without QGIS, using barycentric
+    interpolation over the mesh triangles. It takes the same inputList as
+    mesh2tiff.exportRaster, and the mesh and node values from meshraster.
+    The raster is rendered and written in windows of whole blocks, so memory
+    use is bounded by options['memoryBudget'] and not by the extent size.
+    If rows (row0, row1) is given, only those rows of the extent grid are
+    rendered, which is a shard of the raster.
+    '''
+
+    # Get parameters
+    parameters = getParameters(inputDirP = inputList[0], inputFileP = inputList[1],
+                               outputDirP = inputList[2], outputFileP = inputList[3],
+                               inputExtentP = inputList[4], timeStepP = inputList[5],
+                               mapUnitPPP = inputList[6])
+    output_layer = parameters['OUTPUT_RASTER']
+
+    # Define the raster grid, and the windows it is rendered in
+    logger.info('Get parameters for '+parameters['INPUT_LAYER']+'.')
+    grid = getRasterGrid(parameters['INPUT_EXTENT'], parameters['MAP_UNITS_PER_PIXEL'], options)
+    if rows is not None:
+        grid = meshraster.getSubGrid(grid, rows[0], rows[1])
+    encoding, compression = getOutputEncoding(options)
+    maxPixels, chunkSize = meshraster.getWindowLimits(options['memoryBudget'])
+    windows = list(meshraster.getWindows(grid, options['blockSize'], maxPixels))
+
+    labels = {'input': inputList[1], 'subset': inputList[3].split('.')[1],
+              'output': inputList[3]}
+
+    # Get cached weights for the whole grid, which are memory mapped
+    if options['cacheDir'] is not None:
+        with metrics.measure('weights', **labels) as record:
+            elemIndex, weights = weightcache.getWeights(mesh, grid, options['cacheDir'],
+                                                        options['cacheMaxBytes'], windows,
+                                                        chunkSize)
+            record['pixels'] = grid['width']*grid['height']
+
+    # Rasters written as COGs are staged in tmpDir, in a tiled and compressed GeoTiff
+    if options['cog']:
+        rasterPathFile = os.path.join(options['tmpDir'], inputList[3])
+        profile = cogutils.getStagingProfile(options['blockSize'], encoding['dataType'])
+    else:
+        rasterPathFile = output_layer
+        profile = {'driver': 'GTiff', 'tiled': True, 'blockxsize': options['blockSize'],
+                   'blockysize': options['blockSize'], 'sparse_ok': True}
+
+    # Regrid mesh to raster, and write each window to the GeoTiff file. Blocks with
+    # no data are not written, and read back as nodata.
+    skippedBlocks = nodataPixels = clippedPixels = 0
+    stats = bandstats.newStats(*bandstats.getValueRange(values))
+    logger.info('Regrid mesh '+inputList[0]+inputList[1]+' to raster Geotiff ('+
+                rasterPathFile+') file in '+str(len(windows))+' windows.')
+    with metrics.measure('render', **labels) as record, rasterio.open(
+            rasterPathFile, 'w', width=grid['width'], height=grid['height'], count=1,
+            dtype=encoding['dataType'], crs=grid['crs'],
+            transform=from_origin(grid['xmin'], grid['ymax'], grid['resX'], grid['resY']),
+            nodata=encoding['nodata'], **profile) as dst:
+        for row0, col0, nrows, ncols in windows:
+            if options['cacheDir'] is not None:
+                windowElemIndex = elemIndex[row0:row0+nrows, col0:col0+ncols]
+                windowWeights = weights[row0:row0+nrows, col0:col0+ncols]
+            else:
+                windowElemIndex, windowWeights = meshraster.computeWeights(
+                    mesh, grid['xs'][col0:col0+ncols], grid['ys'][row0:row0+nrows], chunkSize)
+
+            # Skip windows no element touches, which are left unwritten as sparse blocks
+            if not (windowElemIndex >= 0).any():
+                skippedBlocks = skippedBlocks + len(meshraster.getBlocks(
+                                (row0, col0, nrows, ncols), options['blockSize']))
+                nodataPixels = nodataPixels + nrows*ncols
+                continue
+
+            # Write the blocks of the window that have data
+            raster = meshraster.interpolate(mesh, values, windowElemIndex, windowWeights)
+            for blockRow, blockCol, blockRows, blockCols in meshraster.getBlocks(
+                    (row0, col0, nrows, ncols), options['blockSize']):
+                block = raster[blockRow:blockRow+blockRows, blockCol:blockCol+blockCols]
+                blockNodata = int(np.isnan(block).sum())
+                nodataPixels = nodataPixels + blockNodata
+                if blockNodata == block.size:
+                    skippedBlocks = skippedBlocks + 1
+                    continue
+                bandstats.updateStats(stats, block)
+                block, blockClipped = cogutils.encodeBlock(block, encoding)
+                clippedPixels = clippedPixels + blockClipped
+                dst.write(block, 1, window=Window(col0+blockCol, row0+blockRow,
+                                                  blockCols, blockRows))
+
+        # Embed the band statistics of the blocks in the GeoTiff file
+        dst.update_tags(1, **bandstats.getBandTags(
+                        bandstats.getSummary(stats, grid['width']*grid['height']),
+                        encoding['scale'], encoding['offset']))
+
+        record.update({'pixels': grid['width']*grid['height'], 'nodataPixels': nodataPixels,
+                       'outputPathFiles': [rasterPathFile]})
+
+    raster = block = windowElemIndex = windowWeights = None
+    cogutils.setScaleOffset(rasterPathFile, encoding)
+    logger.info('Skipped '+str(skippedBlocks)+' blocks with no data.')
+    if clippedPixels > 0:
+        logger.warning('Clipped '+str(clippedPixels)+' values of '+rasterPathFile+
+                       ' to the range of '+encoding['dataType']+'.')
+
+    # Write the staged raster to a COG
+    if options['cog']:
+        output_layer = cogutils.getCogPathFile(output_layer)
+        with metrics.measure('cog', **labels) as record:
+            cogutils.cogTranslate(rasterPathFile, output_layer,
+                                  webOptimized=not options['webMercator'],
+                                  blockSize=options['blockSize'], compression=compression)
+            record.update({'pixels': grid['width']*grid['height'],
+                           'outputPathFiles': [output_layer]})
+        os.remove(rasterPathFile)
+
+    logger.info('Regridded mesh data in '+inputList[0]+inputList[1]+
+                ' to '+encoding['dataType']+' grid, and saved to tiff ('+output_layer+') file.')
+
+# Shared state of exportRasterNumpy worker processes
+workerState = {}
+
+# Initialize an exportRasterNumpy worker process
+def initWorker(sharedDir, options):
+    '''
+    This function memory maps the mesh shared by the parent process
+    '''
+    workerState['mesh'] = meshraster.openSharedMesh(sharedDir)
+    workerState['sharedDir'] = sharedDir
+    workerState['options'] = options
+
+# Run exportRasterNumpy in a worker process
+def exportRasterWorker(inputList):
+    '''
+    This function runs exportRasterNumpy with the worker process shared state, and the
+    node values of the inputList timestep shared by the parent process
+    '''
+    values = meshraster.openSharedValues(workerState['sharedDir'], inputList[5])
+    exportRasterNumpy(inputList, workerState['mesh'], values, workerState['options'])
+    return inputList
+
+# Build the interpolation weights of an extent in a worker process
+def buildWeightsWorker(inputList):
+    '''
+    This function puts the weights of the grid of an inputList in the weights cache,
+    with the worker process shared state, so the exportRasterWorker runs of its
+    timesteps only load them
+    '''
+    options = workerState['options']
+    grid = getRasterGrid(inputList[4], inputList[6], options)
+    maxPixels, chunkSize = meshraster.getWindowLimits(options['memoryBudget'])
+    windows = list(meshraster.getWindows(grid, options['blockSize'], maxPixels))
+    with metrics.measure('weights', input=inputList[1], subset=inputList[3].split('.')[1],
+                         output=inputList[3]) as record:
+        weightcache.getWeights(workerState['mesh'], grid, options['cacheDir'],
+                               options['cacheMaxBytes'], windows, chunkSize)
+        record['pixels'] = grid['width']*grid['height']
+    return inputList
+
+# Convert mesh to rasters for one extent, reading only the mesh inside the extent
+def exportExtentNumpy(extentLists, options):
+    '''
+    This function runs exportRasterNumpy for the inputLists of one extent, which differ
+    only by timestep. It reads only the elements and nodes inside the extent, and only
+    the node values of those nodes.
+    '''
+    inputPathFile = extentLists[0][0]+extentLists[0][1]
+    with metrics.measure('load', input=extentLists[0][1],
+                         subset=extentLists[0][3].split('.')[1]):
+        mesh = meshraster.loadMeshSubset(inputPathFile, extentLists[0][4])
+    frames = meshraster.iterVariable(inputPathFile, [inputList[5] for inputList in extentLists],
+             meshraster.getFrameChunk(max(len(mesh['x']), 1), options['memoryBudget']),
+             nodeIndex=mesh['nodeIndex'])
+
+    for frameValues in frames:
+        for inputList in extentLists:
+            if inputList[5] in frameValues:
+                exportRasterNumpy(inputList, mesh, frameValues[inputList[5]], options)
+
+    return extentLists[0][4]
+
+# Run exportExtentNumpy in a worker process
+def exportExtentWorker(job):
+    '''
+    This function runs exportExtentNumpy with the inputLists and options in job
+    '''
+    return exportExtentNumpy(*job)
+
+# Define the outputs of an input file
+def getInputsList(inputDirM, outputDirM, inputFileM, options):
+    '''
+    This function returns the inputList of each output of an input file, one for each
+    extent and timestep, or one for each timestep with the mosaic option, the subset
+    inputLists each mosaic output file has views of, and the timesteps
+    '''
+    # Define timesteps
+    timeSteps = getTimeSteps(options['timeSteps'],
+                             meshraster.getTimeStepCount(inputDirM+inputFileM))
+
+    # Define map units per pixel of each extent. With the adaptive option, they are
+    # derived from the size of the mesh elements in each extent.
+    extentMapUnitsPP = mapUnitsPP
+    if options['adaptive']:
+        elementSizes = meshraster.getElementSizes(inputDirM+inputFileM)
+        extentMapUnitsPP = [meshraster.getAdaptiveResolution(elementSizes, inputExtent,
+                            options['minMapUnitPP'], options['maxMapUnitPP'])
+                            for inputExtent in inputExtents]
+        elementSizes = None
+        logger.info('Adaptive map units per pixel of the extents: '+
+                    ', '.join(str(mapUnitPP) for mapUnitPP in extentMapUnitsPP))
+
+    # Define input_list and outputFile index
+    inputs_list = []
+    i = 0
+
+    # Add variables to input_list. When timesteps are selected, each timestep
+    # has its own output file, named with the timestep.
+    logger.info('Create inputs_list, which has multiple extents, and '+
+                str(len(timeSteps))+' timeSteps')
+    for inputExtent in inputExtents:
+        mapUnitPP = extentMapUnitsPP[i]
+
+        for timeStep in timeSteps:
+            outputFile = getOutputFile(inputFileM, 'subset'+str(i), timeStep,
+                                       options['timeSteps'] is not None)
+            inputs_list.append([inputDirM, inputFileM, outputDirM, outputFile,
+                                inputExtent, timeStep, mapUnitPP])
+
+        i = i + 1
+
+    # With the mosaic option, render one raster of all extents on a common grid, so
+    # each pixel is rendered once, and write the subsets as windowed views of it. The
+    # mosaic covers the bounding box of all extents, so its pixel size is not derived
+    # from the extents: at the finest extent pixel size it has several times the pixels
+    # of all the subsets.
+    views = {}
+    if options['mosaic']:
+        mosaicMapUnitPP = options['mosaicMapUnitPP']
+        if mosaicMapUnitPP is None:
+            logger.error('The mosaic option requires mosaicMapUnitPP, the pixel size of '
+                         'the mosaic, so the program will exit')
+            sys.exit(1)
+        mosaicPixels = meshraster.getGridSize(getMosaicExtent(), mosaicMapUnitPP)
+        subsetPixels = sum(meshraster.getGridSize(inputExtent, mapUnitPP) for inputExtent,
+                           mapUnitPP in zip(inputExtents, extentMapUnitsPP))
+        logger.info('The mosaic has '+str(mosaicPixels)+' pixels, and the subsets have '+
+                    str(subsetPixels)+' pixels.')
+        if mosaicPixels > subsetPixels:
+            logger.warning('The mosaic has more pixels than the subsets at mosaicMapUnitPP '+
+                           str(mosaicMapUnitPP)+', so it takes more rendering than them.')
+        mosaicLists = []
+        for timeStep in timeSteps:
+            outputFile = getOutputFile(inputFileM, 'mosaic', timeStep,
+                                       options['timeSteps'] is not None)
+            mosaicLists.append([inputDirM, inputFileM, outputDirM, outputFile,
+                                getMosaicExtent(), timeStep, mosaicMapUnitPP])
+        for mosaicList in mosaicLists:
+            views[mosaicList[3]] = [inputList for inputList in inputs_list
+                                    if inputList[5] == mosaicList[5]]
+        inputs_list = mosaicLists
+
+    return inputs_list, views, timeSteps
+
+# Write the subsets as windowed views of a mosaic output file
+def writeWindowViews(mosaicPathFile, viewLists):
+    '''
+    This function writes a VRT file for each subset inputList in viewLists, which is the
+    window of mosaicPathFile covering the subset extent
+    '''
+    for inputList in viewLists:
+        xmin, xmax, ymin, ymax = [float(value) for value in inputList[4].split(',')]
+        cogutils.writeWindowVrt(os.path.splitext(inputList[2]+inputList[3])[0]+'.vrt',
+                                mosaicPathFile, (xmin, ymin, xmax, ymax))
+    logger.info('Wrote subset views of '+mosaicPathFile+'.')
+
 @ignore_warnings
 class mesh2tiff:
     '''
     This class has the functions that are used to convert the ADCIRC mesh to a geoTIFF
     '''
-    def __init__(self, inputDirM, outputDirM, inputFileM, tmpDir):
-        # Open layer from INPUT_LAYER
-        logger.info('Open layer from input '+inputDirM+inputFileM+' file.')
-        # inputMeshFile = 'Ugrid:'+'"'+inputDirM+inputFileM+'"'
-        # meshFile = inputFileM.strip().split('/')[-1]
-        # meshLayer = inputFileM.strip().split('/')[-1].split('.')[0]
-        self.layer = QgsMeshLayer('Ugrid:'+'"'+inputDirM+inputFileM+'"',
-                                  inputFileM.strip().split('/')[-1].split('.')[0], 'mdal')
-
+    def __init__(self, inputDirM, outputDirM, inputFileM, tmpDir, engine='qgis', options=None,
+                 mesh=None):
         # Define self parameters
         self.tmpDir = tmpDir
+        self.engine = engine
+        self.options = dict(defaultOptions, **(options or {}))
+        self.options['tmpDir'] = tmpDir
+
+        if self.engine == 'qgis':
+            # Open layer from INPUT_LAYER
+            logger.info('Open layer from input '+inputDirM+inputFileM+' file.')
+            # inputMeshFile = 'Ugrid:'+'"'+inputDirM+inputFileM+'"'
+            # meshFile = inputFileM.strip().split('/')[-1]
+            # meshLayer = inputFileM.strip().split('/')[-1].split('.')[0]
+            with metrics.measure('load', input=inputFileM):
+                self.layer = QgsMeshLayer('Ugrid:'+'"'+inputDirM+inputFileM+'"',
+                                          inputFileM.strip().split('/')[-1].split('.')[0],
+                                          'mdal')
 
         # Open INPUT_LAYER with netCDF4, and check its dimensions.
         # If dimensions are incorrect exit program
@@ -138,49 +516,225 @@ class mesh2tiff:
         # fileDateTime = datetime.fromisoformat(
         #                str(base_date + timedelta(seconds=times[0]))).strftime("%Y%m%dT%H%M%S")
 
-        # Define input extent parameters to create tiff from ADCIRC mesh file
-        inputExtents = ['-97.85833,-82.288499,32.0,45.83612',
-                        '-82.5,-60.040029999999994,36.0,45.83612',
-                        '-97.85833,-81.0,24.28441,32.0',
-                        '-82.3,-74.0,24.28441,36.555922',
-                        '-74.467152,-60.040029999999994,23.0,36.83612',
-                        '-97.85833,-77.0,15.0,24.313514',
-                        '-77.85833,-60.040029999999994,15.0,24.313514',
-                        '-97.85833,-77.0,7.909559999999999,15.83612',
-                        '-77.85833,-60.040029999999994,7.909559999999999,15.83612']
+        # Define the outputs, and the subset views of mosaic outputs
+        inputs_list, self.views, timeSteps = getInputsList(inputDirM, outputDirM, inputFileM,
+                                                           self.options)
+
+        # Skip outputs that an earlier run completed from the same inputs
+        self.manifests = {}
+        self.summaries = {}
+        self.summaryPathFile = outputDirM+os.path.splitext(inputFileM)[0]+'.stats.json'
+        inputs_list = self.getPendingInputs(inputs_list)
+        if len(inputs_list) == 0:
+            logger.info('All outputs of '+inputDirM+inputFileM+' are complete, so skip it')
+            bandstats.writeRunSummary(self.summaryPathFile, self.summaries)
+            return
+
+        # Run exportRaster using multiprocessinng for loop, and imput_list
+        if self.engine == 'numpy':
+            # Keep the weights of each extent in tmpDir, if they are not cached, so
+            # every timestep after the first only costs the interpolation
+            weightsDir = None
+            if len(timeSteps) > 1 and self.options['cacheDir'] is None:
+                weightsDir = os.path.join(self.tmpDir, 'weights')
+                self.options['cacheDir'] = weightsDir
 
-        # Define timestep
-        # timeStep = 0
+            try:
+                if self.options['ingest'] == 'bbox':
+                    self.exportExtents(inputs_list)
+                else:
+                    # Load the mesh topology once for all extents and timesteps, unless
+                    # it was loaded from another file on the same mesh
+                    if mesh is None:
+                        with metrics.measure('load', input=inputFileM):
+                            mesh = meshraster.loadMesh(inputDirM+inputFileM)
+                    self.mesh = mesh
 
-        # Define map units per pixel
-        mapUnitsPP = [0.01, 0.005, 0.001, 0.001, 0.005, 0.005, 0.005, 0.005, 0.005]
+                    # Read node values a chunk of timesteps at a time, so memory use does
+                    # not grow with the number of timesteps
+                    frames = meshraster.iterVariable(inputDirM+inputFileM, timeSteps,
+                             meshraster.getFrameChunk(len(self.mesh['x']),
+                                                      self.options['memoryBudget']))
 
-        # Define input_list and outputFile index
-        inputs_list = []
-        i = 0
+                    if self.options['workers'] > 1:
+                        self.exportRastersParallel(inputs_list, frames)
+                    else:
+                        logger.info('Run exportRasterNumpy in for loop, with inputs_list')
+                        for frameValues in frames:
+                            for inputList in inputs_list:
+                                if inputList[5] in frameValues:
+                                    exportRasterNumpy(inputList, self.mesh,
+                                                      frameValues[inputList[5]], self.options)
+                                    self.finishOutput(inputList)
+            finally:
+                if weightsDir is not None:
+                    shutil.rmtree(weightsDir, ignore_errors=True)
+                    self.options['cacheDir'] = None
 
-        # Add variables to input_list
-        logger.info('Create inputs_list, which has multiple extents, and one timeStep')
-        for inputExtent in inputExtents:
-            inputFileList = inputFileM.split('.')
-            inputFileList.insert(1,'raw')
-            inputFileList.insert(1,'subset'+str(i))
-            inputFileList[-1] = 'tif'
-            # outputFile = ".".join(inputFileList)
-            mapUnitPP = mapUnitsPP[i]
+            self.mesh = None
+        else:
+            logger.info('Run exportRaster in for loop, with inputs_list')
+            for inputList in inputs_list:
+                self.exportRaster(inputList)
+                self.finishOutput(inputList)
 
-            inputs_list.append([inputDirM, inputFileM, outputDirM, ".".join(inputFileList),
-                                inputExtent, 0, mapUnitPP])
+            self.layer = None
 
-            i = i + 1
+        # Write the band statistics of every output to the run summary
+        bandstats.writeRunSummary(self.summaryPathFile, self.summaries)
+        logger.info('Wrote band statistics of '+str(len(self.summaries))+' outputs to '+
+                    self.summaryPathFile+'.')
 
+    # Write the subsets as windowed views of a mosaic
+    def writeSubsetViews(self, mosaicList):
+        '''
+        This function writes a VRT file for each subset of the timestep of a mosaic
+        inputList, which is the window of the mosaic output file covering the subset
+        extent. geotiff2cog.py points the VRT files at the COG it creates from the mosaic.
+        '''
+        if mosaicList[3] not in self.views:
+            return
 
-        # Run exportRaster using multiprocessinng for loop, and imput_list
-        logger.info('Run exportRaster in for loop, with inputs_list')
+        writeWindowViews(self.getOutputPathFile(mosaicList), self.views[mosaicList[3]])
+
+    # Get the output file of an inputList
+    def getOutputPathFile(self, inputList):
+        '''
+        This function returns the output file an inputList is rendered to, which is a
+        COG with the cog option
+        '''
+        if self.options['cog']:
+            return cogutils.getCogPathFile(inputList[2]+inputList[3])
+        return inputList[2]+inputList[3]
+
+    # Get the inputLists whose outputs are not complete
+    def getPendingInputs(self, inputs_list):
+        '''
+        This function returns the inputLists whose output files are not complete. With
+        the resume option, an output is complete if its manifest matches the hash of
+        the input mesh and variable, the extent, the resolution, the output options and
+        the tool version. Without it, every output is pending, and old manifests are
+        removed.
+        '''
+        if not self.options['resume']:
+            for inputList in inputs_list:
+                manifest.removeManifest(self.getOutputPathFile(inputList))
+            return inputs_list
+
+        pending = []
+        encoding, compression = getOutputEncoding(self.options)
         for inputList in inputs_list:
-            self.exportRaster(inputList)
+            outputPathFile = self.getOutputPathFile(inputList)
+            self.manifests[inputList[3]] = {
+                'input': inputList[1],
+                'inputHash': manifest.getInputHash(inputList[0]+inputList[1], inputList[5]),
+                'timeStep': inputList[5], 'extent': inputList[4], 'mapUnitPP': inputList[6],
+                'engine': self.engine, 'cog': self.options['cog'],
+                'blockSize': self.options['blockSize'],
+                'webMercator': self.options['webMercator'], 'webZoom': self.options['webZoom'],
+                'encoding': encoding, 'compression': compression,
+                'toolVersion': manifest.getToolVersion()}
+
+            if manifest.isComplete(outputPathFile, self.manifests[inputList[3]]):
+                logger.info('Skip '+outputPathFile+', which is complete.')
+                self.writeSubsetViews(inputList)
+                self.summaries[os.path.basename(outputPathFile)] = bandstats.readSummary(
+                    outputPathFile)
+            else:
+                manifest.removeManifest(outputPathFile)
+                pending.append(inputList)
 
-        self.layer = None
+        return pending
+
+    # Record that the output of an inputList is complete
+    def finishOutput(self, inputList):
+        '''
+        This function writes the subset views of the output of an inputList, if it is a
+        mosaic, and its manifest, with the resume option, and keeps its band statistics
+        for the run summary
+        '''
+        self.writeSubsetViews(inputList)
+        outputPathFile = self.getOutputPathFile(inputList)
+        self.summaries[os.path.basename(outputPathFile)] = bandstats.readSummary(outputPathFile)
+        if inputList[3] in self.manifests:
+            manifest.writeManifest(self.getOutputPathFile(inputList),
+                                   self.manifests[inputList[3]])
+
+    # Convert mesh to rasters one extent at a time
+    def exportExtents(self, inputs_list):
+        '''
+        This function runs exportExtentNumpy for each extent in inputs_list, in a pool of
+        worker processes if there is more than one worker. Each extent reads only the
+        part of the mesh inside it.
+        '''
+        extents = []
+        for inputList in inputs_list:
+            if inputList[4] not in extents:
+                extents.append(inputList[4])
+        jobs = [([inputList for inputList in inputs_list if inputList[4] == extent],
+                 self.options) for extent in extents]
+
+        if self.options['workers'] > 1:
+            logger.info('Run exportExtentNumpy in pool of '+str(self.options['workers'])+
+                        ' workers.')
+            with Pool(processes=self.options['workers']) as pool:
+                for extent in pool.imap_unordered(exportExtentWorker, jobs):
+                    logger.info('Worker finished extent '+extent+'.')
+                    for inputList in inputs_list:
+                        if inputList[4] == extent:
+                            self.finishOutput(inputList)
+        else:
+            logger.info('Run exportExtentNumpy in for loop, with inputs_list')
+            for job in jobs:
+                exportExtentWorker(job)
+                for inputList in job[0]:
+                    self.finishOutput(inputList)
+
+    # Convert mesh to rasters in a pool of worker processes
+    def exportRastersParallel(self, inputs_list, frames):
+        '''
+        This function runs exportRasterNumpy for each inputList in a pool of worker
+        processes, one chunk of timesteps from frames at a time. The mesh and node
+        values are shared with the workers as memory mapped files in tmpDir, so they
+        are not re-read or pickled per worker. With a weights cache, the weights of each
+        extent are built once first, so workers rendering timesteps of the same extent
+        do not all miss the cache and build them.
+        '''
+        sharedDir = os.path.join(self.tmpDir, 'shared_mesh')
+        if self.options['cacheDir'] is not None:
+            weightcache.getMeshHash(self.mesh)
+        meshraster.shareMesh(self.mesh, sharedDir)
+
+        # Start the largest subsets first, so the pool finishes together
+        inputs_list = sorted(inputs_list, key=lambda inputList:
+                             meshraster.getGridSize(inputList[4], inputList[6]), reverse=True)
+
+        logger.info('Run exportRasterNumpy in pool of '+str(self.options['workers'])+' workers.')
+        try:
+            with Pool(processes=self.options['workers'], initializer=initWorker,
+                      initargs=(sharedDir, self.options)) as pool:
+                if self.options['cacheDir'] is not None:
+                    extentLists = {}
+                    for inputList in inputs_list:
+                        extentLists.setdefault((inputList[4], inputList[6]), inputList)
+                    for inputList in pool.imap_unordered(buildWeightsWorker,
+                                                         list(extentLists.values())):
+                        logger.info('Worker built weights of extent '+inputList[4]+'.')
+
+                for frameValues in frames:
+                    for timeStep, values in frameValues.items():
+                        meshraster.shareValues(values, sharedDir, timeStep)
+
+                    frameLists = [inputList for inputList in inputs_list
+                                  if inputList[5] in frameValues]
+                    for inputList in pool.imap_unordered(exportRasterWorker, frameLists):
+                        logger.info('Worker finished '+inputList[3]+'.')
+                        self.finishOutput(inputList)
+
+                    for timeStep in frameValues:
+                        meshraster.unshareValues(sharedDir, timeStep)
+        finally:
+            shutil.rmtree(sharedDir, ignore_errors=True)
 
     # Convert mesh layer as raster and save as a GeoTiff
     def exportRaster(self, inputList):
@@ -213,10 +767,26 @@ class mesh2tiff:
             extent = QgsRectangle(float(input_extent[0]),float(input_extent[2]),
                                   float(input_extent[1]),float(input_extent[3]))
             output_layer = parameters['OUTPUT_RASTER']
-            width = extent.width()/parameters['MAP_UNITS_PER_PIXEL']
-            height = extent.height()/parameters['MAP_UNITS_PER_PIXEL']
+            if self.options['cog']:
+                # Stage the GeoTiff in tmpDir, and write it to a COG in the output directory
+                cog_layer = cogutils.getCogPathFile(output_layer)
+                output_layer = os.path.join(self.tmpDir, inputList[3])
+            # Render on the same grid as the numpy engine, which is the Web Mercator tile
+            # grid with the webMercator option, so the raster is not reprojected
+            grid = getRasterGrid(parameters['INPUT_EXTENT'], parameters['MAP_UNITS_PER_PIXEL'],
+                                 self.options)
+            extent = QgsRectangle(grid['xmin'], grid['ymin'], grid['xmax'], grid['ymax'])
+            width = grid['width']
+            height = grid['height']
             crs = self.layer.crs()
-            crs.createFromSrid(4326)
+            if self.options['webMercator']:
+                # ADCIRC files usually have no CRS, and exportRasterBlock only transforms
+                # the mesh to the grid CRS if the layer CRS is valid, so it is set to the
+                # longitude and latitude of the mesh coordinates.
+                self.layer.setCrs(QgsCoordinateReferenceSystem('EPSG:4326'))
+                crs.createFromSrid(3857)
+            else:
+                crs.createFromSrid(4326)
 
             # Transform instance
             logger.info('Transform instance of '+parameters['INPUT_LAYER']+'.')
@@ -232,47 +802,132 @@ class mesh2tiff:
 
             # Create one band raster
             logger.info('Create one band raster')
-            rdp = rfw.createOneBandRaster( Qgis.Float64, int(width), int(height), extent, crs)
+            encoding, compression = getOutputEncoding(self.options)
+            rdp = rfw.createOneBandRaster(qgisDataTypes[encoding['dataType']], width,
+                                          height, extent, crs)
 
             # Get dataset index
             logger.info('Get data set index')
             dataset_index = QgsMeshDatasetIndex(parameters['INPUT_GROUP'],
                                                 parameters['INPUT_TIMESTEP'])
 
-            # Regred mesh layer to raster
-            logger.info('Regrid mesh layer '+inputList[0]+inputList[1]+'.' )
-            os.chdir(self.tmpDir)
-            block = QgsMeshUtils.exportRasterBlock( self.layer, dataset_index, crs,
-                    transform_context, parameters['MAP_UNITS_PER_PIXEL'], extent)
-            os.chdir('/home/nru/adcirc2cog/run')
+            # Define the windows the raster is rendered in
+            maxPixels, chunkSize = meshraster.getWindowLimits(self.options['memoryBudget'])
+            windows = list(meshraster.getWindows(grid, self.options['blockSize'], maxPixels))
+
+            # Regred mesh layer to raster, and write each window to GeoTiff file
+            logger.info('Regrid mesh layer '+inputList[0]+inputList[1]+' to raster Geotiff ('+
+                        output_layer+') file in '+str(len(windows))+' windows.')
+            labels = {'input': inputList[1], 'subset': inputList[3].split('.')[1],
+                      'output': inputList[3]}
+            with metrics.measure('render', **labels) as record:
+                nodataPixels = clippedPixels = 0
+                datasetMetadata = self.layer.datasetMetadata(dataset_index)
+                stats = bandstats.newStats(datasetMetadata.minimum(), datasetMetadata.maximum())
+                os.chdir(self.tmpDir)
+                for row0, col0, nrows, ncols in windows:
+                    windowExtent = QgsRectangle(*meshraster.getWindowExtent(grid,
+                                                (row0, col0, nrows, ncols)))
+                    block = QgsMeshUtils.exportRasterBlock( self.layer, dataset_index, crs,
+                            transform_context, grid['resX'], windowExtent)
+
+                    # Count the nodata pixels of the block
+                    blockValues = np.frombuffer(bytes(block.data()), dtype=np.float64)
+                    blockNodata = np.isnan(blockValues) | (blockValues == block.noDataValue())
+                    nodataPixels = nodataPixels + int(blockNodata.sum())
+                    bandstats.updateStats(stats, np.where(blockNodata, np.nan, blockValues))
 
-            # Write raster to GeoTiff file
-            logger.info('Write raster Geotiff ('+output_layer+') file.')
-            rdp.writeBlock(block, 1)
-            rdp.setNoDataValue(1, block.noDataValue())
-            rdp.setEditable(False)
+                    # Encode the block if the output is not float64
+                    if encoding['dataType'] != 'float64':
+                        encoded, blockClipped = cogutils.encodeBlock(
+                            np.where(blockNodata, np.nan, blockValues), encoding)
+                        clippedPixels = clippedPixels + blockClipped
+                        block = QgsRasterBlock(qgisDataTypes[encoding['dataType']],
+                                               block.width(), block.height())
+                        block.setData(QByteArray(encoded.tobytes()))
+                    rdp.writeBlock(block, 1, col0, row0)
+                os.chdir('/home/nru/adcirc2cog/run')
 
-            block = None
+                if encoding['dataType'] == 'float64':
+                    rdp.setNoDataValue(1, block.noDataValue())
+                else:
+                    rdp.setNoDataValue(1, encoding['nodata'])
+                rdp.setEditable(False)
 
-            logger.info('Regridded mesh data in '+inputList[0]+inputList[1]+
-                        ' to float64 grid, and saved to tiff ('+output_layer+') file.')
+                block = blockValues = blockNodata = encoded = rdp = rfw = None
+                cogutils.setScaleOffset(output_layer, encoding)
+                bandstats.setBandTags(output_layer,
+                                      bandstats.getSummary(stats, width*height))
+                if clippedPixels > 0:
+                    logger.warning('Clipped '+str(clippedPixels)+' values of '+output_layer+
+                                   ' to the range of '+encoding['dataType']+'.')
+                record.update({'pixels': width*height, 'nodataPixels': nodataPixels,
+                               'outputPathFiles': [output_layer]})
+
+            if self.options['cog']:
+                with metrics.measure('cog', **labels) as record:
+                    cogutils.cogTranslate(output_layer, cog_layer,
+                                          webOptimized=not self.options['webMercator'],
+                                          blockSize=self.options['blockSize'],
+                                          compression=compression)
+                    record.update({'pixels': width*height,
+                                   'outputPathFiles': [cog_layer]})
+                os.remove(output_layer)
+                output_layer = cog_layer
+
+            logger.info('Regridded mesh data in '+inputList[0]+inputList[1]+' to '+
+                        encoding['dataType']+' grid, and saved to tiff ('+output_layer+') file.')
 
         if self.layer.isValid() is False:
             raise Exception('Invalid mesh ('+inputList[0]+inputList[1]+') file.')
 
-@logger.catch
-def main(**kwargs):
+# Define the output file name of a subset of an input file
+def getOutputFile(inputFile, subset, timeStep=0, timeSeries=False):
     '''
-    This is the main function of adcirc2geotiff.py
+    This function returns the output file name of a subset of an input file, with the
+    timestep if timeSeries is True (maxele.subset0.raw.63.tif, fort.subset0.t0003.raw.63.tif)
     '''
-    # Define tmp directory
-    tmpDir = "/".join(kwargs['inputDirPath'].split("/")[:-2])+"/"+ \
-             kwargs['inputFilename'].split('.')[0]+"_qgis_tmp/"
-    logger.info('Create tmpDir: '+tmpDir+' for QGIS')
+    inputFileList = inputFile.split('.')
+    inputFileList.insert(1,'raw')
+    if timeSeries:
+        inputFileList.insert(1,'t'+str(timeStep).zfill(4))
+    inputFileList.insert(1,subset)
+    inputFileList[-1] = 'tif'
+    return ".".join(inputFileList)
 
-    # Make output directory
-    makeDirs(kwargs['outputDirPath'].strip())
+# Define the extent of the mosaic of all extents
+def getMosaicExtent():
+    '''
+    This function returns the extent string (xmin,xmax,ymin,ymax) that covers all
+    inputExtents
+    '''
+    bounds = [[float(value) for value in inputExtent.split(',')] for inputExtent in inputExtents]
+    return ','.join(str(value) for value in [min(bound[0] for bound in bounds),
+                                             max(bound[1] for bound in bounds),
+                                             min(bound[2] for bound in bounds),
+                                             max(bound[3] for bound in bounds)])
 
+# Define the output directory of an input file
+def getOutputDir(outputDir, inputFile):
+    '''
+    This function returns the output directory of an input file, which is outputDir
+    with a sub directory named by the input file name without dots (maxele63)
+    '''
+    return os.path.join(outputDir+"".join(inputFile[:-3].split('.')), '')
+
+# Define the tmp directory of an input file
+def getTmpDir(inputDir, inputFile):
+    '''
+    This function returns the tmp directory of an input file, next to the input directory
+    '''
+    return "/".join(inputDir.split("/")[:-2])+"/"+inputFile.split('.')[0]+"_qgis_tmp/"
+
+# Set the QGIS environment and initialize QGIS
+def startQgis(tmpDir):
+    '''
+    This function sets the QGIS environment, with TMPDIR set to tmpDir, initializes
+    QGIS and the processing framework, and returns the QGIS application
+    '''
     # Set QGIS environment
     os.environ['QT_QPA_PLATFORM']='offscreen'
     xdg_runtime_dir = '/home/nru/adcirc2geotiff'
@@ -299,24 +954,610 @@ def main(**kwargs):
     app = initialize_processing(app)
     logger.info('Initialzed QGIS.')
 
+    return app
+
+# Convert input files, with QGIS already initialized for the qgis engine
+def convertFiles(inputDirPath, outputDirPath, inputFilenames, engine, options,
+                 tmpDirPath=None):
+    '''
+    This function converts each file in inputFilenames, which must all be on the same
+    mesh. Each file gets its own output directory in outputDirPath, and its own tmp
+    directory, which is made in tmpDirPath if it is given, and next to the input
+    directory if not. The qgis engine needs QGIS to be initialized by startQgis first.
+    '''
+    if tmpDirPath is None:
+        fileTmpDirs = {inputFilename: getTmpDir(inputDirPath, inputFilename)
+                       for inputFilename in inputFilenames}
+    else:
+        fileTmpDirs = {inputFilename: os.path.join(tmpDirPath, inputFilename.split('.')[0], '')
+                       for inputFilename in inputFilenames}
+
+    if engine == 'numpy':
+        options = dict(options)
+
+        # Keep the weights of each extent in tmpDir, if they are not cached, so they
+        # are computed once for all input files
+        weightsDir = None
+        if len(inputFilenames) > 1 and options['cacheDir'] is None:
+            weightsDir = os.path.join(fileTmpDirs[inputFilenames[0]], 'batch_weights')
+            options['cacheDir'] = weightsDir
+
+        # Load the mesh from the first file, and check the other files are on it
+        # before rendering any of them. With bbox ingest, each extent loads its own
+        # part of the mesh, so only the coordinates are loaded for the check.
+        with metrics.measure('load', input=inputFilenames[0]):
+            if options['ingest'] == 'bbox':
+                mesh = reference = None
+                if len(inputFilenames) > 1:
+                    reference = meshraster.loadMeshCoordinates(inputDirPath+inputFilenames[0])
+            else:
+                mesh = reference = meshraster.loadMesh(inputDirPath+inputFilenames[0])
+        for inputFilename in inputFilenames[1:]:
+            with metrics.measure('check', input=inputFilename):
+                meshraster.checkMesh(reference, inputDirPath+inputFilename)
+        reference = None
+    else:
+        mesh = weightsDir = None
+
+    try:
+        for inputFilename in inputFilenames:
+            # Make output and tmp directories
+            fileOutputDir = getOutputDir(outputDirPath, inputFilename)
+            makeDirs(fileOutputDir.strip())
+            fileTmpDir = fileTmpDirs[inputFilename]
+            os.makedirs(fileTmpDir, exist_ok=True)
+
+            mesh2tiff(inputDirPath, fileOutputDir, inputFilename, fileTmpDir,
+                      engine=engine, options=options, mesh=mesh)
+    finally:
+        if weightsDir is not None:
+            shutil.rmtree(weightsDir, ignore_errors=True)
+
+# Get the input files that exist
+def getInputFiles(inputDir, inputFiles):
+    '''
+    This function returns the input files that exist in inputDir. Missing swan files
+    are skipped, and any other missing file is a hard exit.
+    '''
+    existingInputFiles = []
+    for inputFile in inputFiles:
+        if os.path.exists(inputDir+inputFile):
+            existingInputFiles.append(inputFile)
+        else:
+            logger.info(inputDir+inputFile+' does not exist')
+            if inputFile.startswith("swan"):
+                logger.info('The input file is a swan file : '+
+                             inputDir+inputFile+' so skip it')
+            else:
+                logger.info('The input file is not a swan file : '+
+                             inputDir+inputFile+' so do a hard exit')
+                sys.exit(1)
+
+    return existingInputFiles
+
+@logger.catch
+def main(**kwargs):
+    '''
+    This is the main function of adcirc2geotiff.py. It converts each file in
+    inputFilenames, which must all be on the same mesh, in one process.
+    '''
+    # Define tmp directory
+    tmpDir = getTmpDir(kwargs['inputDirPath'], kwargs['inputFilenames'][0])
+    logger.info('Create tmpDir: '+tmpDir+' for QGIS')
+    metrics.configure(kwargs['options']['metricsDir'], 'adcirc2geotiff')
+
+    # The numpy engine does not need QGIS
+    if kwargs['engine'] == 'numpy':
+        try:
+            convertFiles(kwargs['inputDirPath'], kwargs['outputDirPath'],
+                         kwargs['inputFilenames'], 'numpy', kwargs['options'])
+        finally:
+            metrics.writePrometheus()
+        return
+
+    # Initialize QGIS
+    app = startQgis(tmpDir)
+
     # Run mesh2tiff and producer tiff files
-    mesh2tiff(kwargs['inputDirPath'], kwargs['outputDirPath'], kwargs['inputFilename'], tmpDir)
+    try:
+        convertFiles(kwargs['inputDirPath'], kwargs['outputDirPath'], kwargs['inputFilenames'],
+                     'qgis', kwargs['options'])
+    finally:
+        metrics.writePrometheus()
 
     # Quit QGIS
     app.exitQgis()
     logger.info('Quit QGIS')
 
+# Run one job from the queue
+def runJob(jobPathFile, engine, options, tmpDirPath=None):
+    '''
+    This function runs the job in jobPathFile, a JSON file with inputDir, outputDir,
+    inputFiles and optional options that override the worker options, with its tmp
+    directories in tmpDirPath. It returns None if the job succeeded, or the error
+    message if it failed.
+    '''
+    try:
+        with open(jobPathFile) as jobFile:
+            job = json.load(jobFile)
+
+        inputDir = os.path.join(job['inputDir'], '')
+        outputDir = os.path.join(job['outputDir'], '')
+        inputFiles = job['inputFiles']
+        if isinstance(inputFiles, str):
+            inputFiles = [inputFiles]
+        jobOptions = dict(options, **job.get('options', {}))
+        metrics.configure(jobOptions['metricsDir'], 'adcirc2geotiff')
+
+        existingInputFiles = getInputFiles(inputDir, inputFiles)
+        if len(existingInputFiles) > 0:
+            try:
+                convertFiles(inputDir, outputDir, existingInputFiles, engine, jobOptions,
+                             tmpDirPath=tmpDirPath)
+            finally:
+                metrics.writePrometheus()
+        else:
+            logger.info('None of the input files of job '+jobPathFile+' exist, so skip it')
+    except SystemExit as err:
+        # Hard exits of a job fail the job, not the worker
+        logger.error('Job '+jobPathFile+' exited with status '+str(err.code))
+        return 'exit status '+str(err.code)
+    except Exception as err:
+        logger.exception('Job '+jobPathFile+' failed')
+        return repr(err)
+
+    return None
+
+# Get the modified time of a file that may have been claimed by another worker
+def getModifiedTime(pathFile):
+    '''
+    This function returns the modified time of pathFile, or 0 if it no longer exists
+    '''
+    try:
+        return os.path.getmtime(pathFile)
+    except OSError:
+        return 0
+
+# Run jobs from a queue directory
+@logger.catch
+def runQueue(queueDir, engine, options, pollInterval=5.0):
+    '''
+    This function is the worker mode of adcirc2geotiff.py. It initializes QGIS once,
+    then runs the *.json job files put in queueDir, oldest first, until a file named
+    STOP is put in queueDir. Each job is claimed by renaming it to .running, so several
+    workers can share a queue, and is renamed to .done or .failed when it finishes,
+    with a .log file holding its error. Each job gets its own tmp directory, which is
+    TMPDIR while it runs, and is removed when it finishes, so the files a failed job
+    leaves are not seen by the next job.
+    '''
+    os.makedirs(queueDir, exist_ok=True)
+
+    # Initialize QGIS once for all jobs
+    app = None
+    queueTmpDir = os.path.join(queueDir, 'qgis_tmp', '')
+    if engine == 'qgis':
+        app = startQgis(queueTmpDir)
+
+    logger.info('Watching queue '+queueDir+' for jobs.')
+    while not os.path.exists(os.path.join(queueDir, 'STOP')):
+        jobPathFiles = sorted((os.path.join(queueDir, name) for name in os.listdir(queueDir)
+                               if name.endswith('.json')), key=getModifiedTime)
+        if len(jobPathFiles) == 0:
+            time.sleep(pollInterval)
+            continue
+
+        for jobPathFile in jobPathFiles:
+            # Claim the job, unless another worker claimed it first
+            runningPathFile = jobPathFile[:-5]+'.running'
+            try:
+                os.rename(jobPathFile, runningPathFile)
+            except OSError:
+                continue
+
+            logger.info('Run job '+jobPathFile+'.')
+            startTime = time.time()
+            jobTmpDir = os.path.join(queueTmpDir, os.path.basename(jobPathFile)[:-5]+'.'+
+                                     str(os.getpid()), '')
+            os.makedirs(jobTmpDir, exist_ok=True)
+            os.environ['TMPDIR'] = jobTmpDir
+            try:
+                error = runJob(runningPathFile, engine, options, tmpDirPath=jobTmpDir)
+            finally:
+                os.environ['TMPDIR'] = queueTmpDir
+                shutil.rmtree(jobTmpDir, ignore_errors=True)
+            if error is None:
+                os.rename(runningPathFile, jobPathFile[:-5]+'.done')
+                logger.info('Finished job '+jobPathFile+' in '+
+                            str(round(time.time()-startTime, 1))+' s.')
+            else:
+                with open(jobPathFile[:-5]+'.log', 'w') as logFile:
+                    logFile.write(error+'\n')
+                os.rename(runningPathFile, jobPathFile[:-5]+'.failed')
+
+            # Stop between jobs, rather than after the queue is empty
+            if os.path.exists(os.path.join(queueDir, 'STOP')):
+                break
+
+    logger.info('Found STOP in queue '+queueDir+', so stop.')
+
+    # Quit QGIS
+    if app is not None:
+        app.exitQgis()
+        logger.info('Quit QGIS')
+
+# Get the shard directory of an output directory
+def getShardDir(outputDir):
+    '''
+    This function returns the directory the shards of the outputs in outputDir are
+    rendered to
+    '''
+    return os.path.join(outputDir+'shards', '')
+
+# Write the plan of a sharded run
+def writeShardPlan(planPathFile, inputDirPath, outputDirPath, inputFilenames, options):
+    '''
+    This function writes the plan of a sharded run of the numpy engine, a JSON file with
+    the options that change the outputs, the outputs of inputFilenames, and the work
+    units they are split into. Each work unit is a band of unitRows rows of an output,
+    in whole blocks, that a shard renders to its own GeoTiff file.
+    '''
+    unitRows = -(-options['unitRows']//options['blockSize'])*options['blockSize']
+    outputs = []
+    units = []
+    for inputFilename in inputFilenames:
+        fileOutputDir = getOutputDir(outputDirPath, inputFilename)
+        inputs_list, views, timeSteps = getInputsList(inputDirPath, fileOutputDir,
+                                                      inputFilename, options)
+        for inputList in inputs_list:
+            grid = getRasterGrid(inputList[4], inputList[6], options)
+            for row0 in range(0, grid['height'], unitRows):
+                row1 = min(row0 + unitRows, grid['height'])
+                units.append({'id': os.path.splitext(inputList[3])[0]+'.rows'+
+                              str(row0).zfill(6)+'.tif', 'output': len(outputs),
+                              'rows': [row0, row1], 'pixels': grid['width']*(row1 - row0)})
+            outputs.append({'inputList': inputList, 'views': views.get(inputList[3], []),
+                            'width': grid['width'], 'height': grid['height']})
+
+    plan = {'toolVersion': manifest.getToolVersion(),
+            'options': {name: value for name, value in options.items()
+                        if name not in shardRuntimeOptions},
+            'outputs': outputs, 'units': units}
+
+    os.makedirs(os.path.dirname(os.path.abspath(planPathFile)), exist_ok=True)
+    tmpPathFile = planPathFile+'.tmp'+str(os.getpid())
+    with open(tmpPathFile, 'w') as planFile:
+        json.dump(plan, planFile, indent=2)
+    os.replace(tmpPathFile, planPathFile)
+    logger.info('Wrote plan '+planPathFile+' of '+str(len(outputs))+' outputs in '+
+                str(len(units))+' work units.')
+
+# Read the plan of a sharded run
+def readShardPlan(planPathFile, options):
+    '''
+    This function returns the plan in planPathFile, and the options of the run, which
+    are the options of the plan with the runtime options in options. It exits if the
+    plan was written by another version of the tool, since the shards would not match.
+    '''
+    with open(planPathFile) as planFile:
+        plan = json.load(planFile)
+
+    if plan['toolVersion'] != manifest.getToolVersion():
+        logger.error('The plan '+planPathFile+' was written by another version of '
+                     'adcirc2geotiff.py, so the shards can not be rendered or merged')
+        sys.exit(1)
+
+    planOptions = dict(defaultOptions, **plan['options'])
+    planOptions.update({name: options[name] for name in shardRuntimeOptions
+                        if name in options})
+    return plan, planOptions
+
+# Get the work units of a shard
+def getShardUnits(plan, shardIndex, shardCount):
+    '''
+    This function returns the work units of shard shardIndex of shardCount. The units
+    are given out largest first to the shard with the fewest pixels so far, so every
+    shard computes the same split, and each gets about the same number of pixels.
+    '''
+    loads = [0]*shardCount
+    shardUnits = []
+    for unit in sorted(plan['units'], key=lambda unit: (-unit['pixels'], unit['id'])):
+        shard = loads.index(min(loads))
+        loads[shard] = loads[shard] + unit['pixels']
+        if shard == shardIndex:
+            shardUnits.append(unit)
+
+    # Render the units of an input file and timestep one after the other
+    return sorted(shardUnits, key=lambda unit: (plan['outputs'][unit['output']]['inputList'][1],
+                                                plan['outputs'][unit['output']]['inputList'][5],
+                                                unit['id']))
+
+# Get the manifest of a work unit
+def getUnitManifest(plan, unit):
+    '''
+    This function returns the manifest a work unit is written with, which the merge
+    checks to know the unit is complete
+    '''
+    return {'unit': unit, 'output': plan['outputs'][unit['output']]['inputList'],
+            'toolVersion': plan['toolVersion']}
+
+# Render the work units of a shard
+@logger.catch(reraise=True)
+def runShard(planPathFile, shardIndex, shardCount, options):
+    '''
+    This function is the shard mode of adcirc2geotiff.py. It renders the work units of
+    shard shardIndex of shardCount in the plan, with the numpy engine, each to its own
+    GeoTiff file in the shard directory of its output. Units that are complete, from an
+    earlier run of the shard, are skipped, so a failed shard can be run again.
+    '''
+    plan, options = readShardPlan(planPathFile, options)
+    units = getShardUnits(plan, shardIndex, shardCount)
+    metrics.configure(options['metricsDir'], 'adcirc2geotiff')
+    logger.info('Render '+str(len(units))+' of the '+str(len(plan['units']))+
+                ' work units in shard '+str(shardIndex)+'/'+str(shardCount)+'.')
+
+    # Shards are GeoTiff files, which the merge writes to COGs
+    shardOptions = dict(options, cog=False)
+    mesh = meshKey = values = valuesKey = None
+    try:
+        for unit in units:
+            inputList = plan['outputs'][unit['output']]['inputList']
+            shardDir = getShardDir(inputList[2])
+            unitManifest = getUnitManifest(plan, unit)
+            if manifest.isComplete(shardDir+unit['id'], unitManifest):
+                logger.info('Skip work unit '+unit['id']+', which is complete.')
+                continue
+            manifest.removeManifest(shardDir+unit['id'])
+            os.makedirs(shardDir, exist_ok=True)
+
+            # Load the mesh and node values once for the units of an input file and timestep
+            if meshKey != inputList[0]+inputList[1]:
+                mesh = values = valuesKey = None
+                with metrics.measure('load', input=inputList[1]):
+                    mesh = meshraster.loadMesh(inputList[0]+inputList[1])
+                meshKey = inputList[0]+inputList[1]
+            if valuesKey != inputList[5]:
+                values = meshraster.readVariable(inputList[0]+inputList[1], None, inputList[5])
+                valuesKey = inputList[5]
+
+            exportRasterNumpy([inputList[0], inputList[1], shardDir, unit['id'], inputList[4],
+                               inputList[5], inputList[6]], mesh, values, shardOptions,
+                              rows=unit['rows'])
+            manifest.writeManifest(shardDir+unit['id'], unitManifest)
+    finally:
+        metrics.writePrometheus()
+
+    logger.info('Rendered shard '+str(shardIndex)+'/'+str(shardCount)+'.')
+
+# Merge the work units of a sharded run into the outputs
+@logger.catch(reraise=True)
+def mergeShards(planPathFile, options):
+    '''
+    This function is the merge mode of adcirc2geotiff.py. It checks every work unit in
+    the plan is complete, and exits if any is not. It then stacks the units of each
+    output into its GeoTiff file, or COG with the cog option, with the band statistics
+    of the units merged, writes the subset views of mosaic outputs and the band
+    statistics summary of each input file, and removes the units.
+    '''
+    plan, options = readShardPlan(planPathFile, options)
+    metrics.configure(options['metricsDir'], 'adcirc2geotiff')
+    encoding, compression = getOutputEncoding(options)
+
+    # Check every work unit is complete
+    missing = [unit['id'] for unit in plan['units'] if not manifest.isComplete(
+               getShardDir(plan['outputs'][unit['output']]['inputList'][2])+unit['id'],
+               getUnitManifest(plan, unit))]
+    if missing:
+        logger.error(str(len(missing))+' of '+str(len(plan['units']))+
+                     ' work units are not complete: '+', '.join(missing))
+        sys.exit(1)
+
+    summaries = {}
+    try:
+        for index, output in enumerate(plan['outputs']):
+            inputList = output['inputList']
+            shardDir = getShardDir(inputList[2])
+            unitPathFiles = [shardDir+unit['id'] for unit in sorted(
+                             (unit for unit in plan['units'] if unit['output'] == index),
+                             key=lambda unit: unit['rows'][0])]
+            labels = {'input': inputList[1], 'subset': inputList[3].split('.')[1],
+                      'output': inputList[3]}
+
+            # Stack the units, with the band statistics of all of them
+            with metrics.measure('merge', **labels) as record:
+                summary = bandstats.mergeSummaries([bandstats.readSummary(unitPathFile)
+                                                    for unitPathFile in unitPathFiles],
+                                                   output['width']*output['height'])
+                if options['cog']:
+                    outputPathFile = cogutils.getCogPathFile(inputList[2]+inputList[3])
+                    rasterPathFile = shardDir+inputList[3]
+                    profile = cogutils.getStagingProfile(options['blockSize'],
+                                                         encoding['dataType'])
+                else:
+                    outputPathFile = rasterPathFile = inputList[2]+inputList[3]
+                    profile = {'driver': 'GTiff', 'tiled': True,
+                               'blockxsize': options['blockSize'],
+                               'blockysize': options['blockSize'], 'sparse_ok': True}
+                cogutils.stackRasters(unitPathFiles, rasterPathFile, profile)
+                bandstats.setBandTags(rasterPathFile, summary)
+                record.update({'pixels': output['width']*output['height'],
+                               'outputPathFiles': [rasterPathFile]})
+
+            if options['cog']:
+                with metrics.measure('cog', **labels) as record:
+                    cogutils.cogTranslate(rasterPathFile, outputPathFile,
+                                          webOptimized=not options['webMercator'],
+                                          blockSize=options['blockSize'],
+                                          compression=compression)
+                    record.update({'pixels': output['width']*output['height'],
+                                   'outputPathFiles': [outputPathFile]})
+                os.remove(rasterPathFile)
+            logger.info('Merged '+str(len(unitPathFiles))+' work units to '+outputPathFile+'.')
+
+            if output['views']:
+                writeWindowViews(outputPathFile, output['views'])
+            summaryPathFile = inputList[2]+os.path.splitext(inputList[1])[0]+'.stats.json'
+            summaries.setdefault(summaryPathFile, {})[os.path.basename(outputPathFile)] = summary
+
+            # Remove the units of the output
+            for unitPathFile in unitPathFiles:
+                os.remove(unitPathFile)
+                manifest.removeManifest(unitPathFile)
+    finally:
+        metrics.writePrometheus()
+
+    for summaryPathFile, fileSummaries in summaries.items():
+        bandstats.writeRunSummary(summaryPathFile, fileSummaries)
+        logger.info('Wrote band statistics of '+str(len(fileSummaries))+' outputs to '+
+                    summaryPathFile+'.')
+
+    # Remove the shard directories, if nothing else is in them
+    for shardDir in set(getShardDir(output['inputList'][2]) for output in plan['outputs']):
+        try:
+            os.rmdir(shardDir)
+        except OSError:
+            pass
+
+    logger.info('Merged the '+str(len(plan['units']))+' work units of plan '+planPathFile+'.')
+
+# Parse the shard argument
+def parseShard(value):
+    '''
+    This function returns the index and count of a shard argument i/N, where i is
+    from 0 to N-1
+    '''
+    try:
+        shardIndex, shardCount = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('--shard must be i/N, for example 0/4')
+    if shardCount < 1 or not 0 <= shardIndex < shardCount:
+        raise argparse.ArgumentTypeError('--shard i/N must have 0 <= i < N')
+    return shardIndex, shardCount
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     # Optional argument which requires a parameter (eg. -d test)
     parser.add_argument("--inputDIR", "--inputDir", help="Input directory path",
-                        action="store", dest="inputDir", required=True)
+                        action="store", dest="inputDir")
     parser.add_argument("--outputDIR", "--outputDir", help="Output directory path",
-                        action="store", dest="outputDir", required=True)
-    parser.add_argument("--inputFILE", "--inputFile", help="Input file name",
-                        action="store", dest="inputFile", required=True)
+                        action="store", dest="outputDir")
+    inputFileGroup = parser.add_mutually_exclusive_group()
+    inputFileGroup.add_argument("--inputFILE", "--inputFile", help="Input file name",
+                                action="store", dest="inputFile")
+    inputFileGroup.add_argument("--inputFILES", "--inputFiles",
+                                help="Comma separated input file names on the same mesh",
+                                action="store", dest="inputFiles")
+    parser.add_argument("--queueDIR", "--queueDir",
+                        help="Run as a worker that keeps QGIS initialized and runs the JSON "
+                        "job files put in this directory, until a STOP file is put in it",
+                        action="store", dest="queueDir", default=None)
+    parser.add_argument("--pollSeconds", help="Seconds a worker waits before checking an "
+                        "empty queue again", action="store", dest="pollSeconds", type=float,
+                        default=5.0)
+    parser.add_argument("--engine", help="Regrid engine, qgis or numpy", action="store",
+                        dest="engine", choices=['qgis', 'numpy'], default='qgis')
+    parser.add_argument("--cacheDIR", "--cacheDir",
+                        help="Interpolation weights cache directory path, used by the numpy engine",
+                        action="store", dest="cacheDir", default=None)
+    parser.add_argument("--cacheMaxGB", help="Maximum size of the weights cache in GB",
+                        action="store", dest="cacheMaxGB", type=float, default=20.0)
+    parser.add_argument("--workers", help="Number of subsets rendered at the same time by the numpy engine",
+                        action="store", dest="workers", type=int, default=1)
+    parser.add_argument("--blockSize", help="Size in pixels of the square blocks rasters are rendered in",
+                        action="store", dest="blockSize", type=int, default=512)
+    parser.add_argument("--memoryBudgetMB", help="Memory budget in MB for rendering a raster",
+                        action="store", dest="memoryBudgetMB", type=int, default=1024)
+    parser.add_argument("--cog", help="Write web optimized COG files instead of GeoTiff files",
+                        action="store_true", dest="cog")
+    parser.add_argument("--ingest", help="How the numpy engine reads the mesh, full to read it "
+                        "once for all extents, or bbox to read only the part inside each extent",
+                        action="store", dest="ingest", choices=['full', 'bbox'], default='full')
+    parser.add_argument("--timeSteps", help="Timesteps to render, all or start:stop:step, "
+                        "with one output file per timestep", action="store", dest="timeSteps",
+                        default=None)
+    parser.add_argument("--metricsDIR", "--metricsDir", help="Directory of the JSON-lines "
+                        "metrics file and Prometheus textfile of each stage", action="store",
+                        dest="metricsDir", default=None)
+    parser.add_argument("--resume", help="Skip outputs whose manifest shows they were "
+                        "completed from the same inputs and options by an earlier run",
+                        action="store_true", dest="resume")
+    parser.add_argument("--adaptiveResolution", help="Derive the pixel size of each extent "
+                        "from the size of the mesh elements in it, between --minMUPP and "
+                        "--maxMUPP", action="store_true", dest="adaptive")
+    parser.add_argument("--minMUPP", help="Smallest pixel size in map units with "
+                        "--adaptiveResolution", action="store", dest="minMUPP", type=float,
+                        default=0.001)
+    parser.add_argument("--maxMUPP", help="Largest pixel size in map units with "
+                        "--adaptiveResolution", action="store", dest="maxMUPP", type=float,
+                        default=0.016)
+    parser.add_argument("--mosaic", help="Render one mosaic of all extents on a common grid, "
+                        "and write the subsets as VRT windows of it", action="store_true",
+                        dest="mosaic")
+    parser.add_argument("--mosaicMUPP", help="Pixel size of the mosaic in map units, "
+                        "required with --mosaic", action="store",
+                        dest="mosaicMUPP", type=float, default=None)
+    parser.add_argument("--webMercator", help="Render on the Web Mercator tile grid, so web "
+                        "optimized COGs are made without reprojecting the rasters",
+                        action="store_true", dest="webMercator")
+    parser.add_argument("--webZoom", help="Zoom level of the Web Mercator tile grid, the zoom "
+                        "closest to the resolution of each extent by default", action="store",
+                        dest="webZoom", type=int, default=None)
+    parser.add_argument("--dataType", help="Data type of the output rasters, float64, float32, "
+                        "or int16 or uint16 with a scale and offset", action="store",
+                        dest="dataType", choices=list(cogutils.outputNodata), default='float64')
+    parser.add_argument("--scale", help="Scale of the int16 and uint16 data types, the "
+                        "precision values are stored with, 0.01 by default", action="store",
+                        dest="scale", type=float, default=None)
+    parser.add_argument("--offset", help="Offset of the int16 and uint16 data types, which is "
+                        "subtracted from values before they are scaled, 0 by default",
+                        action="store", dest="offset", type=float, default=None)
+    parser.add_argument("--compress", help="Compression of the cog files", action="store",
+                        dest="compress", type=str.upper, choices=cogutils.outputCompressions,
+                        default='DEFLATE')
+    parser.add_argument("--predictor", help="Predictor of DEFLATE and ZSTD compression, 1 for "
+                        "none, 2 for horizontal differencing, 3 for floating point, by default "
+                        "3 for float and 2 for integer data types", action="store",
+                        dest="predictor", type=int, choices=[1, 2, 3], default=None)
+    parser.add_argument("--maxZError", help="Largest error of a stored value with LERC "
+                        "compression, in stored units, 0 for lossless", action="store",
+                        dest="maxZError", type=float, default=None)
+    parser.add_argument("--planFILE", "--planFile", help="Plan file of a sharded run, which "
+                        "is written from the inputs and options, or read with --shard or "
+                        "--merge", action="store", dest="planFile", default=None)
+    parser.add_argument("--shard", help="Render shard i of N of the work units in the plan, "
+                        "as i/N", action="store", dest="shard", type=parseShard, default=None)
+    parser.add_argument("--merge", help="Merge the work units in the plan into the outputs, "
+                        "once every shard is complete", action="store_true", dest="merge")
+    parser.add_argument("--unitRows", help="Rows of the work units of a sharded run, rounded "
+                        "up to whole blocks", action="store", dest="unitRows", type=int,
+                        default=2048)
     arguments = parser.parse_args()
+    sharded = arguments.shard is not None or arguments.merge
+    if sharded and arguments.planFile is None:
+        parser.error('--shard and --merge require --planFILE')
+    if arguments.shard is not None and arguments.merge:
+        parser.error('--shard and --merge can not be used together')
+    if arguments.planFile is not None and not sharded and arguments.engine != 'numpy':
+        parser.error('--planFILE requires --engine numpy')
+    if arguments.engine == 'qgis' and not sharded and (arguments.workers != 1 or
+            arguments.ingest != 'full' or arguments.cacheDir is not None):
+        parser.error('--workers, --ingest and --cacheDIR are only used by the numpy engine, '
+                     'so they require --engine numpy')
+    if arguments.unitRows < 1:
+        parser.error('--unitRows must be larger than 0')
+    if arguments.queueDir is None and not sharded and (
+            arguments.inputDir is None or arguments.outputDir is None or
+            (arguments.inputFile is None and arguments.inputFiles is None)):
+        parser.error('--inputDIR, --outputDIR and --inputFILE or --inputFILES are required, '
+                     'unless --queueDIR, --shard or --merge is given')
+    if arguments.mosaic and arguments.mosaicMUPP is None:
+        parser.error('--mosaic requires --mosaicMUPP, the pixel size of the mosaic')
+    if arguments.minMUPP > arguments.maxMUPP:
+        parser.error('--minMUPP must not be larger than --maxMUPP')
+    if arguments.scale is not None and arguments.scale <= 0:
+        parser.error('--scale must be larger than 0')
+    if arguments.predictor == 3 and not arguments.dataType.startswith('float'):
+        parser.error('--predictor 3 can only be used with the float data types')
 
     # Remove old logger and start new one
     logger.remove()
@@ -327,25 +1568,56 @@ if __name__ == "__main__":
     logger.add(sys.stderr, level="ERROR")
     logger.info('Started log file adcirc2geotiff_vcog.log')
 
+    options = {'cacheDir': arguments.cacheDir,
+               'cacheMaxBytes': int(arguments.cacheMaxGB*1024**3),
+               'workers': arguments.workers, 'blockSize': arguments.blockSize,
+               'memoryBudget': arguments.memoryBudgetMB*1024**2,
+               'cog': arguments.cog, 'timeSteps': arguments.timeSteps,
+               'ingest': arguments.ingest, 'metricsDir': arguments.metricsDir,
+               'resume': arguments.resume, 'adaptive': arguments.adaptive,
+               'minMapUnitPP': arguments.minMUPP, 'maxMapUnitPP': arguments.maxMUPP,
+               'mosaic': arguments.mosaic, 'mosaicMapUnitPP': arguments.mosaicMUPP,
+               'webMercator': arguments.webMercator, 'webZoom': arguments.webZoom,
+               'dataType': arguments.dataType, 'scale': arguments.scale,
+               'offset': arguments.offset, 'compress': arguments.compress,
+               'predictor': arguments.predictor, 'maxZError': arguments.maxZError,
+               'unitRows': arguments.unitRows}
+
+    # Render a shard of a plan, or merge the shards
+    if arguments.shard is not None:
+        runShard(arguments.planFile, arguments.shard[0], arguments.shard[1], options)
+        sys.exit(0)
+    if arguments.merge:
+        mergeShards(arguments.planFile, options)
+        sys.exit(0)
+
+    # Run as a worker on a queue directory
+    if arguments.queueDir is not None:
+        runQueue(os.path.join(arguments.queueDir, ''), arguments.engine, options,
+                 pollInterval=arguments.pollSeconds)
+        sys.exit(0)
+
     # get input variables from arguments
     inputDir = os.path.join(arguments.inputDir, '')
     outputDir = os.path.join(arguments.outputDir, '')
-    inputFile = arguments.inputFile
+    if arguments.inputFiles is not None:
+        inputFiles = [inputFile.strip() for inputFile in arguments.inputFiles.split(',')]
+    else:
+        inputFiles = [arguments.inputFile]
     logger.info('Got input variables including inputDir '+inputDir+'.')
 
-    logger.info('Modify outputDir: '+outputDir)
-    outputDir = os.path.join(outputDir+"".join(inputFile[:-3].split('.')), '')
-    logger.info('Modified outputDir: '+outputDir)
+    for inputFile in inputFiles:
+        logger.info('Output directory of '+inputFile+': '+getOutputDir(outputDir, inputFile))
 
-    if os.path.exists(inputDir+inputFile):
-        main(inputDirPath = inputDir, outputDirPath = outputDir, inputFilename = inputFile)
+    # Check the input files exist. Missing swan files are skipped.
+    existingInputFiles = getInputFiles(inputDir, inputFiles)
+
+    if len(existingInputFiles) > 0 and arguments.planFile is not None:
+        writeShardPlan(arguments.planFile, inputDir, outputDir, existingInputFiles, options)
+    elif len(existingInputFiles) > 0:
+        main(inputDirPath = inputDir, outputDirPath = outputDir,
+             inputFilenames = existingInputFiles, engine = arguments.engine,
+             options = options)
     else:
-        logger.info(inputDir+inputFile+' does not exist')
-        if inputFile.startswith("swan"):
-            logger.info('The input file is a swan file : '+
-                         inputDir+inputFile+' so do a soft exit')
-            sys.exit(0)
-        else:
-            logger.info('The input file is not a swan file : '+
-                         inputDir+inputFile+' so do a hard exit')
-            sys.exit(1)
+        logger.info('None of the input files exist, so do a soft exit')
+        sys.exit(0)
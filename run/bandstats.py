@@ -0,0 +1,282 @@
+'''
+bandstats.py computes the band statistics and histogram of a raster incrementally, as
+its blocks are rendered, and embeds them as GDAL metadata, so tile servers and styling
+tools do not have to read a whole raster to find its range.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import json
+import warnings
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+# Number of buckets of the histograms
+histogramBuckets = 256
+
+# Percentiles of the values, for the ends of color ramps
+statsPercentiles = [2, 98]
+
+# Get the range of node values
+def getValueRange(values):
+    '''
+    This function returns the minimum and maximum of values, ignoring NaN, which are NaN
+    if every value is NaN, or if there are no values, as in an extent with no mesh nodes
+    '''
+    if np.size(values) == 0:
+        return np.nan, np.nan
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return float(np.nanmin(values)), float(np.nanmax(values))
+
+# Start the statistics of a raster
+def newStats(valueMin, valueMax, buckets=histogramBuckets):
+    '''
+    This function returns empty statistics of a raster whose values are between
+    valueMin and valueMax, which is the range of its histogram. The values interpolated
+    from the nodes of a mesh are in the range of the node values.
+    '''
+    if not np.isfinite(valueMin) or not np.isfinite(valueMax):
+        valueMin = valueMax = 0.0
+    if valueMax <= valueMin:
+        valueMax = valueMin + 1.0
+
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'minimum': None, 'maximum': None,
+            'histogramMin': float(valueMin), 'histogramMax': float(valueMax),
+            'histogram': np.zeros(buckets, dtype=np.int64)}
+
+# Add a block to the statistics
+def updateStats(stats, block):
+    '''
+    This function adds the values of a block, with NaN where there is no data, to stats.
+    The mean and variance of the block are merged with those of the earlier blocks,
+    so the values are not kept.
+    '''
+    values = block[np.isfinite(block)]
+    if values.size == 0:
+        return
+
+    values = values.astype(np.float64)
+    count = values.size
+    mean = float(values.mean())
+    m2 = float(((values - mean)**2).sum())
+
+    # Merge the mean and sum of squared differences with those of the earlier blocks
+    total = stats['count'] + count
+    delta = mean - stats['mean']
+    stats['m2'] = stats['m2'] + m2 + delta**2*stats['count']*count/total
+    stats['mean'] = stats['mean'] + delta*count/total
+    stats['count'] = total
+
+    minimum = float(values.min())
+    maximum = float(values.max())
+    stats['minimum'] = minimum if stats['minimum'] is None else min(stats['minimum'], minimum)
+    stats['maximum'] = maximum if stats['maximum'] is None else max(stats['maximum'], maximum)
+
+    counts = np.histogram(np.clip(values, stats['histogramMin'], stats['histogramMax']),
+                          bins=len(stats['histogram']),
+                          range=(stats['histogramMin'], stats['histogramMax']))[0]
+    stats['histogram'] = stats['histogram'] + counts
+
+# Get a percentile from a histogram
+def getPercentile(histogram, histogramMin, histogramMax, percentile):
+    '''
+    This function returns the percentile of the values counted in histogram, by linear
+    interpolation in the bucket it is in
+    '''
+    cumulative = np.cumsum(histogram)
+    target = cumulative[-1]*percentile/100.0
+    bucket = int(np.searchsorted(cumulative, target))
+    bucket = min(bucket, len(histogram) - 1)
+    before = cumulative[bucket - 1] if bucket > 0 else 0
+    fraction = (target - before)/histogram[bucket] if histogram[bucket] > 0 else 0.0
+    width = (histogramMax - histogramMin)/len(histogram)
+    return float(histogramMin + (bucket + fraction)*width)
+
+# Get the summary of the statistics
+def getSummary(stats, pixels):
+    '''
+    This function returns the summary of stats of a raster with pixels pixels, which
+    can be written to JSON: the count and percent of valid pixels, the minimum, maximum,
+    mean, standard deviation and percentiles of the values, and the histogram
+    '''
+    summary = {'count': stats['count'],
+               'validPercent': 100.0*stats['count']/pixels if pixels else 0.0,
+               'minimum': stats['minimum'], 'maximum': stats['maximum'], 'mean': None,
+               'stdDev': None, 'percentiles': {},
+               'histogram': {'min': stats['histogramMin'], 'max': stats['histogramMax'],
+                             'counts': [int(count) for count in stats['histogram']]}}
+    if stats['count'] > 0:
+        summary['mean'] = stats['mean']
+        summary['stdDev'] = float(np.sqrt(stats['m2']/stats['count']))
+        summary['percentiles'] = {str(percentile): getPercentile(
+                                  stats['histogram'], stats['histogramMin'],
+                                  stats['histogramMax'], percentile)
+                                  for percentile in statsPercentiles}
+
+    return summary
+
+# Merge the summaries of rasters
+def mergeSummaries(summaries, pixels):
+    '''
+    This function returns the summary of a raster with pixels pixels that is made of
+    the rasters of summaries, which have histograms with the same range
+    '''
+    histograms = [summary['histogram'] for summary in summaries
+                  if summary['histogram'] is not None]
+    if histograms:
+        stats = newStats(histograms[0]['min'], histograms[0]['max'],
+                         len(histograms[0]['counts']))
+    else:
+        stats = newStats(0.0, 1.0)
+
+    for summary in summaries:
+        if summary['count'] == 0 or summary['histogram'] is None:
+            continue
+
+        # Merge the mean and sum of squared differences as updateStats does
+        count = summary['count']
+        total = stats['count'] + count
+        delta = summary['mean'] - stats['mean']
+        stats['m2'] = (stats['m2'] + summary['stdDev']**2*count +
+                       delta**2*stats['count']*count/total)
+        stats['mean'] = stats['mean'] + delta*count/total
+        stats['count'] = total
+        stats['minimum'] = summary['minimum'] if stats['minimum'] is None else \
+            min(stats['minimum'], summary['minimum'])
+        stats['maximum'] = summary['maximum'] if stats['maximum'] is None else \
+            max(stats['maximum'], summary['maximum'])
+        stats['histogram'] = stats['histogram'] + np.asarray(summary['histogram']['counts'],
+                                                             dtype=np.int64)
+
+    return getSummary(stats, pixels)
+
+# Get the GDAL metadata of a summary
+def getBandTags(summary, scale=1.0, offset=0.0):
+    '''
+    This function returns the GDAL band metadata of a summary. The statistics are in
+    the units of the stored pixel values, as GDAL computes them, so they are converted
+    with the scale and offset of the band. The histogram is a JSON object with the
+    range and counts of its buckets.
+    '''
+    def stored(value):
+        return float((value - offset)/scale)
+
+    tags = {'STATISTICS_VALID_PERCENT': repr(float(summary['validPercent']))}
+    if summary['count'] == 0:
+        return tags
+
+    tags.update({'STATISTICS_MINIMUM': repr(stored(summary['minimum'])),
+                 'STATISTICS_MAXIMUM': repr(stored(summary['maximum'])),
+                 'STATISTICS_MEAN': repr(stored(summary['mean'])),
+                 'STATISTICS_STDDEV': repr(float(summary['stdDev']/scale))})
+    for percentile, value in summary['percentiles'].items():
+        tags['STATISTICS_P'+percentile] = repr(stored(value))
+    tags['HISTOGRAM'] = json.dumps({'min': stored(summary['histogram']['min']),
+                                    'max': stored(summary['histogram']['max']),
+                                    'counts': summary['histogram']['counts']},
+                                   separators=(',', ':'))
+    return tags
+
+# Read the summary of a raster from its GDAL metadata
+def readSummary(pathFile):
+    '''
+    This function returns the summary of a raster from its band metadata, in the units
+    of the values, or None if the raster has no statistics
+    '''
+    with rasterio.open(pathFile) as src:
+        tags = src.tags(1)
+        scale = src.scales[0]
+        offset = src.offsets[0]
+        pixels = src.width*src.height
+
+    if 'STATISTICS_VALID_PERCENT' not in tags:
+        return None
+
+    def value(name):
+        return float(tags[name])*scale + offset
+
+    validPercent = float(tags['STATISTICS_VALID_PERCENT'])
+    summary = {'count': int(round(validPercent*pixels/100.0)), 'validPercent': validPercent,
+               'minimum': None, 'maximum': None, 'mean': None, 'stdDev': None,
+               'percentiles': {}, 'histogram': None}
+    if 'STATISTICS_MINIMUM' in tags:
+        histogram = json.loads(tags['HISTOGRAM'])
+        summary.update({'minimum': value('STATISTICS_MINIMUM'),
+                        'maximum': value('STATISTICS_MAXIMUM'),
+                        'mean': value('STATISTICS_MEAN'),
+                        'stdDev': float(tags['STATISTICS_STDDEV'])*scale,
+                        'percentiles': {str(percentile): value('STATISTICS_P'+str(percentile))
+                                        for percentile in statsPercentiles},
+                        'histogram': {'min': histogram['min']*scale + offset,
+                                      'max': histogram['max']*scale + offset,
+                                      'counts': histogram['counts']}})
+
+    return summary
+
+# Compute the summary of a raster
+def computeSummary(pathFile, blockSize=512):
+    '''
+    This function returns the summary of a raster that was written without statistics,
+    reading it one block at a time twice, for the range and then for the statistics
+    '''
+    with rasterio.open(pathFile) as src:
+        windows = [Window(col0, row0, min(blockSize, src.width - col0),
+                          min(blockSize, src.height - row0))
+                   for row0 in range(0, src.height, blockSize)
+                   for col0 in range(0, src.width, blockSize)]
+
+        def readBlock(window):
+            block = src.read(1, window=window, masked=True).astype(np.float64)
+            return np.ma.filled(block*src.scales[0] + src.offsets[0], np.nan)
+
+        valueMin = valueMax = np.nan
+        for window in windows:
+            block = readBlock(window)
+            if np.isfinite(block).any():
+                valueMin = np.fmin(valueMin, np.nanmin(block))
+                valueMax = np.fmax(valueMax, np.nanmax(block))
+
+        stats = newStats(valueMin, valueMax)
+        for window in windows:
+            updateStats(stats, readBlock(window))
+
+        return getSummary(stats, src.width*src.height)
+
+# Write the statistics of a raster into it
+def setBandTags(pathFile, summary):
+    '''
+    This function writes the summary of a raster into its GDAL band metadata
+    '''
+    with rasterio.open(pathFile, 'r+') as dst:
+        dst.update_tags(1, **getBandTags(summary, dst.scales[0], dst.offsets[0]))
+
+# Write the summary of the rasters of a run
+def writeRunSummary(summaryPathFile, summaries):
+    '''
+    This function writes the summaries of the rasters of a run, by output file name, to
+    a JSON file, with the range of the values of all of them. It is written to a
+    temporary file and renamed, so the summary is never partial.
+    '''
+    minimums = [summary['minimum'] for summary in summaries.values()
+                if summary is not None and summary['minimum'] is not None]
+    maximums = [summary['maximum'] for summary in summaries.values()
+                if summary is not None and summary['maximum'] is not None]
+    runSummary = {'minimum': min(minimums) if minimums else None,
+                  'maximum': max(maximums) if maximums else None,
+                  'outputs': dict(sorted(summaries.items()))}
+
+    tmpPathFile = summaryPathFile+'.tmp'+str(os.getpid())
+    with open(tmpPathFile, 'w') as summaryFile:
+        json.dump(runSummary, summaryFile, indent=2)
+    os.replace(tmpPathFile, summaryPathFile)
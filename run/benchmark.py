@@ -0,0 +1,314 @@
+'''
+benchmark.py times the adcirc2geotiff.py and geotiff2cog.py pipeline on synthetic
+ADCIRC maxele.63.nc files of several mesh sizes, and saves the wall time, peak RSS
+and bytes written of each stage to a JSON file, so runs can be compared over time.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import sys
+import argparse
+import json
+import time
+import shutil
+import platform
+import resource
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import netCDF4 as nc
+from loguru import logger
+
+import meshraster
+import weightcache
+import adcirc2geotiff
+import geotiff2cog
+import metrics
+
+# Fill value of dry nodes, as in ADCIRC output files
+fillValue = -99999.0
+
+# Check if points are on land
+def isLand(x, y, xmin):
+    '''
+    This function returns True for the points north of a wavy coastline, west of 75W
+    '''
+    return (y > 30.0+4.0*np.sin(0.4*(x-xmin))) & (x < -75.0)
+
+# Make a synthetic ADCIRC file
+def makeMesh(outputPathFile, nodeCount, seed=0):
+    '''
+    This function writes an ADCIRC style netCDF file, with x, y, element and zeta_max,
+    with about nodeCount nodes covering the adcirc2geotiff.py extents. The nodes are a
+    jittered regular grid, elements on land are removed, and some nodes are dry.
+    '''
+    logger.info('Make synthetic mesh '+outputPathFile+' with about '+str(nodeCount)+' nodes.')
+    rng = np.random.default_rng(seed)
+
+    # Define the bounding box of all extents, and a grid with nodeCount nodes
+    bounds = np.array([[float(value) for value in inputExtent.split(',')]
+                       for inputExtent in adcirc2geotiff.inputExtents])
+    xmin, xmax = bounds[:, 0].min(), bounds[:, 1].max()
+    ymin, ymax = bounds[:, 2].min(), bounds[:, 3].max()
+
+    # Add nodes for the part of the grid on land, which is sampled
+    sampleX = rng.uniform(xmin, xmax, 100000)
+    sampleY = rng.uniform(ymin, ymax, 100000)
+    nodeCount = nodeCount/(1.0-isLand(sampleX, sampleY, xmin).mean())
+    nx = max(int(round(np.sqrt(nodeCount*(xmax-xmin)/(ymax-ymin)))), 2)
+    ny = max(int(round(nodeCount/nx)), 2)
+    dx = (xmax-xmin)/(nx-1)
+    dy = (ymax-ymin)/(ny-1)
+
+    # Jitter the interior nodes, so the triangles are not all the same
+    x, y = np.meshgrid(np.linspace(xmin, xmax, nx), np.linspace(ymin, ymax, ny))
+    x[1:-1, 1:-1] += rng.uniform(-0.3, 0.3, (ny-2, nx-2))*dx
+    y[1:-1, 1:-1] += rng.uniform(-0.3, 0.3, (ny-2, nx-2))*dy
+    x = x.ravel()
+    y = y.ravel()
+
+    # Split each grid cell in two triangles
+    nodes = np.arange(nx*ny, dtype=np.int32).reshape(ny, nx)
+    a = nodes[:-1, :-1].ravel()
+    b = nodes[:-1, 1:].ravel()
+    c = nodes[1:, :-1].ravel()
+    d = nodes[1:, 1:].ravel()
+    element = np.concatenate([np.stack([a, b, d], 1), np.stack([a, d, c], 1)])
+    nodes = a = b = c = d = None
+
+    # Remove elements on land, north of a wavy coastline, and the nodes they leave unused
+    centerX = x[element].mean(axis=1)
+    centerY = y[element].mean(axis=1)
+    element = element[~isLand(centerX, centerY, xmin)]
+    centerX = centerY = None
+    used, element = np.unique(element, return_inverse=True)
+    element = element.reshape(-1, 3).astype(np.int32)
+    x = x[used]
+    y = y[used]
+
+    # Define a smooth water level, with the lowest nodes dry
+    zetaMax = 1.0+0.5*np.sin(0.3*x)*np.cos(0.3*y)
+    zetaMax[zetaMax < 0.6] = fillValue
+
+    with nc.Dataset(outputPathFile, 'w') as ds:
+        ds.createDimension('node', len(x))
+        ds.createDimension('nele', len(element))
+        ds.createDimension('nvertex', 3)
+        var = ds.createVariable('x', 'f8', ('node',))
+        var[:] = x
+        var = ds.createVariable('y', 'f8', ('node',))
+        var[:] = y
+        var = ds.createVariable('element', 'i4', ('nele', 'nvertex'))
+        var.start_index = 1
+        var[:] = element+1
+        var = ds.createVariable('zeta_max', 'f8', ('node',), fill_value=fillValue)
+        var[:] = zetaMax
+
+    return len(x), len(element)
+
+# Measure a stage
+@contextmanager
+def measureStage(name, stages):
+    '''
+    This function measures the wall time and peak RSS of the code run in its with block,
+    and appends them to stages. The with block sets outputs to the files it wrote. The
+    peak RSS of child processes is only known if a child was larger than any before it.
+    '''
+    stage = {'stage': name, 'outputs': []}
+    childPeak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    metrics.resetPeakMemory()
+    startTime = time.perf_counter()
+    yield stage
+    stage['seconds'] = round(time.perf_counter()-startTime, 3)
+    stage['peakRssBytes'] = metrics.getPeakMemory()
+    if resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss > childPeak:
+        stage['peakChildRssBytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*1024
+    else:
+        stage['peakChildRssBytes'] = None
+    stage['bytesWritten'] = metrics.getBytes(stage.pop('outputs'))
+    stages.append(stage)
+    logger.info('Stage '+name+' took '+str(stage['seconds'])+' s, peak RSS '+
+                str(stage['peakRssBytes']//1024**2)+' MB, wrote '+
+                str(stage['bytesWritten'])+' bytes.')
+
+# Split the zip stage out of the cog stage
+def splitZipStage(stages, metricsPathFile):
+    '''
+    This function splits a zip stage out of the cog stage, the last stage in stages,
+    with the zip and cog records geotiff2cog wrote to metricsPathFile. The zip stage is
+    the time spent packaging files into the zip file, and the cog stage is the rest of
+    the wall time, since files are packaged while the other cog files are created.
+    '''
+    with open(metricsPathFile) as metricsFile:
+        records = [json.loads(line) for line in metricsFile]
+    zipRecords = [record for record in records if record['stage'] == 'zip']
+    cogRecords = [record for record in records if record['stage'] == 'cog']
+
+    cogStage = stages[-1]
+    zipStage = {'stage': 'zip',
+                'seconds': round(sum(record['seconds'] for record in zipRecords), 3),
+                'peakRssBytes': max([record['peakMemoryBytes'] for record in zipRecords],
+                                    default=0),
+                'peakChildRssBytes': None,
+                'bytesWritten': sum(record['outputBytes'] for record in zipRecords)}
+    cogStage['seconds'] = round(cogStage['seconds']-zipStage['seconds'], 3)
+    cogStage['bytesWritten'] = sum(record['outputBytes'] for record in cogRecords)
+    stages.append(zipStage)
+    logger.info('Stage cog took '+str(cogStage['seconds'])+' s without zip, which took '+
+                str(zipStage['seconds'])+' s and wrote '+str(zipStage['bytesWritten'])+
+                ' bytes.')
+
+# Run the pipeline on a synthetic mesh
+def runBenchmark(workDir, nodeCount, subsets, options):
+    '''
+    This function makes a synthetic mesh with nodeCount nodes in workDir, and runs the
+    pipeline stages on it at the extents in subsets. Regrid is the search of the mesh for
+    the pixel interpolation weights, and write interpolates the node values with them and
+    writes the GeoTiff files, as the numpy engine does.
+    '''
+    inputDir = os.path.join(workDir, 'input', '')
+    outputDir = os.path.join(workDir, 'cogeo', 'maxele63', '')
+    finalDir = os.path.join(workDir, 'final', 'maxele63', '')
+    cacheDir = os.path.join(workDir, 'weights')
+    for directory in [inputDir, outputDir, os.path.dirname(finalDir[:-1])]:
+        os.makedirs(directory, exist_ok=True)
+
+    inputFile = 'maxele.63.nc'
+    nodes, elements = makeMesh(inputDir+inputFile, nodeCount)
+    options = dict(adcirc2geotiff.defaultOptions, **options)
+    options['tmpDir'] = workDir
+
+    # Define the inputList of each subset, as mesh2tiff does
+    inputLists = []
+    for i in subsets:
+        inputLists.append([inputDir, inputFile, outputDir, 'maxele.subset'+str(i)+'.raw.63.tif',
+                           adcirc2geotiff.inputExtents[i], 0, adcirc2geotiff.mapUnitsPP[i]])
+
+    stages = []
+    with measureStage('load', stages):
+        mesh = meshraster.loadMesh(inputDir+inputFile)
+        values = meshraster.readVariable(inputDir+inputFile)
+
+    with measureStage('check', stages):
+        meshraster.checkMesh(mesh, inputDir+inputFile)
+
+    pixels = 0
+    with measureStage('regrid', stages) as stage:
+        maxPixels, chunkSize = meshraster.getWindowLimits(options['memoryBudget'])
+        for inputList in inputLists:
+            grid = meshraster.getGrid(inputList[4], inputList[6])
+            windows = list(meshraster.getWindows(grid, options['blockSize'], maxPixels))
+            weightcache.getWeights(mesh, grid, cacheDir, None, windows, chunkSize)
+            pixels = pixels + grid['width']*grid['height']
+        stage['outputs'] = [cacheDir]
+
+    with measureStage('write', stages) as stage:
+        options['cacheDir'] = cacheDir
+        for inputList in inputLists:
+            adcirc2geotiff.exportRasterNumpy(inputList, mesh, values, options)
+        stage['outputs'] = [inputList[2]+inputList[3] for inputList in inputLists]
+
+    mesh = values = None
+    shutil.rmtree(cacheDir, ignore_errors=True)
+
+    # geotiff2cog packages each cog file while the others are created, so the time it
+    # spends packaging is taken from the zip records of its metrics
+    metrics.configure(os.path.join(workDir, 'metrics'), 'geotiff2cog')
+    metricsPathFile = metrics.getMetricsPathFile()
+    try:
+        with measureStage('cog', stages) as stage:
+            stage['outputs'] = [geotiff2cog.geotiff2cog(inputParamDir=outputDir,
+                                                        finalParamDir=finalDir,
+                                                        workers=options['workers'])]
+    finally:
+        metrics.configure(None, 'benchmark')
+    splitZipStage(stages, metricsPathFile)
+
+    return {'nodeCount': nodes, 'elementCount': elements,
+            'inputBytes': os.path.getsize(inputDir+inputFile), 'subsets': list(subsets),
+            'pixels': pixels, 'stages': stages,
+            'totalSeconds': round(sum(stage['seconds'] for stage in stages), 3)}
+
+@logger.catch
+def main(**kwargs):
+    '''
+    This is the main function of benchmark.py. It runs the pipeline for each mesh size
+    in its own work directory, and saves the results to resultsPathFile.
+    '''
+    results = {'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+               'host': platform.node(), 'platform': platform.platform(),
+               'python': platform.python_version(), 'cpuCount': os.cpu_count(),
+               'options': kwargs['options'], 'runs': []}
+
+    for nodeCount in kwargs['nodeCounts']:
+        runDir = os.path.join(kwargs['workDirPath'], 'nodes'+str(nodeCount))
+        shutil.rmtree(runDir, ignore_errors=True)
+        try:
+            logger.info('Run benchmark with '+str(nodeCount)+' nodes in '+runDir+'.')
+            results['runs'].append(runBenchmark(runDir, nodeCount, kwargs['subsets'],
+                                                kwargs['options']))
+        finally:
+            if not kwargs['keep']:
+                shutil.rmtree(runDir, ignore_errors=True)
+
+        # Save the results after each run, so a long run that fails keeps the others
+        with open(kwargs['resultsPathFile'], 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+        logger.info('Saved benchmark results to '+kwargs['resultsPathFile']+'.')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    # Optional argument which requires a parameter (eg. -d test)
+    parser.add_argument("--workDIR", "--workDir", help="Work directory path for the synthetic "
+                        "input files and outputs", action="store", dest="workDir", required=True)
+    parser.add_argument("--resultsFILE", "--resultsFile", help="JSON results file path, "
+                        "benchmark_<date>.json in the work directory by default",
+                        action="store", dest="resultsFile", default=None)
+    parser.add_argument("--nodeCounts", help="Comma separated synthetic mesh sizes in nodes",
+                        action="store", dest="nodeCounts",
+                        default='10000,100000,1000000,5000000')
+    parser.add_argument("--subsets", help="Comma separated subset indexes to render, all by default",
+                        action="store", dest="subsets", default=None)
+    parser.add_argument("--workers", help="Number of processes geotiff2cog uses",
+                        action="store", dest="workers", type=int, default=1)
+    parser.add_argument("--blockSize", help="Size in pixels of the square blocks rasters are rendered in",
+                        action="store", dest="blockSize", type=int, default=512)
+    parser.add_argument("--memoryBudgetMB", help="Memory budget in MB for rendering a raster",
+                        action="store", dest="memoryBudgetMB", type=int, default=1024)
+    parser.add_argument("--keep", help="Keep the synthetic input files and outputs",
+                        action="store_true", dest="keep")
+    arguments = parser.parse_args()
+
+    # Remove old logger and start new one
+    logger.remove()
+    log_path = os.path.join(os.getenv('LOG_PATH',
+                                      os.path.join(os.path.dirname(__file__), 'logs')), '')
+    logger.add(log_path+'benchmark.log', level='DEBUG', rotation="1 MB")
+    logger.add(sys.stdout, level="INFO")
+    logger.add(sys.stderr, level="ERROR")
+    logger.info('Started log file benchmark.log')
+
+    workDir = os.path.join(arguments.workDir, '')
+    os.makedirs(workDir, exist_ok=True)
+    resultsFile = arguments.resultsFile
+    if resultsFile is None:
+        resultsFile = workDir+'benchmark_'+datetime.now().strftime('%Y%m%dT%H%M%S')+'.json'
+    if arguments.subsets is None:
+        subsets = list(range(len(adcirc2geotiff.inputExtents)))
+    else:
+        subsets = [int(subset) for subset in arguments.subsets.split(',')]
+
+    main(workDirPath = workDir, resultsPathFile = resultsFile,
+         nodeCounts = [int(nodeCount) for nodeCount in arguments.nodeCounts.split(',')],
+         subsets = subsets, keep = arguments.keep,
+         options = {'workers': arguments.workers, 'blockSize': arguments.blockSize,
+                    'memoryBudget': arguments.memoryBudgetMB*1024**2})
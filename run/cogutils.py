@@ -0,0 +1,333 @@
+'''
+cogutils.py has the functions used to write Cloud Optimized GeoTIFF (COG) files
+in-process with the rio_cogeo API, instead of running rio cogeo in a subprocess.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import glob
+import math
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+from loguru import logger
+from rio_cogeo.cogeo import cog_translate
+from rio_cogeo.profiles import cog_profiles
+
+import bandstats
+
+# Get the name of the COG for a GeoTIFF
+def getCogPathFile(pathFile):
+    '''
+    This function returns the COG file name for a GeoTIFF file name, by inserting cog
+    before the extension, which is the name geotiff2cog gives it
+    '''
+    root, ext = os.path.splitext(pathFile)
+    return root+'.cog'+ext
+
+# Output data types, with the nodata value of each. The nodata value of the integer
+# types is left out of the range values are encoded in.
+outputNodata = {'float64': float('nan'), 'float32': float('nan'), 'int16': -32768,
+                'uint16': 65535}
+
+# Compression methods of the output files
+outputCompressions = ['DEFLATE', 'ZSTD', 'LERC', 'LERC_DEFLATE', 'LERC_ZSTD']
+
+# Get the encoding of output rasters
+def getEncoding(dataType='float64', scale=None, offset=None):
+    '''
+    This function returns the encoding of output rasters with dataType. Values are stored
+    in the integer types as round((value - offset)/scale), with scale and offset in the
+    GDAL scale and offset metadata, so readers get back the values. The default scale
+    of the integer types is 0.01, which keeps centimetres.
+    '''
+    if dataType not in outputNodata:
+        raise ValueError('Output data type '+str(dataType)+' is not one of '+
+                         ', '.join(outputNodata))
+
+    if dataType.startswith('float'):
+        return {'dataType': dataType, 'nodata': outputNodata[dataType], 'scale': 1.0,
+                'offset': 0.0}
+
+    return {'dataType': dataType, 'nodata': outputNodata[dataType],
+            'scale': 0.01 if scale is None else float(scale),
+            'offset': 0.0 if offset is None else float(offset)}
+
+# Encode a block of values
+def encodeBlock(block, encoding):
+    '''
+    This function returns block, with NaN where there is no data, encoded with encoding,
+    and the number of values that were out of the range of the data type, which are
+    clipped to it
+    '''
+    if encoding['dataType'].startswith('float'):
+        return block.astype(encoding['dataType']), 0
+
+    # Keep the nodata value out of the range of values
+    info = np.iinfo(encoding['dataType'])
+    lowest = info.min + 1 if encoding['nodata'] == info.min else info.min
+    highest = info.max - 1 if encoding['nodata'] == info.max else info.max
+
+    stored = np.rint((block - encoding['offset'])/encoding['scale'])
+    valid = ~np.isnan(stored)
+    clipped = int((valid & ((stored < lowest) | (stored > highest))).sum())
+    encoded = np.where(valid, np.clip(stored, lowest, highest), encoding['nodata'])
+    return encoded.astype(encoding['dataType']), clipped
+
+# Get the compression creation options of output files
+def getCompression(compress='DEFLATE', predictor=None, maxZError=None, dataType='float64'):
+    '''
+    This function returns the rasterio creation options that compress output files of
+    dataType with compress. The predictor is the floating point predictor for float
+    types and the horizontal differencing predictor for integer types, unless it is set.
+    LERC does not use a predictor, and is lossless unless maxZError, the largest error
+    of a stored value, is set.
+    '''
+    compress = compress.upper()
+    if compress not in outputCompressions:
+        raise ValueError('Compression '+compress+' is not one of '+', '.join(outputCompressions))
+
+    if compress.startswith('LERC'):
+        return {'compress': compress, 'max_z_error': 0.0 if maxZError is None else maxZError}
+
+    if predictor is None:
+        predictor = 3 if dataType.startswith('float') else 2
+    elif predictor == 3 and not dataType.startswith('float'):
+        raise ValueError('The floating point predictor can not compress '+dataType+' files')
+
+    return {'compress': compress, 'predictor': predictor}
+
+# Get the creation options of a staging GeoTIFF
+def getStagingProfile(blockSize=512, dataType='float64'):
+    '''
+    This function returns the rasterio creation options of the tiled, compressed
+    GeoTIFF that rendered blocks of dataType are staged in before they are written to a COG
+    '''
+    profile = {'driver': 'GTiff', 'tiled': True, 'blockxsize': blockSize,
+               'blockysize': blockSize, 'bigtiff': 'IF_SAFER', 'sparse_ok': True}
+    profile.update(getCompression(dataType=dataType))
+    return profile
+
+# Get the creation options of a COG
+def getCogProfile(blockSize=512, compression=None):
+    '''
+    This function returns the rasterio creation options of a COG, which are those of
+    rio cogeo create with the compression options from getCompression, a DEFLATE and
+    floating point predictor by default, and with blocks that are all nodata left out
+    of the file
+    '''
+    profile = cog_profiles.get('deflate')
+    profile.update({'blockxsize': blockSize, 'blockysize': blockSize, 'sparse_ok': True})
+    profile.update(getCompression() if compression is None else compression)
+    return profile
+
+# Set the scale and offset of a raster
+def setScaleOffset(pathFile, encoding):
+    '''
+    This function sets the GDAL scale and offset metadata of a raster written with
+    encoding, if it is an integer encoding
+    '''
+    if encoding['dataType'].startswith('float'):
+        return
+
+    with rasterio.open(pathFile, 'r+') as dst:
+        dst.scales = (encoding['scale'],)
+        dst.offsets = (encoding['offset'],)
+
+# Encode a raster
+def encodeRaster(srcPathFile, dstPathFile, encoding, blockSize=512):
+    '''
+    This function writes the values of srcPathFile, with its scale and offset applied,
+    to a staging GeoTIFF with encoding, one block at a time, with the band statistics of
+    srcPathFile. It returns the number of values that were clipped to the range of the
+    data type.
+    '''
+    clipped = 0
+    with rasterio.open(srcPathFile) as src:
+        profile = getStagingProfile(blockSize, encoding['dataType'])
+        with rasterio.open(dstPathFile, 'w', width=src.width, height=src.height, count=1,
+                           dtype=encoding['dataType'], crs=src.crs, transform=src.transform,
+                           nodata=encoding['nodata'], **profile) as dst:
+            for row0 in range(0, src.height, blockSize):
+                for col0 in range(0, src.width, blockSize):
+                    window = Window(col0, row0, min(blockSize, src.width - col0),
+                                    min(blockSize, src.height - row0))
+                    block = src.read(1, window=window, masked=True).astype(np.float64)
+                    block = np.ma.filled(block*src.scales[0] + src.offsets[0], np.nan)
+                    if np.isnan(block).all():
+                        continue
+                    encoded, blockClipped = encodeBlock(block, encoding)
+                    clipped = clipped + blockClipped
+                    dst.write(encoded, 1, window=window)
+
+    setScaleOffset(dstPathFile, encoding)
+    summary = bandstats.readSummary(srcPathFile)
+    if summary is not None:
+        bandstats.setBandTags(dstPathFile, summary)
+    return clipped
+
+# Check if a raster is on the Web Mercator tile grid
+def isWebOptimized(pathFile, tileSize=256):
+    '''
+    This function returns True if a raster is in EPSG:3857, with the resolution of a
+    zoom level of the Web Mercator tile grid, and bounds on whole tiles, which is the
+    grid rio cogeo --web-optimized would reproject it to
+    '''
+    worldSize = 2*math.pi*6378137.0
+    with rasterio.open(pathFile) as src:
+        if src.crs is None or src.crs.to_epsg() != 3857:
+            return False
+        transform = src.transform
+        width = src.width
+        height = src.height
+
+    # Check the resolution is the resolution of a zoom level
+    if transform.b != 0 or transform.d != 0 or transform.a != -transform.e:
+        return False
+    zoom = math.log2(worldSize/(tileSize*transform.a))
+    if abs(zoom - round(zoom)) > 1e-9:
+        return False
+
+    # Check the bounds are on whole tiles
+    tileSpan = tileSize*transform.a
+    for offset in [transform.c + worldSize/2, worldSize/2 - transform.f,
+                   transform.c + width*transform.a + worldSize/2,
+                   worldSize/2 - transform.f + height*transform.a]:
+        if abs(offset/tileSpan - round(offset/tileSpan)) > 1e-6:
+            return False
+
+    return True
+
+# Stack rasters with the same columns
+def stackRasters(srcPathFiles, dstPathFile, profile):
+    '''
+    This function writes the rasters in srcPathFiles, which have the same columns and
+    follow each other from top to bottom, as one raster with the creation options in
+    profile. They are copied one block at a time, and blocks that are all nodata are
+    left unwritten. The raster has the data type, nodata, scale and offset of the first.
+    '''
+    heights = []
+    for srcPathFile in srcPathFiles:
+        with rasterio.open(srcPathFile) as src:
+            heights.append(src.height)
+
+    with rasterio.open(srcPathFiles[0]) as first:
+        meta = {'width': first.width, 'height': sum(heights), 'count': 1,
+                'dtype': first.dtypes[0], 'crs': first.crs, 'transform': first.transform,
+                'nodata': first.nodata}
+        scales = first.scales
+        offsets = first.offsets
+
+    with rasterio.open(dstPathFile, 'w', **meta, **profile) as dst:
+        row0 = 0
+        for srcPathFile, height in zip(srcPathFiles, heights):
+            with rasterio.open(srcPathFile) as src:
+                for ij, window in src.block_windows(1):
+                    block = src.read(1, window=window)
+                    if meta['nodata'] is not None and (
+                            np.isnan(block).all() if np.isnan(meta['nodata'])
+                            else (block == meta['nodata']).all()):
+                        continue
+                    dst.write(block, 1, window=Window(window.col_off, row0 + window.row_off,
+                                                      window.width, window.height))
+            row0 = row0 + height
+        dst.scales = scales
+        dst.offsets = offsets
+
+# Write a COG from a GeoTIFF, or an open rasterio dataset
+def cogTranslate(source, dstPathFile, webOptimized=True, blockSize=512, compression=None):
+    '''
+    This function writes a COG, with internal overviews, from source. It does the
+    same as rio cogeo create, with --web-optimized if webOptimized is True. The COG
+    has the data type, scale, offset and band metadata, with the band statistics, of
+    source, and is compressed with compression.
+    '''
+    logger.info('Create cog file '+dstPathFile+'.')
+    tmpPathFile = dstPathFile+'.tmp'
+    cog_translate(source, tmpPathFile, getCogProfile(blockSize, compression),
+                  web_optimized=webOptimized, forward_band_tags=True, in_memory=False,
+                  quiet=True)
+
+    # Rename the finished COG, so a partial COG never has the final name
+    os.replace(tmpPathFile, dstPathFile)
+    logger.info('Created cog file '+dstPathFile+'.')
+
+# GDAL data type names of numpy data types, for VRT files
+gdalTypeNames = {'uint8': 'Byte', 'int16': 'Int16', 'uint16': 'UInt16', 'int32': 'Int32',
+                 'uint32': 'UInt32', 'float32': 'Float32', 'float64': 'Float64'}
+
+# Write a VRT file that is a window of a raster
+def writeWindowVrt(vrtPathFile, sourcePathFile, bounds, boundsCrs='EPSG:4326'):
+    '''
+    This function writes a VRT file that is the window of sourcePathFile covering bounds
+    (left, bottom, right, top) in boundsCrs. The window is snapped to whole source pixels,
+    so no pixels are resampled. The source is named relative to the VRT file, so both
+    must be in the same directory.
+    '''
+    with rasterio.open(sourcePathFile) as src:
+        left, bottom, right, top = transform_bounds(boundsCrs, src.crs, *bounds)
+        window = from_bounds(left, bottom, right, top, src.transform)
+        col0 = max(int(math.floor(window.col_off)), 0)
+        row0 = max(int(math.floor(window.row_off)), 0)
+        col1 = min(int(math.ceil(window.col_off + window.width)), src.width)
+        row1 = min(int(math.ceil(window.row_off + window.height)), src.height)
+        transform = src.window_transform(Window(col0, row0, col1 - col0, row1 - row0))
+        crs = src.crs.to_wkt()
+        dataType = gdalTypeNames[src.dtypes[0]]
+        nodata = src.nodata
+        scale = src.scales[0]
+        offset = src.offsets[0]
+
+    root = ET.Element('VRTDataset', rasterXSize=str(col1 - col0), rasterYSize=str(row1 - row0))
+    ET.SubElement(root, 'SRS').text = crs
+    ET.SubElement(root, 'GeoTransform').text = ', '.join(repr(value) for value in
+                                                         transform.to_gdal())
+    band = ET.SubElement(root, 'VRTRasterBand', dataType=dataType, band='1')
+    if nodata is not None:
+        ET.SubElement(band, 'NoDataValue').text = repr(nodata)
+    if scale != 1 or offset != 0:
+        ET.SubElement(band, 'Offset').text = repr(offset)
+        ET.SubElement(band, 'Scale').text = repr(scale)
+    source = ET.SubElement(band, 'SimpleSource')
+    ET.SubElement(source, 'SourceFilename',
+                  relativeToVRT='1').text = os.path.basename(sourcePathFile)
+    ET.SubElement(source, 'SourceBand').text = '1'
+    ET.SubElement(source, 'SrcRect', xOff=str(col0), yOff=str(row0), xSize=str(col1 - col0),
+                  ySize=str(row1 - row0))
+    ET.SubElement(source, 'DstRect', xOff='0', yOff='0', xSize=str(col1 - col0),
+                  ySize=str(row1 - row0))
+
+    ET.indent(root)
+    ET.ElementTree(root).write(vrtPathFile)
+
+# Point the VRT windows of a raster at its COG
+def retargetWindowVrts(vrtDir, sourcePathFile, cogPathFile):
+    '''
+    This function rewrites each VRT file in vrtDir that is a window of sourcePathFile,
+    as the window with the same bounds of cogPathFile, which can be in another CRS
+    '''
+    for vrtPathFile in glob.glob(os.path.join(vrtDir, '*.vrt')):
+        root = ET.parse(vrtPathFile).getroot()
+        if root.findtext('VRTRasterBand/SimpleSource/SourceFilename') != \
+                os.path.basename(sourcePathFile):
+            continue
+
+        # Get the bounds of the window from its geotransform and size
+        transform = Affine.from_gdal(*[float(value) for value in
+                                       root.findtext('GeoTransform').split(',')])
+        left, top = transform*(0, 0)
+        right, bottom = transform*(int(root.get('rasterXSize')), int(root.get('rasterYSize')))
+        writeWindowVrt(vrtPathFile, cogPathFile, (left, bottom, right, top),
+                       root.findtext('SRS'))
+        logger.info('Pointed VRT file '+vrtPathFile+' at '+cogPathFile+'.')
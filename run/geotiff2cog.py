@@ -12,34 +12,98 @@ geotiff2cog converts and geoTiff image to a cloud optimized geo tiff image
 import sys
 import os
 import argparse
-import shutil
 import glob
-from subprocess import Popen, PIPE, STDOUT
+import json
+import hashlib
+import zipfile
 # from multiprocessing.pool import ThreadPool as Pool
 from multiprocessing.pool import Pool
 
+import rasterio
 from loguru import logger
 
-# Function creates a process using command from cmd
-def call_proc(cmd):
-    ''' 
-    This runs in a separate thread
+import cogutils
+import metrics
+import manifest
+import bandstats
+
+# Get the encoding and compression of a cog file
+def getCogEncoding(inputPathFile, encodingOptions):
+    '''
+    This function returns the encoding of the cog file of inputPathFile, which is None
+    if the cog file keeps the data type of inputPathFile, and the compression options
+    of the cog file
+    '''
+    dataType = encodingOptions.get('dataType')
+    if dataType is None:
+        with rasterio.open(inputPathFile) as src:
+            dataType = src.dtypes[0]
+        encoding = None
+    else:
+        encoding = cogutils.getEncoding(dataType, encodingOptions.get('scale'),
+                                        encodingOptions.get('offset'))
+
+    compression = cogutils.getCompression(encodingOptions.get('compress', 'DEFLATE'),
+                                          encodingOptions.get('predictor'),
+                                          encodingOptions.get('maxZError'), dataType)
+    return encoding, compression
+
+# Function creates a cog file in a pool process
+def convert_cog(inputPathFile, outputPathFile, encodingOptions=None):
+    '''
+    This runs in a separate process, and returns the error message, or None if the
+    cog file was created. Rasters that are already on the Web Mercator tile grid are
+    not reprojected. If encodingOptions has a dataType, the values are encoded with
+    it in a staging GeoTIFF first.
     '''
-    with Popen(cmd, stdout=PIPE, stderr=STDOUT) as proc:
-        stdout, stderr = proc.communicate()
-        return (stdout, stderr)
+    inputFile = os.path.basename(inputPathFile)
+    stagingPathFile = os.path.splitext(outputPathFile)[0]+'.staging.tmp'
+    try:
+        with metrics.measure('cog', input=inputFile, subset=inputFile.split('.')[1],
+                             output=os.path.basename(outputPathFile)) as record:
+            encoding, compression = getCogEncoding(inputPathFile, encodingOptions or {})
+            sourcePathFile = inputPathFile
+            if encoding is not None:
+                clipped = cogutils.encodeRaster(inputPathFile, stagingPathFile, encoding)
+                if clipped > 0:
+                    logger.warning('Clipped '+str(clipped)+' values of '+inputPathFile+
+                                   ' to the range of '+encoding['dataType']+'.')
+                sourcePathFile = stagingPathFile
+
+            # Rasters rendered on the Web Mercator tile grid are not reprojected
+            cogutils.cogTranslate(sourcePathFile, outputPathFile,
+                                  webOptimized=not cogutils.isWebOptimized(inputPathFile),
+                                  compression=compression)
+            record['outputPathFiles'] = [outputPathFile]
+        return None
+    except Exception as err:
+        return repr(err)
+    finally:
+        if os.path.exists(stagingPathFile):
+            os.remove(stagingPathFile)
 
 def geotiff2cog(**kwargs):
     ''' 
-    Create empty list for commands
+    Convert the tiff files in inputParamDir to cog files in a pool of workers, and
+    package them into the zip file of finalParamDir as they are created, which is
+    returned. With resume, cog files whose manifest matches the hash of their tiff
+    file are not created again. The cog files are encoded and compressed with
+    kwargs['encodingOptions'].
     '''
-    cmds_list = []
+    jobs_list = []
+    manifests = {}
+    encodingOptions = kwargs.get('encodingOptions') or {}
 
-    # Get list of input tiff files
-    inputPathFiles = glob.glob(kwargs['inputParamDir']+'*.tif')
+    # Get list of input tiff files. COG files written by adcirc2geotiff.py --cog
+    # do not need to be converted, and are only packaged into the zip file.
+    inputPathFiles = [inputPathFile for inputPathFile in glob.glob(kwargs['inputParamDir']+'*.tif')
+                      if not inputPathFile.endswith('.cog.tif')]
+    cogPathFiles = glob.glob(kwargs['inputParamDir']+'*.cog.tif')
 
     # Check if inputPathFiles list has values
-    if len(inputPathFiles) > 0:
+    if len(inputPathFiles) == 0 and len(cogPathFiles) > 0:
+        logger.info('inputPathFiles list only has cog files, so none are created.')
+    elif len(inputPathFiles) > 0:
         for inputPathFile in inputPathFiles:
             # Log inputPathFile
             logger.info('The inputPathFile '+inputPathFile.strip()+' so create cog file.')
@@ -49,6 +113,32 @@ def geotiff2cog(**kwargs):
             inputFileList.insert(-1,'cog')
             outputFile = ".".join(inputFileList)
 
+            # Embed the band statistics in tiff files that were written without them
+            if bandstats.readSummary(inputPathFile) is None:
+                logger.info('Compute band statistics of '+inputPathFile+'.')
+                bandstats.setBandTags(inputPathFile, bandstats.computeSummary(inputPathFile))
+
+            # Skip cog files that an earlier run created from the same tiff file
+            if kwargs.get('resume'):
+                encoding, compression = getCogEncoding(inputPathFile, encodingOptions)
+                manifests[inputPathFile] = {'input': inputPathFile.split('/')[-1],
+                                            'inputHash': manifest.getFileHash(inputPathFile),
+                                            'cogProfile': dict(cogutils.getCogProfile(
+                                                compression=compression)),
+                                            'encoding': encoding,
+                                            'toolVersion': manifest.getToolVersion()}
+                if manifest.isComplete(kwargs['inputParamDir']+outputFile,
+                                       manifests[inputPathFile]):
+                    logger.info('Skip cog file '+kwargs['inputParamDir']+outputFile+
+                                ', which is complete.')
+
+                    # VRT views of a mosaic that adcirc2geotiff.py rewrote since the
+                    # cog file was created point at the tiff file again
+                    cogutils.retargetWindowVrts(kwargs['inputParamDir'], inputPathFile,
+                                                kwargs['inputParamDir']+outputFile)
+                    continue
+            manifest.removeManifest(kwargs['inputParamDir']+outputFile)
+
             # Remove cog file if it already exits
             if os.path.exists(kwargs['inputParamDir']+outputFile):
                 os.remove(kwargs['inputParamDir']+outputFile)
@@ -57,32 +147,40 @@ def geotiff2cog(**kwargs):
             else:
                 logger.info('Cogeo path '+kwargs['inputParamDir']+outputFile+'.')
 
-            # Define command to create cog
-            cmds_list.append(['rio', 'cogeo', 'create', inputPathFile,
-                              kwargs['inputParamDir']+outputFile, '--web-optimized'])
+            # Define job to create cog
+            jobs_list.append((inputPathFile, kwargs['inputParamDir']+outputFile, encodingOptions))
     else:
         logger.info('inputPathFiles list has not values')
         sys.exit(1)
 
+    # Cog files written by adcirc2geotiff.py --cog, or by an earlier run, are packaged
+    # while the other cog files are created
+    readyPathFiles = sorted(set(glob.glob(kwargs['inputParamDir']+'*.cog.tif')) -
+                            set(job[1] for job in jobs_list))
+
     # Define number of CPU to use in pool.
     logger.info('Create pool.')
-    pool = Pool(processes=4)
+    pool = Pool(processes=kwargs.get('workers', 4))
     logger.info('Pool created.')
 
-    # Apply cmds_list to pool, and output to resutls
-    logger.info('Create results array.')
-    for cmd in cmds_list:
-        logger.info(" ".join(cmd))
-        result = pool.apply_async(call_proc, (cmd,))
-        stdout, stderr = result.get()
-
-        if stderr:
-            logger.info(f"stdout: {stdout} stderr: {stderr}")
-            sys.exit(1)
+    # Submit every job in jobs_list to pool, and package each cog file into the zip
+    # file as soon as it is created, while the other jobs run
+    archive = openArchive(kwargs['finalParamDir'])
+    results = pool.imap_unordered(convertCogJob, jobs_list)
+    for readyPathFile in readyPathFiles:
+        addToArchive(archive, readyPathFile)
+
+    errors = []
+    for inputPathFile, outputPathFile, error in results:
+        if error:
+            logger.error('Error creating cog file from '+inputPathFile+': '+error)
+            errors.append(inputPathFile)
         else:
-            logger.info(f"stdout: {stdout} stderr: {stderr}")
-
-    logger.info('Results array created.')
+            logger.info('Created cog file from '+inputPathFile+'.')
+            cogutils.retargetWindowVrts(kwargs['inputParamDir'], inputPathFile, outputPathFile)
+            if inputPathFile in manifests:
+                manifest.writeManifest(outputPathFile, manifests[inputPathFile])
+            addToArchive(archive, outputPathFile)
 
     # Close the pool and wait for each running task to complete
     logger.info('Close pool.')
@@ -90,24 +188,108 @@ def geotiff2cog(**kwargs):
     pool.join()
     logger.info('Pool closed.')
 
-    # Create final directory path
-    if os.path.exists(kwargs['finalParamDir']):
-        os.rmdir(kwargs['finalParamDir'])
-        logger.info('Remove directory '+kwargs['finalParamDir']+'.')
-        os.makedirs(kwargs['finalParamDir'], exist_ok=True)
-        logger.info('Made directory '+kwargs['finalParamDir']+'.')
-    else:
-        os.makedirs(kwargs['finalParamDir'], exist_ok=True)
-        logger.info('Directory '+kwargs['finalParamDir']+' does not exist so make it.')
+    # Exit if any cog file was not created. The cog files that were created are kept,
+    # so a rerun with resume only creates the others.
+    if errors:
+        discardArchive(archive)
+        logger.error(str(len(errors))+' of '+str(len(jobs_list))+
+                     ' cog files were not created: '+', '.join(errors))
+        sys.exit(1)
 
-    # Move cogs to final directory
-    for finalPathFile in glob.glob(kwargs['inputParamDir']+'*.cog.tif'):
-        try:
-            shutil.move(finalPathFile, kwargs['finalParamDir'])
-            logger.info('Moved cog file '+finalPathFile.split("/")[-1]+
-            ' to '+kwargs['finalParamDir']+' directory.')
-        except OSError as err:
-            logger.exception(err)
+    # Package the VRT views of mosaic cogs, which point at their cog by now, and the
+    # band statistics summary of the run
+    for packagedPathFile in sorted(glob.glob(kwargs['inputParamDir']+'*.vrt')+
+                                   glob.glob(kwargs['inputParamDir']+'*.stats.json')):
+        addToArchive(archive, packagedPathFile)
+
+    zipPathFile = closeArchive(archive)
+
+    # Remove the packaged files and their manifests, unless they are kept for a rerun
+    # with resume
+    if not kwargs.get('resume'):
+        for packagedPathFile in archive['pathFiles']:
+            os.remove(packagedPathFile)
+            manifest.removeManifest(packagedPathFile)
+        logger.info('Removed '+str(len(archive['pathFiles']))+' packaged files from '+
+                    kwargs['inputParamDir']+'.')
+
+    return zipPathFile
+
+# Function creates a cog file for a job in jobs_list
+def convertCogJob(job):
+    '''
+    This runs convert_cog in a pool process, and returns the tiff and cog file of the
+    job with the error message
+    '''
+    return job[0], job[1], convert_cog(*job)
+
+# Open the zip file of the final directory
+def openArchive(finalDirPath):
+    '''
+    This function opens the zip file finalDirPath[:-1]+'.zip' that files are packaged
+    into under the final directory name, without the final directory being made. The
+    zip file is written to a temporary file until it is closed.
+    '''
+    zipPathFile = finalDirPath[:-1]+'.zip'
+    os.makedirs(os.path.dirname(zipPathFile), exist_ok=True)
+    tmpPathFile = zipPathFile+'.tmp'
+
+    # Cog files are compressed already, so they are stored without compression
+    logger.info('Open zip file '+zipPathFile+'.')
+    return {'zipFile': zipfile.ZipFile(tmpPathFile, 'w', compression=zipfile.ZIP_STORED,
+                                       allowZip64=True),
+            'zipPathFile': zipPathFile, 'tmpPathFile': tmpPathFile,
+            'baseDir': finalDirPath.split('/')[-2], 'checksums': {}, 'pathFiles': []}
+
+# Add a file to the zip file
+def addToArchive(archive, pathFile):
+    '''
+    This function copies a file into the zip file in chunks, and records its sha256
+    checksum and size from the same read
+    '''
+    arcname = archive['baseDir']+'/'+os.path.basename(pathFile)
+    inputFile = os.path.basename(pathFile)
+    with metrics.measure('zip', input=inputFile, subset=inputFile.split('.')[1],
+                         output=arcname):
+        sha = hashlib.sha256()
+        size = 0
+        with open(pathFile, 'rb') as src, archive['zipFile'].open(
+                zipfile.ZipInfo.from_file(pathFile, arcname), 'w', force_zip64=True) as dst:
+            for chunk in iter(lambda: src.read(manifest.hashChunkSize), b''):
+                sha.update(chunk)
+                dst.write(chunk)
+                size = size + len(chunk)
+
+    archive['checksums'][arcname] = {'sha256': sha.hexdigest(), 'bytes': size}
+    archive['pathFiles'].append(pathFile)
+    logger.info('Added '+inputFile+' to zip file '+archive['zipPathFile']+'.')
+
+# Close the zip file
+def closeArchive(archive):
+    '''
+    This function writes the manifest of the zip file, with the sha256 checksum and size
+    of each file, into the zip file, closes it and renames it to its final name, so a
+    partial zip file never has the final name. It returns the zip file path.
+    '''
+    with metrics.measure('zip', input=archive['baseDir']) as record:
+        archive['zipFile'].writestr(archive['baseDir']+'/manifest.json',
+                                    json.dumps({'files': archive['checksums']}, indent=2,
+                                               sort_keys=True))
+        archive['zipFile'].close()
+        os.replace(archive['tmpPathFile'], archive['zipPathFile'])
+        record['outputPathFiles'] = [archive['zipPathFile']]
+
+    logger.info('Zipped '+str(len(archive['checksums']))+' files to zip file '+
+                archive['zipPathFile'])
+    return archive['zipPathFile']
+
+# Remove a partial zip file
+def discardArchive(archive):
+    '''
+    This function closes and removes the temporary file of a zip file that is not complete
+    '''
+    archive['zipFile'].close()
+    os.remove(archive['tmpPathFile'])
 
 @logger.catch
 def main(**kwargs):
@@ -115,31 +297,22 @@ def main(**kwargs):
     This is the main function
     '''
     logger.info('Create cog files in '+kwargs['inputDirPath']+' tiff file.')
-
-    geotiff2cog(inputParamDir = kwargs['inputDirPath'], finalParamDir = kwargs['finalDirPath'])
-
-    logger.info('Created cog files in '+kwargs['inputDirPath']+'.')
-
-    # Zip finalDir into zip file, and then remove the finalDir
-    logger.info('Zip finalDir '+kwargs['finalDirPath'],)
+    metrics.configure(kwargs.get('metricsDir'), 'geotiff2cog')
 
     try:
-        shutil.make_archive(kwargs['finalDirPath'][:-1], 'zip',
-                            root_dir="/".join(kwargs['finalDirPath'].split('/')[:-2]),
-                            base_dir=kwargs['finalDirPath'].split('/')[-2])
-
-        logger.info('Ziped finalDir to FinalDir to zip file '+
-                    "/".join(kwargs['finalDirPath'].split('/')[:-2])+
-                    '/'+kwargs['finalDirPath'].split('/')[-2]+'.zip')
-
-        shutil.rmtree(kwargs['finalDirPath'])
-
-        logger.info('Removed finalDir ' + kwargs['finalDirPath'])
+        zipPathFile = geotiff2cog(inputParamDir = kwargs['inputDirPath'],
+                                  finalParamDir = kwargs['finalDirPath'],
+                                  workers = kwargs['workers'], resume = kwargs.get('resume', False),
+                                  encodingOptions = kwargs.get('encodingOptions'))
 
+        logger.info('Created cog files in '+kwargs['inputDirPath']+', and zipped them to '+
+                    zipPathFile+'.')
     except OSError:
         logger.exception('Error in main')
         logger.flush()
         sys.exit(1)
+    finally:
+        metrics.writePrometheus()
 
     # Use sys.exit(0) to exit from program for k8s
     # logger.info('Use sys.exit(0) to exit from program for k8s')
@@ -155,8 +328,40 @@ if __name__ == "__main__":
                         action="store", dest="inputDir")
     parser.add_argument("--finalDIR", "--finalDir", help="Final directory path",
                         action="store", dest="finalDir")
+    parser.add_argument("--workers", help="Number of cog files created at the same time",
+                        action="store", dest="workers", type=int, default=4)
+    parser.add_argument("--metricsDIR", "--metricsDir", help="Directory of the JSON-lines "
+                        "metrics file and Prometheus textfile of each stage", action="store",
+                        dest="metricsDir", default=None)
+    parser.add_argument("--resume", help="Skip cog files whose manifest shows they were "
+                        "created from the same tiff file by an earlier run",
+                        action="store_true", dest="resume")
+    parser.add_argument("--dataType", help="Data type of the cog files, float64, float32, or "
+                        "int16 or uint16 with a scale and offset, the data type of each tiff "
+                        "file by default", action="store", dest="dataType",
+                        choices=list(cogutils.outputNodata), default=None)
+    parser.add_argument("--scale", help="Scale of the int16 and uint16 data types, the "
+                        "precision values are stored with, 0.01 by default", action="store",
+                        dest="scale", type=float, default=None)
+    parser.add_argument("--offset", help="Offset of the int16 and uint16 data types, which is "
+                        "subtracted from values before they are scaled, 0 by default",
+                        action="store", dest="offset", type=float, default=None)
+    parser.add_argument("--compress", help="Compression of the cog files", action="store",
+                        dest="compress", type=str.upper, choices=cogutils.outputCompressions,
+                        default='DEFLATE')
+    parser.add_argument("--predictor", help="Predictor of DEFLATE and ZSTD compression, 1 for "
+                        "none, 2 for horizontal differencing, 3 for floating point, by default "
+                        "3 for float and 2 for integer data types", action="store",
+                        dest="predictor", type=int, choices=[1, 2, 3], default=None)
+    parser.add_argument("--maxZError", help="Largest error of a stored value with LERC "
+                        "compression, in stored units, 0 for lossless", action="store",
+                        dest="maxZError", type=float, default=None)
 
     args = parser.parse_args()
+    if args.scale is not None and args.scale <= 0:
+        parser.error('--scale must be larger than 0')
+    if args.predictor == 3 and args.dataType is not None and not args.dataType.startswith('float'):
+        parser.error('--predictor 3 can only be used with the float data types')
 
     # Remove old logger and start new logger
     logger.remove()
@@ -178,7 +383,11 @@ if __name__ == "__main__":
     # Check if input file exists and if it does run geotiff2cog function
     if os.path.exists(inputDir):
         try:
-            main(inputDirPath = inputDir, finalDirPath = finalDir)
+            main(inputDirPath = inputDir, finalDirPath = finalDir, workers = args.workers,
+                 metricsDir = args.metricsDir, resume = args.resume,
+                 encodingOptions = {'dataType': args.dataType, 'scale': args.scale,
+                                    'offset': args.offset, 'compress': args.compress,
+                                    'predictor': args.predictor, 'maxZError': args.maxZError})
         except Exception:
             logger.exception("General exception detected %s", '<some unique id so you can investigate further>')
             logger.flush()
@@ -0,0 +1,147 @@
+'''
+manifest.py records a manifest next to each output file, with hashes of what the output
+was made from, so reruns with --resume skip outputs that are already complete.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import json
+import hashlib
+
+import numpy as np
+import netCDF4 as nc
+from loguru import logger
+
+import meshraster
+
+# Modules whose source defines the tool version, since a change to any of them can
+# change the outputs
+toolModules = ['adcirc2geotiff.py', 'geotiff2cog.py', 'meshraster.py', 'weightcache.py',
+               'cogutils.py', 'bandstats.py']
+
+# Size of the chunks files are hashed in
+hashChunkSize = 16*1024**2
+
+# Hashes computed by this process, which do not change during a run
+hashState = {}
+
+# Get the tool version
+def getToolVersion():
+    '''
+    This function returns a sha256 hash of the source of the modules in toolModules
+    '''
+    if 'toolVersion' not in hashState:
+        sha = hashlib.sha256()
+        for module in toolModules:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), 'rb') as f:
+                sha.update(f.read())
+        hashState['toolVersion'] = sha.hexdigest()
+
+    return hashState['toolVersion']
+
+# Hash a file
+def getFileHash(pathFile):
+    '''
+    This function returns a sha256 hash of the content of a file, read in chunks
+    '''
+    sha = hashlib.sha256()
+    with open(pathFile, 'rb') as f:
+        for chunk in iter(lambda: f.read(hashChunkSize), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+# Hash the mesh and a variable at a timestep of an ADCIRC netCDF file
+def getInputHash(inputPathFile, timeStep=0, variableName=None):
+    '''
+    This function returns a sha256 hash of the mesh coordinates and connectivity, and
+    of the node values of the variable that is regridded at timeStep. The mesh hash is
+    computed once per file, and the hash of each variable and timestep once, as every
+    subset of a timestep has the same input hash.
+    '''
+    valuesKey = ('values', inputPathFile, variableName, timeStep)
+    if valuesKey in hashState:
+        return hashState[valuesKey]
+
+    if ('mesh', inputPathFile) not in hashState:
+        sha = hashlib.sha256()
+        with nc.Dataset(inputPathFile) as ds:
+            for name in ['x', 'y', 'element']:
+                sha.update(np.ascontiguousarray(ds.variables[name][:]).tobytes())
+        hashState[('mesh', inputPathFile)] = sha.hexdigest()
+
+    with nc.Dataset(inputPathFile) as ds:
+        variableName = meshraster.getVariableName(ds, variableName)
+
+    sha = hashlib.sha256(hashState[('mesh', inputPathFile)].encode())
+    sha.update(variableName.encode())
+    sha.update(meshraster.readVariable(inputPathFile, variableName, timeStep).tobytes())
+    hashState[valuesKey] = sha.hexdigest()
+    return hashState[valuesKey]
+
+# Get the manifest file of an output file
+def getManifestPathFile(outputPathFile):
+    '''
+    This function returns the manifest file name of an output file
+    '''
+    return outputPathFile+'.manifest.json'
+
+# Get the JSON form of a manifest
+def getManifestJson(manifest):
+    '''
+    This function returns a manifest as JSON text with sorted keys, which is how
+    manifests are compared. A manifest read back from its file compares equal to the
+    one it was written from, even with NaN values, such as the nodata of float
+    encodings, which are not equal to themselves, and tuples, which are read as lists.
+    '''
+    return json.dumps(manifest, sort_keys=True)
+
+# Check if an output file is complete
+def isComplete(outputPathFile, manifest):
+    '''
+    This function returns True if the output file exists, and its manifest matches
+    manifest and the size of the output file
+    '''
+    try:
+        with open(getManifestPathFile(outputPathFile)) as manifestFile:
+            saved = json.load(manifestFile)
+        outputBytes = os.path.getsize(outputPathFile)
+    except (OSError, ValueError):
+        return False
+
+    return getManifestJson(saved) == getManifestJson(dict(manifest, outputBytes=outputBytes))
+
+# Write the manifest of a complete output file
+def writeManifest(outputPathFile, manifest):
+    '''
+    This function writes the manifest of an output file, with the size of the output
+    file. It is written to a temporary file and renamed, so a manifest is never partial.
+    It is then checked to match manifest when it is read back, so an output that a rerun
+    with resume would not skip is found when it is written.
+    '''
+    tmpPathFile = getManifestPathFile(outputPathFile)+'.tmp'+str(os.getpid())
+    with open(tmpPathFile, 'w') as manifestFile:
+        json.dump(dict(manifest, outputBytes=os.path.getsize(outputPathFile)), manifestFile,
+                  indent=2)
+    os.replace(tmpPathFile, getManifestPathFile(outputPathFile))
+
+    if not isComplete(outputPathFile, manifest):
+        logger.warning('The manifest of '+outputPathFile+' does not match when it is read '
+                       'back, so a rerun with resume will not skip it.')
+
+# Remove the manifest of an output file
+def removeManifest(outputPathFile):
+    '''
+    This function removes the manifest of an output file that is being rewritten
+    '''
+    try:
+        os.remove(getManifestPathFile(outputPathFile))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,673 @@
+'''
+meshraster.py regrids an ADCIRC unstructured triangular grid onto a regular
+raster with NumPy, using linear (barycentric) interpolation within each triangle.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import json
+
+import numpy as np
+import netCDF4 as nc
+from loguru import logger
+
+# Variables in an ADCIRC netCDF file that describe the mesh, and not data on the mesh
+meshVariables = ['x', 'y', 'element', 'depth', 'adcirc_mesh']
+
+# Default maximum number of candidate pixels tested against triangles at once
+candidateChunkSize = 4000000
+
+# Average number of triangles in each bucket of the spatial index
+trianglesPerBucket = 8
+
+# Approximate bytes of memory used for each pixel of a rendered window, and for each
+# candidate pixel tested against a triangle
+bytesPerPixel = 80
+bytesPerCandidate = 200
+
+# Number of rows of mesh variables read at once by loadMeshSubset
+ingestChunkSize = 1000000
+
+# Tolerance used when testing if a pixel center is inside a triangle
+insideTolerance = 1e-9
+
+# Tolerance, in pixels, used when expanding an extent to whole pixels
+gridTolerance = 1e-6
+
+# Percentile of the sizes of the elements in an extent that its adaptive pixel size is
+# derived from, and the number of pixels across an element of that size
+adaptivePercentile = 10
+pixelsPerElement = 2
+
+# Earth radius, and tile size in pixels, of the Web Mercator tile grid (WebMercatorQuad)
+mercatorRadius = 6378137.0
+mercatorTileSize = 256
+
+# Load the mesh topology and node coordinates
+def loadMesh(inputPathFile):
+    '''
+    This function reads the x, y and element variables from an ADCIRC netCDF file,
+    and returns them as a dictionary with zero based element node indices
+    '''
+    logger.info('Load mesh from '+inputPathFile+'.')
+    with nc.Dataset(inputPathFile) as ds:
+        x = np.asarray(ds.variables['x'][:], dtype=np.float64)
+        y = np.asarray(ds.variables['y'][:], dtype=np.float64)
+        elementVar = ds.variables['element']
+        startIndex = int(getattr(elementVar, 'start_index', 1))
+        element = np.asarray(elementVar[:], dtype=np.int32) - startIndex
+
+    return {'x': x, 'y': y, 'element': element, 'elementCount': len(element)}
+
+# Load the node coordinates and element count
+def loadMeshCoordinates(inputPathFile):
+    '''
+    This function reads the x and y variables, and the number of elements, from an
+    ADCIRC netCDF file, which is all checkMesh needs
+    '''
+    with nc.Dataset(inputPathFile) as ds:
+        return {'x': readChunked(ds.variables['x'], np.float64),
+                'y': readChunked(ds.variables['y'], np.float64),
+                'elementCount': ds.variables['element'].shape[0]}
+
+# Read a variable in chunks
+def readChunked(var, dtype):
+    '''
+    This function reads a netCDF variable ingestChunkSize rows at a time into an array
+    '''
+    values = np.empty(var.shape, dtype=dtype)
+    for start in range(0, var.shape[0], ingestChunkSize):
+        values[start:start+ingestChunkSize] = var[start:start+ingestChunkSize]
+    return values
+
+# Load the part of the mesh inside an extent
+def loadMeshSubset(inputPathFile, inputExtent):
+    '''
+    This function reads the elements whose bounding box overlaps an extent string
+    (xmin,xmax,ymin,ymax) in chunks, and returns them as a mesh dictionary with only
+    the nodes of those elements. nodeIndex has the index of each node in the file.
+    '''
+    xmin, xmax, ymin, ymax = [float(value) for value in inputExtent.split(',')]
+    logger.info('Load mesh inside extent '+inputExtent+' from '+inputPathFile+'.')
+    with nc.Dataset(inputPathFile) as ds:
+        x = readChunked(ds.variables['x'], np.float64)
+        y = readChunked(ds.variables['y'], np.float64)
+        elementVar = ds.variables['element']
+        startIndex = int(getattr(elementVar, 'start_index', 1))
+
+        # Keep the elements of each chunk that overlap the extent
+        elements = [np.zeros((0, 3), dtype=np.int32)]
+        for start in range(0, elementVar.shape[0], ingestChunkSize):
+            element = np.asarray(elementVar[start:start+ingestChunkSize],
+                                 dtype=np.int32) - startIndex
+            tx = x[element]
+            ty = y[element]
+            overlaps = ((tx.max(axis=1) >= xmin) & (tx.min(axis=1) <= xmax) &
+                        (ty.max(axis=1) >= ymin) & (ty.min(axis=1) <= ymax))
+            elements.append(element[overlaps])
+
+    # Number the nodes of the kept elements from zero
+    nodeIndex, element = np.unique(np.concatenate(elements), return_inverse=True)
+    element = element.reshape(-1, 3).astype(np.int32)
+    logger.info('Loaded '+str(len(element))+' elements and '+str(len(nodeIndex))+
+                ' nodes inside extent '+inputExtent+'.')
+
+    return {'x': x[nodeIndex], 'y': y[nodeIndex], 'element': element, 'nodeIndex': nodeIndex}
+
+# Check that a file is on a mesh
+def checkMesh(mesh, inputPathFile):
+    '''
+    This function checks that the ADCIRC netCDF file has the same number of elements,
+    and the same node coordinates, as the mesh, and raises an exception if it does not
+    '''
+    logger.info('Check mesh of '+inputPathFile+'.')
+    with nc.Dataset(inputPathFile) as ds:
+        if (ds.variables['x'].shape != mesh['x'].shape or
+                ds.variables['element'].shape[0] != mesh['elementCount'] or
+                not np.array_equal(np.asarray(ds.variables['x'][:], dtype=np.float64), mesh['x']) or
+                not np.array_equal(np.asarray(ds.variables['y'][:], dtype=np.float64), mesh['y'])):
+            raise Exception('The netCDF file '+inputPathFile+' is not on the same mesh.')
+
+# Find the name of the variable to regrid
+def getVariableName(ds, variableName=None):
+    '''
+    This function returns the name of the first data variable defined on the mesh nodes,
+    which is the variable QGIS uses as dataset group 1, unless variableName is given
+    '''
+    if variableName is not None:
+        if variableName not in ds.variables:
+            raise Exception('Variable '+variableName+' is not in the netCDF file.')
+        return variableName
+
+    for name, var in ds.variables.items():
+        if name in meshVariables or name.startswith('time_of'):
+            continue
+        if len(var.dimensions) > 0 and var.dimensions[-1] == 'node':
+            return name
+
+    raise Exception('The netCDF file has no data variable on the mesh nodes.')
+
+# Read the node values of a variable
+def readVariable(inputPathFile, variableName=None, timeStep=0):
+    '''
+    This function reads the node values of a variable at a timestep, and returns them
+    as float64 with fill values replaced by NaN
+    '''
+    with nc.Dataset(inputPathFile) as ds:
+        var = ds.variables[getVariableName(ds, variableName)]
+        if len(var.dimensions) > 1:
+            values = var[timeStep, :]
+        else:
+            values = var[:]
+
+    return np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+
+# Get the number of timesteps of a variable
+def getTimeStepCount(inputPathFile, variableName=None):
+    '''
+    This function returns the number of timesteps of a variable, which is 1 for
+    variables without a time dimension, like zeta_max
+    '''
+    with nc.Dataset(inputPathFile) as ds:
+        var = ds.variables[getVariableName(ds, variableName)]
+        if len(var.dimensions) > 1:
+            return var.shape[0]
+        return 1
+
+# Get the number of timesteps read at once
+def getFrameChunk(nodeCount, memoryBudget):
+    '''
+    This function returns the number of timesteps of node values that fit in a quarter
+    of a memory budget, and at least one
+    '''
+    return max(memoryBudget//4//(nodeCount*8), 1)
+
+# Read the node values of a variable one chunk of timesteps at a time
+def iterVariable(inputPathFile, timeSteps, frameChunk, variableName=None, nodeIndex=None):
+    '''
+    This generator reads the node values of a variable for timeSteps, frameChunk
+    timesteps at a time, and yields a dictionary of node values by timestep for each
+    chunk, with fill values replaced by NaN. If nodeIndex is given, only the values of
+    those nodes are returned, and only the range of nodes they span is read.
+    '''
+    if nodeIndex is not None and len(nodeIndex) > 0:
+        nodeSlice = slice(int(nodeIndex[0]), int(nodeIndex[-1]) + 1)
+        nodeOffsets = nodeIndex - nodeIndex[0]
+    else:
+        nodeSlice = slice(0, 0) if nodeIndex is not None else slice(None)
+        nodeOffsets = None
+
+    with nc.Dataset(inputPathFile) as ds:
+        var = ds.variables[getVariableName(ds, variableName)]
+        for start in range(0, len(timeSteps), frameChunk):
+            chunkTimeSteps = timeSteps[start:start+frameChunk]
+            logger.info('Read node values for timesteps '+str(chunkTimeSteps[0])+' to '+
+                        str(chunkTimeSteps[-1])+' from '+inputPathFile+'.')
+            if len(var.dimensions) > 1:
+                values = var[chunkTimeSteps, nodeSlice]
+            else:
+                values = var[nodeSlice][np.newaxis]
+            values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+            if nodeOffsets is not None:
+                values = values[:, nodeOffsets]
+
+            yield {timeStep: values[index] for index, timeStep in enumerate(chunkTimeSteps)}
+
+# Save the mesh for other processes
+def shareMesh(mesh, sharedDir):
+    '''
+    This function saves the mesh arrays, and the triangle arrays and spatial index
+    built from them, as .npy files in sharedDir, so other processes can memory map them
+    with openSharedMesh instead of building them again
+    '''
+    os.makedirs(sharedDir, exist_ok=True)
+    for name in ['x', 'y', 'element']:
+        np.save(os.path.join(sharedDir, name+'.npy'), mesh[name])
+    if len(mesh['element']) > 0:
+        for name, values in getTriangles(mesh).items():
+            np.save(os.path.join(sharedDir, 'triangles.'+name+'.npy'), values)
+        index = getSpatialIndex(mesh)
+        for name in ['bucketStart', 'triangles']:
+            np.save(os.path.join(sharedDir, 'index.'+name+'.npy'), index[name])
+        with open(os.path.join(sharedDir, 'index.json'), 'w', encoding='utf-8') as indexFile:
+            json.dump({name: index[name] for name in ['xmin', 'ymin', 'bucketSize', 'nbx', 'nby']},
+                      indexFile)
+    if 'hash' in mesh:
+        with open(os.path.join(sharedDir, 'hash'), 'w', encoding='utf-8') as hashFile:
+            hashFile.write(mesh['hash'])
+
+# Memory map the mesh saved by shareMesh
+def openSharedMesh(sharedDir):
+    '''
+    This function memory maps the mesh arrays, and the triangle arrays and spatial index,
+    saved by shareMesh
+    '''
+    mesh = {}
+    for name in ['x', 'y', 'element']:
+        mesh[name] = np.load(os.path.join(sharedDir, name+'.npy'), mmap_mode='r')
+    if os.path.exists(os.path.join(sharedDir, 'index.json')):
+        mesh['triangles'] = {name: np.load(os.path.join(sharedDir, 'triangles.'+name+'.npy'),
+                                           mmap_mode='r')
+                             for name in ['tx', 'ty', 'xmin', 'xmax', 'ymin', 'ymax', 'det']}
+        with open(os.path.join(sharedDir, 'index.json'), encoding='utf-8') as indexFile:
+            mesh['index'] = json.load(indexFile)
+        for name in ['bucketStart', 'triangles']:
+            mesh['index'][name] = np.load(os.path.join(sharedDir, 'index.'+name+'.npy'),
+                                          mmap_mode='r')
+    if os.path.exists(os.path.join(sharedDir, 'hash')):
+        with open(os.path.join(sharedDir, 'hash'), encoding='utf-8') as hashFile:
+            mesh['hash'] = hashFile.read()
+
+    return mesh
+
+# Save the node values of a timestep for other processes
+def shareValues(values, sharedDir, timeStep):
+    '''
+    This function saves the node values of a timestep as a .npy file in sharedDir, so
+    other processes can memory map them with openSharedValues
+    '''
+    np.save(os.path.join(sharedDir, 'values'+str(timeStep)+'.npy'), values)
+
+# Memory map the node values saved by shareValues
+def openSharedValues(sharedDir, timeStep):
+    '''
+    This function memory maps the node values of a timestep saved by shareValues
+    '''
+    return np.load(os.path.join(sharedDir, 'values'+str(timeStep)+'.npy'), mmap_mode='r')
+
+# Remove the node values saved by shareValues
+def unshareValues(sharedDir, timeStep):
+    '''
+    This function removes the node values of a timestep saved by shareValues
+    '''
+    os.remove(os.path.join(sharedDir, 'values'+str(timeStep)+'.npy'))
+
+# Get the number of pixels in the raster grid for an extent
+def getGridSize(inputExtent, mapUnitPP):
+    '''
+    This function returns the number of pixels getGrid would create for an extent
+    '''
+    grid = getGrid(inputExtent, mapUnitPP)
+    return grid['width']*grid['height']
+
+# Define the raster grid for an extent
+def getGrid(inputExtent, mapUnitPP):
+    '''
+    This function returns the raster grid for an extent string (xmin,xmax,ymin,ymax),
+    and the pixel center coordinates. Pixels are mapUnitPP square, as QGIS
+    exportRasterBlock only renders square pixels, and the extent is expanded to whole
+    multiples of mapUnitPP, so the pixels of grids whose mapUnitPP are multiples of each
+    other line up.
+    '''
+    xmin, xmax, ymin, ymax = [float(value) for value in inputExtent.split(',')]
+    xmin = np.floor(xmin/mapUnitPP + gridTolerance)*mapUnitPP
+    ymax = np.ceil(ymax/mapUnitPP - gridTolerance)*mapUnitPP
+    width = int(np.ceil((xmax - xmin)/mapUnitPP - gridTolerance))
+    height = int(np.ceil((ymax - ymin)/mapUnitPP - gridTolerance))
+    xmax = xmin + width*mapUnitPP
+    ymin = ymax - height*mapUnitPP
+    resX = resY = mapUnitPP
+
+    return {'xmin': xmin, 'xmax': xmax, 'ymin': ymin, 'ymax': ymax,
+            'width': width, 'height': height, 'resX': resX, 'resY': resY,
+            'xs': xmin + (np.arange(width) + 0.5)*resX,
+            'ys': ymax - (np.arange(height) + 0.5)*resY, 'crs': 'EPSG:4326'}
+
+# Define the Web Mercator raster grid for an extent
+def getMercatorGrid(inputExtent, mapUnitPP, zoom=None):
+    '''
+    This function returns the raster grid for an extent string (xmin,xmax,ymin,ymax) on
+    the Web Mercator tile grid, which is the grid rio cogeo --web-optimized reprojects
+    the getGrid raster to. The zoom level is the one whose resolution is closest to the
+    resolution of that raster, unless zoom is given. The grid bounds are in EPSG:3857,
+    and xs and ys have the longitude and latitude of the pixel centers, which are
+    separable because Web Mercator x only depends on longitude, and y on latitude.
+    '''
+    xmin, xmax, ymin, ymax = [float(value) for value in inputExtent.split(',')]
+    worldSize = 2*np.pi*mercatorRadius
+    left, bottom = lonLatToMercator(xmin, ymin)
+    right, top = lonLatToMercator(xmax, ymax)
+
+    # Choose the zoom level, from the resolution that keeps the number of pixels along
+    # the diagonal, as GDAL does when it reprojects
+    if zoom is None:
+        width = int((xmax - xmin)/mapUnitPP)
+        height = int((ymax - ymin)/mapUnitPP)
+        resolution = np.hypot(right - left, top - bottom)/np.hypot(width, height)
+        zoom = max(int(round(np.log2(worldSize/(mercatorTileSize*resolution)))), 0)
+    cellSize = worldSize/(mercatorTileSize*2**zoom)
+
+    # Expand the bounds to whole tiles
+    tileSpan = cellSize*mercatorTileSize
+    gridLeft = -worldSize/2 + np.floor((left + worldSize/2)/tileSpan)*tileSpan
+    gridTop = worldSize/2 - np.floor((worldSize/2 - top)/tileSpan)*tileSpan
+    gridRight = -worldSize/2 + (np.floor((right + worldSize/2)/tileSpan) + 1)*tileSpan
+    gridBottom = worldSize/2 - (np.floor((worldSize/2 - bottom)/tileSpan) + 1)*tileSpan
+    width = int(round((gridRight - gridLeft)/cellSize))
+    height = int(round((gridTop - gridBottom)/cellSize))
+
+    xs, ys = mercatorToLonLat(gridLeft + (np.arange(width) + 0.5)*cellSize,
+                              gridTop - (np.arange(height) + 0.5)*cellSize)
+    return {'xmin': gridLeft, 'xmax': gridRight, 'ymin': gridBottom, 'ymax': gridTop,
+            'width': width, 'height': height, 'resX': cellSize, 'resY': cellSize,
+            'xs': xs, 'ys': ys, 'crs': 'EPSG:3857', 'zoom': zoom}
+
+# Define the rows of a raster grid
+def getSubGrid(grid, row0, row1):
+    '''
+    This function returns the grid of rows row0 to row1 of a grid, which is a band of
+    the grid with the same columns
+    '''
+    subGrid = dict(grid)
+    subGrid.update({'ymax': grid['ymax'] - row0*grid['resY'],
+                    'ymin': grid['ymax'] - row1*grid['resY'],
+                    'height': row1 - row0, 'ys': grid['ys'][row0:row1]})
+    return subGrid
+
+# Convert longitude and latitude to Web Mercator
+def lonLatToMercator(lon, lat):
+    '''
+    This function returns the EPSG:3857 x and y of a longitude and latitude in degrees
+    '''
+    return (mercatorRadius*np.radians(lon),
+            mercatorRadius*np.log(np.tan(np.pi/4 + np.radians(lat)/2)))
+
+# Convert Web Mercator to longitude and latitude
+def mercatorToLonLat(x, y):
+    '''
+    This function returns the longitude and latitude in degrees of an EPSG:3857 x and y
+    '''
+    return (np.degrees(x/mercatorRadius),
+            np.degrees(2*np.arctan(np.exp(y/mercatorRadius)) - np.pi/2))
+
+# Get the center and size of each element
+def getElementSizes(inputPathFile):
+    '''
+    This function reads the elements of an ADCIRC netCDF file in chunks, and returns the
+    x and y of their centers, and their mean edge length in map units
+    '''
+    logger.info('Get element sizes from '+inputPathFile+'.')
+    with nc.Dataset(inputPathFile) as ds:
+        x = readChunked(ds.variables['x'], np.float64)
+        y = readChunked(ds.variables['y'], np.float64)
+        elementVar = ds.variables['element']
+        startIndex = int(getattr(elementVar, 'start_index', 1))
+
+        centerX = np.empty(elementVar.shape[0], dtype=np.float32)
+        centerY = np.empty(elementVar.shape[0], dtype=np.float32)
+        sizes = np.empty(elementVar.shape[0], dtype=np.float32)
+        for start in range(0, elementVar.shape[0], ingestChunkSize):
+            element = np.asarray(elementVar[start:start+ingestChunkSize],
+                                 dtype=np.int32) - startIndex
+            tx = x[element]
+            ty = y[element]
+            centerX[start:start+len(element)] = tx.mean(axis=1)
+            centerY[start:start+len(element)] = ty.mean(axis=1)
+            sizes[start:start+len(element)] = np.hypot(tx - np.roll(tx, 1, axis=1),
+                                                       ty - np.roll(ty, 1, axis=1)).mean(axis=1)
+
+    return centerX, centerY, sizes
+
+# Get the pixel size of an extent from the size of its elements
+def getAdaptiveResolution(elementSizes, inputExtent, minMapUnitPP, maxMapUnitPP):
+    '''
+    This function returns the pixel size of an extent string (xmin,xmax,ymin,ymax), which
+    is the adaptivePercentile of the sizes of the elements centered in it divided by
+    pixelsPerElement. It is rounded down to minMapUnitPP times a power of two, and is at
+    most the largest of those that is not more than maxMapUnitPP, so getGrid lines up the
+    pixels of the grids of different extents. An extent with no elements gets that
+    largest pixel size.
+    '''
+    centerX, centerY, sizes = elementSizes
+    xmin, xmax, ymin, ymax = [float(value) for value in inputExtent.split(',')]
+    maxPower = max(int(np.floor(np.log2(maxMapUnitPP/minMapUnitPP) + gridTolerance)), 0)
+    inside = (centerX >= xmin) & (centerX <= xmax) & (centerY >= ymin) & (centerY <= ymax)
+    if not inside.any():
+        return minMapUnitPP*2**maxPower
+
+    mapUnitPP = float(np.percentile(sizes[inside], adaptivePercentile))/pixelsPerElement
+    if mapUnitPP <= minMapUnitPP:
+        return minMapUnitPP
+
+    return minMapUnitPP*2**min(int(np.floor(np.log2(mapUnitPP/minMapUnitPP))), maxPower)
+
+# Get the triangle vertex coordinates and bounds of the mesh
+def getTriangles(mesh):
+    '''
+    This function returns the vertex coordinates, bounding boxes and barycentric
+    determinants of the mesh triangles, which are computed once and kept in the
+    mesh dictionary
+    '''
+    if 'triangles' not in mesh:
+        tx = mesh['x'][mesh['element']]
+        ty = mesh['y'][mesh['element']]
+        mesh['triangles'] = {'tx': tx, 'ty': ty,
+                             'xmin': tx.min(axis=1), 'xmax': tx.max(axis=1),
+                             'ymin': ty.min(axis=1), 'ymax': ty.max(axis=1),
+                             'det': ((ty[:, 1] - ty[:, 2])*(tx[:, 0] - tx[:, 2]) +
+                                     (tx[:, 2] - tx[:, 1])*(ty[:, 0] - ty[:, 2]))}
+
+    return mesh['triangles']
+
+# Build a bucket grid spatial index over the mesh triangles
+def getSpatialIndex(mesh):
+    '''
+    This function returns a bucket grid over the mesh bounding box, with the triangles
+    whose bounding box overlaps each bucket in compressed sparse row form. It is built
+    once and kept in the mesh dictionary.
+    '''
+    if 'index' not in mesh:
+        triangles = getTriangles(mesh)
+        xmin, xmax = float(triangles['xmin'].min()), float(triangles['xmax'].max())
+        ymin, ymax = float(triangles['ymin'].min()), float(triangles['ymax'].max())
+
+        # Size the buckets so there are about trianglesPerBucket triangles in each
+        bucketCount = max(len(triangles['xmin'])//trianglesPerBucket, 1)
+        bucketSize = max(np.sqrt((xmax - xmin)*(ymax - ymin)/bucketCount), 1e-9)
+        nbx = int((xmax - xmin)/bucketSize) + 1
+        nby = int((ymax - ymin)/bucketSize) + 1
+
+        # Get the range of buckets each triangle bounding box overlaps
+        bx0 = ((triangles['xmin'] - xmin)/bucketSize).astype(np.int64)
+        bx1 = ((triangles['xmax'] - xmin)/bucketSize).astype(np.int64)
+        by0 = ((triangles['ymin'] - ymin)/bucketSize).astype(np.int64)
+        by1 = ((triangles['ymax'] - ymin)/bucketSize).astype(np.int64)
+        nbxs = bx1 - bx0 + 1
+        counts = nbxs*(by1 - by0 + 1)
+
+        # Expand each triangle into the buckets it overlaps, and sort them by bucket
+        tri = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(tri)) - np.repeat(np.cumsum(counts) - counts, counts)
+        buckets = (by0[tri] + offsets // nbxs[tri])*nbx + bx0[tri] + offsets % nbxs[tri]
+        order = np.argsort(buckets, kind='stable')
+        bucketStart = np.zeros(nbx*nby + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=nbx*nby), out=bucketStart[1:])
+
+        mesh['index'] = {'xmin': xmin, 'ymin': ymin, 'bucketSize': bucketSize,
+                         'nbx': nbx, 'nby': nby, 'bucketStart': bucketStart,
+                         'triangles': tri[order].astype(np.int32)}
+
+    return mesh['index']
+
+# Find the triangles whose bounding box overlaps a box
+def queryTriangles(mesh, xmin, xmax, ymin, ymax):
+    '''
+    This function returns the sorted indices of the triangles whose bounding box
+    overlaps the box, using the spatial index
+    '''
+    index = getSpatialIndex(mesh)
+    bx0 = max(int((xmin - index['xmin'])//index['bucketSize']), 0)
+    bx1 = min(int((xmax - index['xmin'])//index['bucketSize']), index['nbx'] - 1)
+    by0 = max(int((ymin - index['ymin'])//index['bucketSize']), 0)
+    by1 = min(int((ymax - index['ymin'])//index['bucketSize']), index['nby'] - 1)
+    if bx0 > bx1 or by0 > by1:
+        return np.zeros(0, dtype=np.int32)
+
+    # Gather the triangles of each row of buckets, which are contiguous
+    bucketStart = index['bucketStart']
+    found = [index['triangles'][bucketStart[by*index['nbx'] + bx0]:
+                                bucketStart[by*index['nbx'] + bx1 + 1]]
+             for by in range(by0, by1 + 1)]
+    found = np.unique(np.concatenate(found))
+
+    # Keep the triangles whose bounding box overlaps the box
+    triangles = getTriangles(mesh)
+    overlaps = ((triangles['xmax'][found] >= xmin) & (triangles['xmin'][found] <= xmax) &
+                (triangles['ymax'][found] >= ymin) & (triangles['ymin'][found] <= ymax))
+    return found[overlaps]
+
+# Get the window size and candidate chunk size that fit a memory budget
+def getWindowLimits(memoryBudget):
+    '''
+    This function splits a memory budget in bytes between the pixels of a window and
+    the candidate pixels tested at once, and returns the maximum number of each
+    '''
+    maxPixels = max(memoryBudget//2//bytesPerPixel, 1)
+    chunkSize = max(memoryBudget//2//bytesPerCandidate, 1)
+    return maxPixels, chunkSize
+
+# Split a raster grid into windows of whole blocks
+def getWindows(grid, blockSize, maxPixels):
+    '''
+    This function returns the (row0, col0, nrows, ncols) windows a raster grid is
+    rendered in. Windows are made of whole blockSize by blockSize blocks, are as wide
+    as the grid when possible, and have at most maxPixels pixels, but are never
+    smaller than one block.
+    '''
+    blocksPerWindow = max(maxPixels//(blockSize*blockSize), 1)
+    blocksPerRow = -(-grid['width']//blockSize)
+    if blocksPerWindow >= blocksPerRow:
+        ncols = grid['width']
+        nrows = blockSize*(blocksPerWindow//blocksPerRow)
+    else:
+        ncols = blockSize*blocksPerWindow
+        nrows = blockSize
+
+    for row0 in range(0, grid['height'], nrows):
+        for col0 in range(0, grid['width'], ncols):
+            yield (row0, col0, min(nrows, grid['height'] - row0),
+                   min(ncols, grid['width'] - col0))
+
+# Get the extent QGIS renders a window of a raster grid from
+def getWindowExtent(grid, window):
+    '''
+    This function returns the (xmin, ymin, xmax, ymax) extent that QGIS exportRasterBlock
+    renders a (row0, col0, nrows, ncols) window of a grid from. exportRasterBlock samples
+    the top left corner of each pixel of the extent, so the extent is moved half a pixel
+    right and down to sample the pixel centers computeWeights uses. It is padded by a
+    small fraction of a pixel, so exportRasterBlock rounds down to the window size.
+    '''
+    row0, col0, nrows, ncols = window
+    pad = grid['resX']*1e-6
+    xmin = grid['xmin'] + (col0 + 0.5)*grid['resX']
+    ymax = grid['ymax'] - (row0 + 0.5)*grid['resY']
+    return (xmin, ymax - nrows*grid['resY'] - pad, xmin + ncols*grid['resX'] + pad, ymax)
+
+# Find the triangle, and barycentric weights, for each pixel
+def computeWeights(mesh, xs, ys, chunkSize=candidateChunkSize):
+    '''
+    This function locates each pixel center (xs, ys) in the mesh, and returns the
+    element index for each pixel (-1 if outside the mesh), and the three barycentric
+    weights of that element's nodes. At most chunkSize candidate pixels are tested
+    at once.
+    '''
+    elemIndex = np.full((len(ys), len(xs)), -1, dtype=np.int32)
+    weights = np.zeros((len(ys), len(xs), 3), dtype=np.float32)
+    if len(mesh['element']) == 0:
+        return elemIndex, weights
+    triangles = getTriangles(mesh)
+
+    # Only test the triangles the spatial index finds near the pixels
+    triangleIds = queryTriangles(mesh, xs[0], xs[-1], ys[-1], ys[0])
+    if len(triangleIds) == 0:
+        return elemIndex, weights
+
+    # Get the range of pixel columns and rows that each triangle bounding box covers.
+    # Rows run from north to south, so search ys in reverse order.
+    col0 = np.searchsorted(xs, triangles['xmin'][triangleIds], side='left')
+    col1 = np.searchsorted(xs, triangles['xmax'][triangleIds], side='right')
+    row0 = np.searchsorted(-ys, -triangles['ymax'][triangleIds], side='left')
+    row1 = np.searchsorted(-ys, -triangles['ymin'][triangleIds], side='right')
+    ncols = col1 - col0
+    nrows = row1 - row0
+    counts = ncols.astype(np.int64)*nrows.astype(np.int64)
+
+    # Only triangles that cover at least one pixel center are tested
+    candidates = np.nonzero(counts > 0)[0]
+    if len(candidates) == 0:
+        return elemIndex, weights
+
+    # Get barycentric coefficients
+    tx = triangles['tx'][triangleIds]
+    ty = triangles['ty'][triangleIds]
+    det = triangles['det'][triangleIds]
+
+    # Test candidate pixels in chunks of triangles, to bound memory
+    cumCounts = np.cumsum(counts[candidates])
+    start = 0
+    while start < len(candidates):
+        base = cumCounts[start - 1] if start > 0 else 0
+        stop = max(int(np.searchsorted(cumCounts, base + chunkSize, side='right')),
+                   start + 1)
+        tri = candidates[start:stop]
+        triCounts = counts[tri]
+
+        # Expand each triangle into the pixels in its bounding box
+        candTri = np.repeat(tri, triCounts)
+        offsets = np.arange(len(candTri)) - np.repeat(np.cumsum(triCounts) - triCounts, triCounts)
+        rows = row0[candTri] + offsets // ncols[candTri]
+        cols = col0[candTri] + offsets % ncols[candTri]
+        px = xs[cols] - tx[candTri, 2]
+        py = ys[rows] - ty[candTri, 2]
+
+        # Compute barycentric weights, and keep pixels inside the triangle
+        with np.errstate(divide='ignore', invalid='ignore'):
+            l1 = ((ty[candTri, 1] - ty[candTri, 2])*px +
+                  (tx[candTri, 2] - tx[candTri, 1])*py)/det[candTri]
+            l2 = ((ty[candTri, 2] - ty[candTri, 0])*px +
+                  (tx[candTri, 0] - tx[candTri, 2])*py)/det[candTri]
+        l3 = 1.0 - l1 - l2
+        inside = ((l1 >= -insideTolerance) & (l2 >= -insideTolerance) &
+                  (l3 >= -insideTolerance) & (det[candTri] != 0))
+
+        rows = rows[inside]
+        cols = cols[inside]
+        elemIndex[rows, cols] = triangleIds[candTri[inside]]
+        weights[rows, cols, 0] = l1[inside]
+        weights[rows, cols, 1] = l2[inside]
+        weights[rows, cols, 2] = l3[inside]
+
+        start = stop
+
+    return elemIndex, weights
+
+# Split a window into its blocks
+def getBlocks(window, blockSize):
+    '''
+    This function returns the (row0, col0, nrows, ncols) blocks of a window, relative
+    to the window
+    '''
+    row0, col0, nrows, ncols = window
+    return [(blockRow, blockCol, min(blockSize, nrows - blockRow), min(blockSize, ncols - blockCol))
+            for blockRow in range(0, nrows, blockSize) for blockCol in range(0, ncols, blockSize)]
+
+# Interpolate node values onto pixels
+def interpolate(mesh, values, elemIndex, weights):
+    '''
+    This function interpolates node values onto pixels, using the element index and
+    barycentric weights from computeWeights. Pixels outside the mesh, or in elements
+    with a NaN node value, are NaN.
+    '''
+    raster = np.full(elemIndex.shape, np.nan, dtype=np.float64)
+    valid = elemIndex >= 0
+    nodes = mesh['element'][elemIndex[valid]]
+    raster[valid] = (values[nodes]*weights[valid]).sum(axis=1)
+
+    return raster
@@ -0,0 +1,219 @@
+'''
+metrics.py records the duration, peak memory, pixel count, nodata fraction and output
+bytes of each stage of adcirc2geotiff.py and geotiff2cog.py, in a JSON-lines metrics
+file and a Prometheus textfile collector file.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import json
+import time
+import resource
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from loguru import logger
+
+# Metrics state of this process. Worker processes started by fork inherit it.
+metricsState = {'metricsDir': None, 'script': None, 'runId': None, 'stack': []}
+
+# Labels of the Prometheus metrics, in the order they are written
+promLabels = ['script', 'stage', 'input', 'subset', 'output']
+
+# Prometheus metrics written for each record, with the record field they are taken from
+promMetrics = [('adcirc2cog_stage_duration_seconds', 'seconds',
+                'Wall time of a pipeline stage in seconds'),
+               ('adcirc2cog_stage_peak_memory_bytes', 'peakMemoryBytes',
+                'Peak resident set size of the process during a pipeline stage'),
+               ('adcirc2cog_stage_pixels', 'pixels',
+                'Number of pixels in the raster of a pipeline stage'),
+               ('adcirc2cog_stage_nodata_ratio', 'nodataFraction',
+                'Fraction of the pixels of a pipeline stage that are nodata'),
+               ('adcirc2cog_stage_output_bytes', 'outputBytes',
+                'Number of bytes in the files written by a pipeline stage')]
+
+# Start recording metrics
+def configure(metricsDir, script, runId=None):
+    '''
+    This function starts recording the metrics of script to metricsDir, with records
+    from this run marked by runId. Metrics are not recorded if metricsDir is None.
+    '''
+    metricsState['metricsDir'] = metricsDir
+    metricsState['script'] = script
+    metricsState['stack'] = []
+    if metricsDir is None:
+        return
+
+    os.makedirs(metricsDir, exist_ok=True)
+    if runId is None:
+        runId = script+'-'+datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')+'-'+str(os.getpid())
+    metricsState['runId'] = runId
+    logger.info('Record metrics of run '+runId+' in '+metricsDir+'.')
+
+# Get the JSON-lines metrics file
+def getMetricsPathFile():
+    '''
+    This function returns the JSON-lines metrics file of the script
+    '''
+    return os.path.join(metricsState['metricsDir'], metricsState['script']+'_metrics.jsonl')
+
+# Get the Prometheus textfile
+def getPromPathFile():
+    '''
+    This function returns the Prometheus textfile collector file of the script
+    '''
+    return os.path.join(metricsState['metricsDir'], metricsState['script']+'.prom')
+
+# Get the peak RSS of this process
+def getPeakMemory():
+    '''
+    This function returns the peak resident set size of this process in bytes, since
+    it was last reset by resetPeakMemory
+    '''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+# Reset the peak RSS of this process
+def resetPeakMemory():
+    '''
+    This function resets the peak resident set size of this process to its current
+    resident set size, which Linux supports with /proc/self/clear_refs
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clearRefs:
+            clearRefs.write('5')
+    except OSError:
+        pass
+
+# Get the number of bytes in files
+def getBytes(pathFiles):
+    '''
+    This function returns the total size of the files in pathFiles, and of the files
+    in any directory in pathFiles
+    '''
+    total = 0
+    for pathFile in pathFiles:
+        if os.path.isdir(pathFile):
+            for root, dirs, files in os.walk(pathFile):
+                total = total + sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        elif os.path.exists(pathFile):
+            total = total + os.path.getsize(pathFile)
+
+    return total
+
+# Measure a stage
+@contextmanager
+def measure(stage, **labels):
+    '''
+    This function measures the wall time and peak memory of the code run in its with
+    block, and writes them to the metrics file with labels. The with block can set
+    pixels, nodataPixels and outputPathFiles in the record it gets. Stages can be nested,
+    and the peak memory of a stage includes the stages inside it.
+    '''
+    record = {'stage': stage, 'pixels': None, 'nodataPixels': None, 'outputPathFiles': []}
+    record.update(labels)
+    if metricsState['metricsDir'] is None:
+        yield record
+        return
+
+    # Keep the peak memory of the enclosing stage before the peak is reset
+    stack = metricsState['stack']
+    if stack:
+        stack[-1]['peak'] = max(stack[-1]['peak'], getPeakMemory())
+    resetPeakMemory()
+    stack.append({'peak': 0})
+    status = 'ok'
+    startTime = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        seconds = time.perf_counter()-startTime
+        peak = max(getPeakMemory(), stack.pop()['peak'])
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        writeRecord(record, seconds, peak, status)
+
+# Write a record to the metrics file
+def writeRecord(record, seconds, peak, status):
+    '''
+    This function appends a record to the JSON-lines metrics file. Each record is written
+    in one append, so records from worker processes are not mixed.
+    '''
+    record = dict(record)
+    outputPathFiles = record.pop('outputPathFiles')
+    nodataPixels = record.pop('nodataPixels')
+    record.update({'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+                   'run': metricsState['runId'], 'script': metricsState['script'],
+                   'pid': os.getpid(), 'status': status, 'seconds': round(seconds, 6),
+                   'peakMemoryBytes': peak, 'outputBytes': getBytes(outputPathFiles)})
+    if record['pixels'] and nodataPixels is not None:
+        record['nodataFraction'] = nodataPixels/record['pixels']
+    else:
+        record['nodataFraction'] = None
+
+    with open(getMetricsPathFile(), 'a') as metricsFile:
+        metricsFile.write(json.dumps(record)+'\n')
+
+# Escape a Prometheus label value
+def escapeLabel(value):
+    '''
+    This function escapes backslashes, double quotes and new lines in a label value
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Write the Prometheus textfile of this run
+def writePrometheus():
+    '''
+    This function writes the records of this run, from every process, to the Prometheus
+    textfile collector file. The file is written to a temporary file and renamed, so the
+    collector never reads a partial file.
+    '''
+    if metricsState['metricsDir'] is None:
+        return
+
+    records = []
+    if os.path.exists(getMetricsPathFile()):
+        with open(getMetricsPathFile()) as metricsFile:
+            for line in metricsFile:
+                record = json.loads(line)
+                if record.get('run') == metricsState['runId']:
+                    records.append(record)
+
+    lines = []
+    for name, field, description in promMetrics:
+        lines.append('# HELP '+name+' '+description)
+        lines.append('# TYPE '+name+' gauge')
+        for record in records:
+            if record.get(field) is None:
+                continue
+            labels = ','.join(label+'="'+escapeLabel(record[label])+'"' for label in promLabels
+                              if record.get(label) is not None)
+            lines.append(name+'{'+labels+'} '+repr(float(record[field])))
+
+    lines.append('# HELP adcirc2cog_run_timestamp_seconds Time the run finished')
+    lines.append('# TYPE adcirc2cog_run_timestamp_seconds gauge')
+    lines.append('adcirc2cog_run_timestamp_seconds{script="'+
+                 escapeLabel(metricsState['script'])+'"} '+repr(time.time()))
+
+    tmpPathFile = getPromPathFile()+'.tmp'+str(os.getpid())
+    with open(tmpPathFile, 'w') as promFile:
+        promFile.write('\n'.join(lines)+'\n')
+    os.replace(tmpPathFile, getPromPathFile())
+    logger.info('Wrote '+str(len(records))+' metrics records to '+getPromPathFile()+'.')
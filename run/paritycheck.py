@@ -0,0 +1,175 @@
+'''
+paritycheck.py renders an ADCIRC file with both the qgis and numpy engines of
+adcirc2geotiff.py, and checks the rasters agree: the same grid, the same nodata mask,
+and values within a tolerance where both have data.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import sys
+import glob
+import json
+import argparse
+import shutil
+
+import numpy as np
+import rasterio
+from loguru import logger
+
+import adcirc2geotiff
+
+# Read a block of a raster as values
+def readBlock(src, window):
+    '''
+    This function returns the values of a window of a raster, scaled by its scale and
+    offset, with NaN where the raster has no data
+    '''
+    block = src.read(1, window=window, masked=True).astype(np.float64)
+    return np.ma.filled(block*src.scales[0] + src.offsets[0], np.nan)
+
+# Compare the rasters of the two engines
+def compareRasters(numpyPathFile, qgisPathFile):
+    '''
+    This function returns the comparison of a raster rendered by the numpy engine with
+    the one rendered by the qgis engine: if the grids match, the number of pixels whose
+    nodata mask differs, and the largest absolute difference where both have data. The
+    rasters are read one block at a time.
+    '''
+    with rasterio.open(numpyPathFile) as numpySrc, rasterio.open(qgisPathFile) as qgisSrc:
+        result = {'output': os.path.basename(numpyPathFile),
+                  'pixels': numpySrc.width*numpySrc.height,
+                  'gridMatch': numpySrc.width == qgisSrc.width and
+                               numpySrc.height == qgisSrc.height and
+                               numpySrc.crs == qgisSrc.crs and
+                               numpySrc.transform.almost_equals(qgisSrc.transform),
+                  'maskMismatch': None, 'maxAbsDiff': None}
+        if not result['gridMatch']:
+            return result
+
+        maskMismatch = 0
+        maxAbsDiff = 0.0
+        for ij, window in numpySrc.block_windows(1):
+            numpyValues = readBlock(numpySrc, window)
+            qgisValues = readBlock(qgisSrc, window)
+            numpyMask = ~np.isfinite(numpyValues)
+            qgisMask = ~np.isfinite(qgisValues)
+            maskMismatch = maskMismatch + int((numpyMask != qgisMask).sum())
+            valid = ~numpyMask & ~qgisMask
+            if valid.any():
+                maxAbsDiff = max(maxAbsDiff, float(np.abs(numpyValues[valid] -
+                                                          qgisValues[valid]).max()))
+
+    result.update({'maskMismatch': maskMismatch, 'maxAbsDiff': maxAbsDiff})
+    return result
+
+# Render an input file with one engine
+def renderEngine(inputDirPath, inputFilename, outputDirPath, engine):
+    '''
+    This function renders inputFilename to GeoTiff files in outputDirPath with engine,
+    with the default options, as adcirc2geotiff.py does, and returns the output directory
+    of the file
+    '''
+    shutil.rmtree(outputDirPath, ignore_errors=True)
+    logger.info('Render '+inputDirPath+inputFilename+' with the '+engine+' engine.')
+    adcirc2geotiff.convertFiles(inputDirPath, outputDirPath, [inputFilename], engine,
+                                dict(adcirc2geotiff.defaultOptions))
+    return adcirc2geotiff.getOutputDir(outputDirPath, inputFilename)
+
+@logger.catch
+def main(**kwargs):
+    '''
+    This is the main function of paritycheck.py. It renders the input file with both
+    engines, compares every output, saves the comparison to resultsPathFile, and exits
+    with an error if any output is outside the tolerances.
+    '''
+    numpyDir = renderEngine(kwargs['inputDirPath'], kwargs['inputFilename'],
+                            kwargs['workDirPath']+'numpy/', 'numpy')
+
+    app = adcirc2geotiff.startQgis(adcirc2geotiff.getTmpDir(kwargs['inputDirPath'],
+                                                            kwargs['inputFilename']))
+    try:
+        qgisDir = renderEngine(kwargs['inputDirPath'], kwargs['inputFilename'],
+                               kwargs['workDirPath']+'qgis/', 'qgis')
+    finally:
+        app.exitQgis()
+
+    results = []
+    failed = []
+    for numpyPathFile in sorted(glob.glob(numpyDir+'*.tif')):
+        qgisPathFile = qgisDir+os.path.basename(numpyPathFile)
+        if not os.path.exists(qgisPathFile):
+            logger.error('The qgis engine did not write '+qgisPathFile)
+            failed.append(os.path.basename(numpyPathFile))
+            continue
+
+        result = compareRasters(numpyPathFile, qgisPathFile)
+        result['pass'] = (result['gridMatch'] and
+                          result['maskMismatch'] <= kwargs['maskTolerance']*result['pixels'] and
+                          result['maxAbsDiff'] <= kwargs['tolerance'])
+        results.append(result)
+        logger.info('Compared '+result['output']+': grid match '+str(result['gridMatch'])+
+                    ', '+str(result['maskMismatch'])+' of '+str(result['pixels'])+
+                    ' pixels with a different nodata mask, largest difference '+
+                    str(result['maxAbsDiff'])+'.')
+        if not result['pass']:
+            failed.append(result['output'])
+
+    with open(kwargs['resultsPathFile'], 'w') as resultsFile:
+        json.dump({'input': kwargs['inputDirPath']+kwargs['inputFilename'],
+                   'tolerance': kwargs['tolerance'], 'maskTolerance': kwargs['maskTolerance'],
+                   'results': results}, resultsFile, indent=2)
+    logger.info('Saved parity results to '+kwargs['resultsPathFile']+'.')
+
+    if failed or not results:
+        logger.error('The engines do not agree on '+str(len(failed))+' outputs: '+
+                     ', '.join(failed))
+        sys.exit(1)
+    logger.info('The engines agree on all '+str(len(results))+' outputs.')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    # Optional argument which requires a parameter (eg. -d test)
+    parser.add_argument("--inputDIR", "--inputDir", help="Input directory path",
+                        action="store", dest="inputDir", required=True)
+    parser.add_argument("--inputFILE", "--inputFile", help="Input file name, an ADCIRC "
+                        "netCDF file QGIS can open", action="store", dest="inputFile",
+                        required=True)
+    parser.add_argument("--workDIR", "--workDir", help="Work directory path for the "
+                        "rasters of each engine", action="store", dest="workDir", required=True)
+    parser.add_argument("--resultsFILE", "--resultsFile", help="JSON results file path, "
+                        "parity.json in the work directory by default", action="store",
+                        dest="resultsFile", default=None)
+    parser.add_argument("--tolerance", help="Largest absolute difference of a value where "
+                        "both engines have data", action="store", dest="tolerance",
+                        type=float, default=1e-5)
+    parser.add_argument("--maskTolerance", help="Largest fraction of the pixels of a raster "
+                        "whose nodata mask may differ", action="store", dest="maskTolerance",
+                        type=float, default=1e-6)
+    arguments = parser.parse_args()
+
+    # Remove old logger and start new one
+    logger.remove()
+    log_path = os.path.join(os.getenv('LOG_PATH',
+                                      os.path.join(os.path.dirname(__file__), 'logs')), '')
+    logger.add(log_path+'paritycheck.log', level='DEBUG', rotation="1 MB")
+    logger.add(sys.stdout, level="INFO")
+    logger.add(sys.stderr, level="ERROR")
+    logger.info('Started log file paritycheck.log')
+
+    workDir = os.path.join(arguments.workDir, '')
+    os.makedirs(workDir, exist_ok=True)
+    resultsFile = arguments.resultsFile
+    if resultsFile is None:
+        resultsFile = workDir+'parity.json'
+
+    main(inputDirPath = os.path.join(arguments.inputDir, ''), inputFilename = arguments.inputFile,
+         workDirPath = workDir, resultsPathFile = resultsFile, tolerance = arguments.tolerance,
+         maskTolerance = arguments.maskTolerance)
@@ -0,0 +1,162 @@
+'''
+weightcache.py stores the pixel to triangle interpolation weights computed by
+meshraster.py on disk, so a mesh is only searched once for each raster grid.
+'''
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import os
+import shutil
+import hashlib
+
+import numpy as np
+from loguru import logger
+
+import meshraster
+
+# Names of the files in each cache entry
+elemIndexFile = 'elemIndex.npy'
+weightsFile = 'weights.npy'
+
+# Version of the weights computation and entry files, which is part of the cache key.
+# Increment it when meshraster.computeWeights or the entry files change, so entries
+# written by older code are not used.
+cacheVersion = 1
+
+# Hash the mesh topology and node coordinates
+def getMeshHash(mesh):
+    '''
+    This function returns a sha256 hash of the mesh connectivity and coordinates,
+    which is computed once and kept in the mesh dictionary
+    '''
+    if 'hash' not in mesh:
+        sha = hashlib.sha256()
+        for name in ['x', 'y', 'element']:
+            sha.update(np.ascontiguousarray(mesh[name]).tobytes())
+        mesh['hash'] = sha.hexdigest()
+
+    return mesh['hash']
+
+# Define the cache key for a mesh and raster grid
+def getCacheKey(mesh, grid):
+    '''
+    This function returns the cache key for a mesh, extent and resolution, and the
+    cache version
+    '''
+    sha = hashlib.sha256(getMeshHash(mesh).encode())
+    sha.update(('version'+str(cacheVersion)).encode())
+    sha.update(repr((grid['xmin'], grid['xmax'], grid['ymin'], grid['ymax'],
+                     grid['width'], grid['height'])).encode())
+    if grid['crs'] != 'EPSG:4326':
+        sha.update(grid['crs'].encode())
+    return sha.hexdigest()
+
+# Load weights from the cache
+def loadWeights(cacheDir, key):
+    '''
+    This function memory maps the element index and weights for a key, and returns
+    None if the key is not in the cache
+    '''
+    entryDir = os.path.join(cacheDir, key)
+    try:
+        elemIndex = np.load(os.path.join(entryDir, elemIndexFile), mmap_mode='r')
+        weights = np.load(os.path.join(entryDir, weightsFile), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+    # Touch the entry so eviction removes the least recently used entries first
+    os.utime(entryDir)
+    logger.info('Loaded weights '+key+' from cache '+cacheDir+'.')
+    return elemIndex, weights
+
+# Compute weights into the cache
+def buildWeights(cacheDir, key, mesh, grid, windows, chunkSize):
+    '''
+    This function computes the element index and weights for a key window by window,
+    into memory mapped files, so memory use does not grow with the grid size. The entry
+    is written to a temporary directory and renamed, so concurrent runs never see
+    partial entries.
+    '''
+    entryDir = os.path.join(cacheDir, key)
+    tmpDir = entryDir+'.tmp'+str(os.getpid())
+    os.makedirs(tmpDir, exist_ok=True)
+    elemIndex = np.lib.format.open_memmap(os.path.join(tmpDir, elemIndexFile), mode='w+',
+                                          dtype=np.int32, shape=(grid['height'], grid['width']))
+    weights = np.lib.format.open_memmap(os.path.join(tmpDir, weightsFile), mode='w+',
+                                        dtype=np.float32,
+                                        shape=(grid['height'], grid['width'], 3))
+
+    for row0, col0, nrows, ncols in windows:
+        (elemIndex[row0:row0+nrows, col0:col0+ncols],
+         weights[row0:row0+nrows, col0:col0+ncols]) = meshraster.computeWeights(
+            mesh, grid['xs'][col0:col0+ncols], grid['ys'][row0:row0+nrows], chunkSize)
+
+        # Flush each window, so its pages are clean and can be reclaimed
+        elemIndex.flush()
+        weights.flush()
+
+    elemIndex = weights = None
+
+    try:
+        os.rename(tmpDir, entryDir)
+        logger.info('Saved weights '+key+' to cache '+cacheDir+'.')
+    except OSError:
+        # Another run saved the same entry first
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+# Get the size of a cache entry
+def getEntrySize(entryDir):
+    '''
+    This function returns the number of bytes in a cache entry
+    '''
+    return sum(os.path.getsize(os.path.join(entryDir, name)) for name in os.listdir(entryDir))
+
+# Remove least recently used entries until the cache fits in maxBytes
+def evictCache(cacheDir, maxBytes, keep=None):
+    '''
+    This function removes the least recently used cache entries, other than keep,
+    until the total size of the cache is at most maxBytes
+    '''
+    entries = []
+    for name in os.listdir(cacheDir):
+        entryDir = os.path.join(cacheDir, name)
+        if os.path.isdir(entryDir) and '.tmp' not in name:
+            entries.append((os.path.getmtime(entryDir), getEntrySize(entryDir), entryDir))
+
+    totalBytes = sum(entry[1] for entry in entries)
+    for mtime, size, entryDir in sorted(entries):
+        if totalBytes <= maxBytes:
+            break
+        if os.path.basename(entryDir) == keep:
+            continue
+        shutil.rmtree(entryDir, ignore_errors=True)
+        totalBytes = totalBytes - size
+        logger.info('Evicted cache entry '+entryDir+'.')
+
+# Get weights from the cache
+def getWeights(mesh, grid, cacheDir, maxBytes=None, windows=None,
+               chunkSize=meshraster.candidateChunkSize):
+    '''
+    This function returns memory mapped element index and weights for a raster grid
+    from the cache, computing them window by window and saving them on a cache miss
+    '''
+    os.makedirs(cacheDir, exist_ok=True)
+    key = getCacheKey(mesh, grid)
+    cached = loadWeights(cacheDir, key)
+    if cached is not None:
+        return cached
+
+    if windows is None:
+        windows = [(0, 0, grid['height'], grid['width'])]
+    buildWeights(cacheDir, key, mesh, grid, windows, chunkSize)
+
+    if maxBytes is not None:
+        evictCache(cacheDir, maxBytes, keep=key)
+
+    return loadWeights(cacheDir, key)
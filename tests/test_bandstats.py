@@ -0,0 +1,61 @@
+'''
+test_bandstats.py tests that the band statistics merged from parts of a raster, as the
+shard merge does, match the statistics computed from the whole raster.
+'''
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import numpy as np
+import rasterio
+
+import bandstats
+import cogutils
+
+# Merge the summaries of the row bands of a raster
+def test_merge_summaries(tmp_path):
+    '''
+    This function tests that mergeSummaries of the row bands of a raster, with the
+    histogram range of the whole raster, matches computeSummary of the raster
+    '''
+    rng = np.random.default_rng(0)
+    values = rng.normal(1.5, 0.7, (300, 200))
+    values[rng.random(values.shape) < 0.3] = np.nan
+    values[:40] = np.nan
+
+    pathFile = str(tmp_path/'raster.tif')
+    profile = dict(cogutils.getStagingProfile(blockSize=64), width=200, height=300, count=1,
+                   dtype='float64', nodata=float('nan'), crs='EPSG:4326',
+                   transform=rasterio.transform.from_origin(0, 3, 0.01, 0.01))
+    with rasterio.open(pathFile, 'w', **profile) as dst:
+        dst.write(values, 1)
+    expected = bandstats.computeSummary(pathFile, blockSize=64)
+
+    valueMin, valueMax = bandstats.getValueRange(values)
+    summaries = []
+    for row0, row1 in [(0, 40), (40, 128), (128, 300)]:
+        stats = bandstats.newStats(valueMin, valueMax)
+        bandstats.updateStats(stats, values[row0:row1])
+        summaries.append(bandstats.getSummary(stats, (row1 - row0)*200))
+    merged = bandstats.mergeSummaries(summaries, 300*200)
+
+    assert merged['count'] == expected['count']
+    assert merged['validPercent'] == expected['validPercent']
+    assert merged['minimum'] == expected['minimum']
+    assert merged['maximum'] == expected['maximum']
+    assert np.isclose(merged['mean'], expected['mean'], rtol=1e-12)
+    assert np.isclose(merged['stdDev'], expected['stdDev'], rtol=1e-12)
+    assert merged['histogram'] == expected['histogram']
+    assert merged['percentiles'] == expected['percentiles']
+
+# Get the range of no values
+def test_value_range_empty():
+    '''
+    This function tests that the range of no values, or of only NaN, is NaN
+    '''
+    assert np.isnan(bandstats.getValueRange(np.zeros(0))).all()
+    assert np.isnan(bandstats.getValueRange(np.array([np.nan, np.nan]))).all()
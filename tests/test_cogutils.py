@@ -0,0 +1,54 @@
+'''
+test_cogutils.py tests the encoding of raster values in the output data types of
+cogutils.py.
+'''
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import numpy as np
+import pytest
+
+import cogutils
+
+# Round trip values through an integer encoding
+@pytest.mark.parametrize('dataType', ['int16', 'uint16'])
+def test_encode_integer_round_trip(dataType):
+    '''
+    This function tests that values encoded in an integer type decode to within half
+    the scale, that NaN is encoded as nodata, and that clipped values are counted
+    '''
+    offset = -5.0 if dataType == 'uint16' else 0.0
+    encoding = cogutils.getEncoding(dataType, scale=0.01, offset=offset)
+    block = np.array([[-2.345, 0.0, np.nan], [1.005, 4.999, 1000.0]])
+    encoded, clipped = cogutils.encodeBlock(block, encoding)
+
+    assert encoded.dtype == np.dtype(dataType)
+    assert clipped == 1
+    assert encoded[0, 2] == encoding['nodata']
+    decoded = encoded.astype(np.float64)*encoding['scale'] + encoding['offset']
+    valid = np.isfinite(block) & (block < 100)
+    assert np.all(np.abs(decoded[valid] - block[valid]) <= encoding['scale']/2 + 1e-9)
+
+    # Clipped values stay out of the nodata value
+    highest = np.iinfo(dataType).max
+    assert encoded[1, 2] == (highest - 1 if encoding['nodata'] == highest else highest)
+
+# Round trip values through a float encoding
+@pytest.mark.parametrize('dataType', ['float64', 'float32'])
+def test_encode_float_round_trip(dataType):
+    '''
+    This function tests that float encodings keep the values, and NaN as nodata
+    '''
+    encoding = cogutils.getEncoding(dataType)
+    block = np.array([[-2.345, np.nan], [1.0e-3, 12.5]])
+    encoded, clipped = cogutils.encodeBlock(block, encoding)
+
+    assert encoded.dtype == np.dtype(dataType)
+    assert clipped == 0
+    assert np.array_equal(np.isnan(encoded), np.isnan(block))
+    assert np.allclose(encoded[~np.isnan(block)], block[~np.isnan(block)], rtol=1e-7)
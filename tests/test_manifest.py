@@ -0,0 +1,37 @@
+'''
+test_manifest.py tests that the manifests manifest.py writes are read back as complete,
+so a rerun with --resume skips their outputs.
+'''
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import manifest
+import cogutils
+
+# Write a manifest with NaN nodata
+def test_manifest_nan_nodata(tmp_path):
+    '''
+    This function tests that a manifest with a NaN nodata value and tuples matches when
+    it is read back, and does not match once the manifest or output changes
+    '''
+    outputPathFile = str(tmp_path/'maxele.subset0.raw.63.tif')
+    with open(outputPathFile, 'wb') as outputFile:
+        outputFile.write(b'tiff')
+    outputManifest = {'input': 'maxele.63.nc', 'extent': '-97.85833,-82.288499,32.0,45.83612',
+                      'encoding': cogutils.getEncoding('float32'), 'window': (0, 0, 512, 512)}
+
+    manifest.writeManifest(outputPathFile, outputManifest)
+    assert manifest.isComplete(outputPathFile, outputManifest)
+    assert not manifest.isComplete(outputPathFile, dict(outputManifest, extent='0,1,0,1'))
+
+    with open(outputPathFile, 'ab') as outputFile:
+        outputFile.write(b'more')
+    assert not manifest.isComplete(outputPathFile, outputManifest)
+
+    manifest.removeManifest(outputPathFile)
+    assert not manifest.isComplete(outputPathFile, outputManifest)
@@ -0,0 +1,125 @@
+'''
+test_meshraster.py tests the raster grids and the interpolation of meshraster.py, on
+meshes built by hand.
+'''
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import numpy as np
+
+import meshraster
+
+# Build a unit square mesh of two triangles
+def getSquareMesh():
+    '''
+    This function returns a mesh of the unit square split into two triangles along
+    its diagonal
+    '''
+    return {'x': np.array([0.0, 1.0, 1.0, 0.0]), 'y': np.array([0.0, 0.0, 1.0, 1.0]),
+            'element': np.array([[0, 1, 2], [0, 2, 3]], dtype=np.int32)}
+
+# Interpolate a linear function on the square mesh
+def test_interpolate_linear():
+    '''
+    This function tests that barycentric interpolation of a linear function is exact
+    inside the mesh, and NaN outside it
+    '''
+    mesh = getSquareMesh()
+    values = 1.0 + 2.0*mesh['x'] + 3.0*mesh['y']
+    grid = meshraster.getGrid('-0.5,1.5,-0.5,1.5', 0.125)
+    elemIndex, weights = meshraster.computeWeights(mesh, grid['xs'], grid['ys'])
+    raster = meshraster.interpolate(mesh, values, elemIndex, weights)
+
+    xs, ys = np.meshgrid(grid['xs'], grid['ys'])
+    inside = (xs > 0) & (xs < 1) & (ys > 0) & (ys < 1)
+    assert np.array_equal(np.isfinite(raster), inside)
+    assert np.allclose(raster[inside], 1.0 + 2.0*xs[inside] + 3.0*ys[inside], atol=1e-6)
+    assert set(np.unique(elemIndex[inside])) == {0, 1}
+
+# Interpolate with a NaN node value
+def test_interpolate_nan_node():
+    '''
+    This function tests that the pixels of the elements of a NaN node value are NaN
+    '''
+    mesh = getSquareMesh()
+    values = np.array([1.0, 1.0, 1.0, np.nan])
+    grid = meshraster.getGrid('0,1,0,1', 0.125)
+    elemIndex, weights = meshraster.computeWeights(mesh, grid['xs'], grid['ys'])
+    raster = meshraster.interpolate(mesh, values, elemIndex, weights)
+
+    assert np.all(np.isnan(raster[elemIndex == 1]))
+    assert np.all(raster[elemIndex == 0] == 1.0)
+
+# Check a grid has square pixels on whole multiples of its pixel size
+def test_grid_nests():
+    '''
+    This function tests that getGrid covers the extent with square pixels, starting at
+    whole multiples of the pixel size, so grids of pixel sizes that are powers of two
+    apart line up, and that getGridSize agrees with it
+    '''
+    extent = '-97.85833,-82.288499,32.0,45.83612'
+    fine = meshraster.getGrid(extent, 0.001)
+    coarse = meshraster.getGrid(extent, 0.016)
+    for grid, mapUnitPP in [(fine, 0.001), (coarse, 0.016)]:
+        assert grid['resX'] == grid['resY'] == mapUnitPP
+        assert grid['xmin'] <= -97.85833 and grid['xmax'] >= -82.288499
+        assert grid['ymin'] <= 32.0 and grid['ymax'] >= 45.83612
+        assert np.isclose(grid['xmax'] - grid['xmin'], grid['width']*mapUnitPP)
+        assert grid['width']*grid['height'] == meshraster.getGridSize(extent, mapUnitPP)
+
+    offset = np.array([coarse['xmin'] - fine['xmin'], fine['ymax'] - coarse['ymax']])/0.001
+    assert np.allclose(offset, np.round(offset), atol=1e-6)
+
+# Check the Web Mercator grid is on the tile grid
+def test_mercator_grid():
+    '''
+    This function tests that getMercatorGrid covers the extent with whole tiles of the
+    chosen zoom level, with its pixel center longitudes and latitudes inside the grid
+    '''
+    extent = '-82.3,-74.0,24.28441,36.555922'
+    grid = meshraster.getMercatorGrid(extent, 0.005, zoom=8)
+    worldSize = 2*np.pi*meshraster.mercatorRadius
+    cellSize = worldSize/(meshraster.mercatorTileSize*2**8)
+
+    assert grid['resX'] == grid['resY'] == cellSize
+    assert grid['width'] % meshraster.mercatorTileSize == 0
+    assert grid['height'] % meshraster.mercatorTileSize == 0
+    assert len(grid['xs']) == grid['width'] and len(grid['ys']) == grid['height']
+    tileSpan = cellSize*meshraster.mercatorTileSize
+    tiles = (np.array([grid['xmin'], grid['ymax']]) + worldSize/2)/tileSpan
+    assert np.allclose(tiles, np.round(tiles))
+
+    left, bottom = meshraster.lonLatToMercator(-82.3, 24.28441)
+    right, top = meshraster.lonLatToMercator(-74.0, 36.555922)
+    assert grid['xmin'] <= left and grid['xmax'] >= right
+    assert grid['ymin'] <= bottom and grid['ymax'] >= top
+
+    # The zoom level is chosen from the resolution when it is not given. 0.005 degrees
+    # is about 640 m in Web Mercator at these latitudes, and zoom 8 cells are 611 m.
+    assert meshraster.getMercatorGrid(extent, 0.005)['zoom'] == 8
+
+# Check QGIS samples the pixel centers of a window
+def test_window_extent():
+    '''
+    This function tests that the extent getWindowExtent gives exportRasterBlock has the
+    window size, and that the top left corners QgsMapToPixel samples on it are the pixel
+    centers of the window
+    '''
+    grid = meshraster.getGrid('-82.5,-60.04,36.0,45.83612', 0.005)
+    for window in [(0, 0, 512, 512), (1536, 2048, 431, 395)]:
+        row0, col0, nrows, ncols = window
+        xmin, ymin, xmax, ymax = meshraster.getWindowExtent(grid, window)
+        width = int((xmax - xmin)/grid['resX'])
+        height = int((ymax - ymin)/grid['resY'])
+        assert (height, width) == (nrows, ncols)
+
+        sampleXs = (xmin + xmax)/2 + (np.arange(width) - width/2)*grid['resX']
+        sampleYs = (ymin + ymax)/2 - (np.arange(height) - height/2)*grid['resY']
+        tolerance = 1e-6*grid['resX']
+        assert np.allclose(sampleXs, grid['xs'][col0:col0+ncols], rtol=0, atol=tolerance)
+        assert np.allclose(sampleYs, grid['ys'][row0:row0+nrows], rtol=0, atol=tolerance)
@@ -0,0 +1,63 @@
+'''
+test_shardplan.py tests how adcirc2geotiff.py gives out the work units of a shard plan
+to the shards.
+'''
+
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+# Import Python modules
+import adcirc2geotiff
+
+# Build a plan of work units
+def getPlan():
+    '''
+    This function returns a plan with the outputs of two timesteps of two extents, split
+    into row bands of different sizes
+    '''
+    outputs = {}
+    units = []
+    for subset, width in enumerate([1557, 16858]):
+        for timeStep in [0, 1]:
+            output = 'fort.subset'+str(subset)+'.raw.'+str(timeStep)+'.63.tif'
+            outputs[output] = {'inputList': ['/data/', 'fort.63.nc', '/out/', output,
+                                             '0,1,0,1', timeStep, 0.001]}
+            for row0 in range(0, 5000 if subset else 1384, 2048):
+                rows = min(2048, (5000 if subset else 1384) - row0)
+                units.append({'id': output[:-4]+'.rows'+str(row0).zfill(6)+'.tif',
+                              'output': output, 'rows': [row0, row0 + rows],
+                              'pixels': rows*width})
+    return {'outputs': outputs, 'units': units}
+
+# Give out the units to the shards
+def test_shard_units_balanced():
+    '''
+    This function tests that every unit is in exactly one shard, the same one every time,
+    and that no shard has more pixels than another by more than the largest unit
+    '''
+    plan = getPlan()
+    shardCount = 3
+    shards = [adcirc2geotiff.getShardUnits(plan, shardIndex, shardCount)
+              for shardIndex in range(shardCount)]
+
+    unitIds = [unit['id'] for shard in shards for unit in shard]
+    assert sorted(unitIds) == sorted(unit['id'] for unit in plan['units'])
+    assert shards == [adcirc2geotiff.getShardUnits(getPlan(), shardIndex, shardCount)
+                      for shardIndex in range(shardCount)]
+
+    loads = [sum(unit['pixels'] for unit in shard) for shard in shards]
+    assert max(loads) - min(loads) <= max(unit['pixels'] for unit in plan['units'])
+
+# Give out the units to more shards than units
+def test_shard_units_more_shards():
+    '''
+    This function tests that shards with no units are empty, and the others have one unit
+    '''
+    plan = getPlan()
+    shardCount = len(plan['units']) + 2
+    shards = [adcirc2geotiff.getShardUnits(plan, shardIndex, shardCount)
+              for shardIndex in range(shardCount)]
+    assert sorted(len(shard) for shard in shards) == [0, 0] + [1]*len(plan['units'])